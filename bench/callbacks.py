@@ -0,0 +1,57 @@
+# ---------------------- ⏱ بنچ مسیریابی callbackها ----------------------
+# زمان پیدا کردن هندلر + تبدیل آرگومان‌ها برای react/sr/ss (پرتکرارترین callbackهای کاربر)،
+# زنجیره‌ی قدیمی regexها (به همان ترتیب ثبت قبلی، با match و groups) در برابر CallbackRouter.resolve.
+# اجرا از ریشه‌ی مخزن:  python bench/callbacks.py [--iters 100000]
+import os, sys, re, time, argparse
+
+for k, v in dict(API_ID="1", API_HASH="x", BOT_TOKEN="1:x", BOT_USERNAME="bench", MONGO_URI="mongodb://localhost:1",
+                 WELCOME_IMAGE="x", CONFIRM_IMAGE="x", ADMIN_IDS="1", REQUIRED_CHANNELS="bench",
+                 TARGET_CHANNELS_JSON="{}", USER_SESSION_STRING="x").items():
+    os.environ.setdefault(k, v)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot  # noqa: E402
+
+_KEYSET = r"(\d+)(?:::([np])::([0-9a-z]+)::([0-9a-f]{24}))?$"
+# الگوهای هندلرها پیش از روتر، به ترتیب ثبت (Pyrogram هندلرهای یک گروه را به همین ترتیب امتحان می‌کرد)
+LEGACY = [
+    r"^check_membership$", r"^more_", r"^sched_yes::(.+)$", r"^sched_no::(.+)$", r"^pub_cancel$", r"^sched_cancel$",
+    r"^sched_pick::(-?\d+)$", r"^film_pub_go::(.+)::(-?\d+)$", r"^admin_home$", r"^admin_films_" + _KEYSET,
+    r"^admin_search$", r"^film_open::(.+)$", r"^film_edit_title::(.+)$", r"^film_edit_genre::(.+)$",
+    r"^film_edit_year::(.+)$", r"^film_replace_cover::(.+)$", r"^film_files::(.+)$", r"^film_file_open::(.+)::(\d+)$",
+    r"^file_edit_caption::(.+)::(\d+)$", r"^file_edit_quality::(.+)::(\d+)$", r"^file_replace::(.+)::(\d+)$",
+    r"^file_delete_confirm::(.+)::(\d+)$", r"^file_delete::(.+)::(\d+)$", r"^film_file_add::(.+)$",
+    r"^film_delete_confirm::(.+)$", r"^film_delete::(.+)$", r"^film_pub_pick::(.+)$", r"^film_sched_start::(.+)$",
+    r"^admin_pending_" + _KEYSET, r"^admin_sched_list_" + _KEYSET, r"^sched_open::([0-9a-f]{24})$",
+    r"^sched_del::([0-9a-f]{24})$", r"^pending_open::(.+)$", r"^pending_send::(.+)::(-?\d+)$", r"^pending_delete::(.+)$",
+    r"^admin_export_csv$", r"^react::(.+)::(-?\d+)::(\d+)$", r"^sr::(-?\d+)::(\d+)$", r"^ss::(-?\d+)::(\d+)$",
+]
+SAMPLES = {"react": "react::love::-1001234567890::4821", "sr": "sr::-1001234567890::4821", "ss": "ss::-1001234567890::4821"}
+
+def legacy_resolve(patterns, data: str):
+    for p in patterns:
+        m = p.match(data)
+        if m:
+            return [int(g) if g.lstrip("-").isdigit() else g for g in m.groups()]
+    return None
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iters", type=int, default=100_000)
+    args = ap.parse_args()
+    patterns = [re.compile(p) for p in LEGACY]
+    router = bot.callbacks
+    print(f"{'route':>6} | {'regex chain':>12} | {'router':>8} | speedup")
+    for name, data in SAMPLES.items():
+        assert legacy_resolve(patterns, data) == router.resolve(data)[1]
+        t0 = time.perf_counter()
+        for _ in range(args.iters):
+            legacy_resolve(patterns, data)
+        old = (time.perf_counter() - t0) / args.iters * 1e6
+        t0 = time.perf_counter()
+        for _ in range(args.iters):
+            router.resolve(data)
+        new = (time.perf_counter() - t0) / args.iters * 1e6
+        print(f"{name:>6} | {old:10.2f}us | {new:6.2f}us | {old / new:5.1f}x")
+
+if __name__ == "__main__":
+    main()
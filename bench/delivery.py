@@ -0,0 +1,61 @@
+# ---------------------- ⏱ بنچ تحویل فایل‌های DeepLink ----------------------
+# تأخیر deliver_film برای فیلم‌های ۱/۱۰/۵۰ فایلی روی یک کلاینت ساختگی (بدون تلگرام و Mongo)،
+# در مقایسه با روش قدیمی «هر فایل یک send_video».
+# اجرا از ریشه‌ی مخزن:  python bench/delivery.py [--send-ms 120] [--album-ms 250] [--per-item-ms 15]
+import os, sys, time, asyncio, argparse, itertools
+from types import SimpleNamespace as NS
+
+for k, v in dict(API_ID="1", API_HASH="x", BOT_TOKEN="1:x", BOT_USERNAME="bench", MONGO_URI="mongodb://localhost:1",
+                 WELCOME_IMAGE="x", CONFIRM_IMAGE="x", ADMIN_IDS="1", REQUIRED_CHANNELS="bench",
+                 TARGET_CHANNELS_JSON="{}", USER_SESSION_STRING="x").items():
+    os.environ.setdefault(k, v)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot  # noqa: E402
+
+class StubClient:
+    """کلاینت ساختگی با تأخیر ثابت برای هر فراخوانی"""
+    def __init__(self, send_ms: float, album_ms: float, per_item_ms: float):
+        self.send = send_ms / 1000; self.album = album_ms / 1000; self.per_item = per_item_ms / 1000
+        self.ids = itertools.count(1); self.calls = 0
+
+    async def send_video(self, chat_id, file_id, **kw):
+        self.calls += 1; await asyncio.sleep(self.send); return NS(id=next(self.ids))
+
+    async def send_message(self, chat_id, text, **kw):
+        self.calls += 1; await asyncio.sleep(self.send); return NS(id=next(self.ids))
+
+    async def send_media_group(self, chat_id, media, **kw):
+        self.calls += 1; await asyncio.sleep(self.album + self.per_item * len(media))
+        return [NS(id=next(self.ids)) for _ in media]
+
+async def per_file(client, chat_id, film):
+    """روش قدیمی: هر فایل جدا و پشت‌سرهم"""
+    for f in film["files"]:
+        await client.send_video(chat_id, f["file_id"], caption=f.get("caption", ""))
+    await client.send_message(chat_id, "⚠️")
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--send-ms", type=float, default=120)
+    ap.add_argument("--album-ms", type=float, default=250)
+    ap.add_argument("--per-item-ms", type=float, default=15)
+    args = ap.parse_args()
+
+    async def _no_delete(chat_id, ids, delay=0):
+        pass
+    bot.delete_wheel.schedule = _no_delete            # صف حذف به Mongo نیاز دارد؛ در بنچ لازم نیست
+
+    print(f"{'files':>5} | {'per-file':>14} | {'deliver_film':>14}")
+    for n in (1, 10, 50):
+        film = {"film_id": "bench", "title": "Bench",
+                "files": [{"file_id": f"f{i}", "quality": "720p", "caption": f"E{i + 1:02d}"} for i in range(n)]}
+        row = []
+        for fn in (per_file, bot.deliver_film):
+            client = StubClient(args.send_ms, args.album_ms, args.per_item_ms)
+            t0 = time.perf_counter()
+            await fn(client, 1, film)
+            row.append(f"{(time.perf_counter() - t0) * 1000:7.0f}ms/{client.calls:>3}c")
+        print(f"{n:>5} | {row[0]:>14} | {row[1]:>14}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+# ---------------------- ⏱ بنچ جست‌وجوی فارسی (SearchIndex) ----------------------
+# ساخت ایندکس معکوس روی N عنوان ساختگی فارسی/لاتین و p50/p95 تأخیر search() برای کوئری‌های کامل/پیشوندی،
+# در کنار اسکن regex روی همه‌ی عنوان‌ها (معادل درون‌حافظه‌ی کوئری $regex قدیمی روی Mongo، بدون شبکه).
+# اجرا از ریشه‌ی مخزن:  python bench/search.py [--titles 50000] [--rounds 200]
+import os, sys, re, time, random, argparse
+from datetime import datetime, timedelta
+
+for k, v in dict(API_ID="1", API_HASH="x", BOT_TOKEN="1:x", BOT_USERNAME="bench", MONGO_URI="mongodb://localhost:1",
+                 WELCOME_IMAGE="x", CONFIRM_IMAGE="x", ADMIN_IDS="1", REQUIRED_CHANNELS="bench",
+                 TARGET_CHANNELS_JSON="{}", USER_SESSION_STRING="x").items():
+    os.environ.setdefault(k, v)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot  # noqa: E402
+
+WORDS  = ["avatar", "star", "war", "night", "dark", "blue", "king", "ring", "lord", "city",
+          "شب", "ماه", "خانه", "سفر", "عشق", "آواتار", "پدر", "جنگ", "ستاره", "دریا", "كلاه", "قرمزي"]
+GENRES = ["drama", "درام", "کمدی", "علمي تخيلي", "اکشن"]
+QUERIES = ["ava", "star war", "شب", "ماه خانه 12", "درام 2001", "k", "night dark blue", "ستار", "کلاه قرمزی", "۱۹۹۹"]
+
+def _pct(lat: list[float], p: float) -> float:
+    return lat[min(len(lat) - 1, int(len(lat) * p))] * 1000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--titles", type=int, default=50_000)
+    ap.add_argument("--rounds", type=int, default=200)
+    args = ap.parse_args()
+
+    rnd = random.Random(1)
+    base = datetime(2020, 1, 1)
+    docs = [{"film_id": f"f{i}", "title": " ".join(rnd.choices(WORDS, k=3)) + f" {i % 977}",
+             "genre": rnd.choice(GENRES), "year": str(1980 + i % 45), "timestamp": base + timedelta(minutes=i)}
+            for i in range(args.titles)]
+
+    ix = bot.SearchIndex()
+    t0 = time.perf_counter()
+    for d in docs:
+        ix.add(d)
+    ix._vocab = sorted(ix._postings); ix.ready = True            # همان کاری که rebuild() بعد از add انجام می‌دهد
+    print(f"build: {args.titles} titles, {len(ix._vocab)} tokens in {time.perf_counter() - t0:.2f}s")
+
+    lat = []
+    for _ in range(args.rounds):
+        for q in QUERIES:
+            t = time.perf_counter(); ix.search(q); lat.append(time.perf_counter() - t)
+    lat.sort()
+    print(f"index: p50 {_pct(lat, .5):.2f}ms • p95 {_pct(lat, .95):.2f}ms • max {lat[-1] * 1000:.2f}ms")
+
+    fields = [(d["title"], d["genre"], d["year"], d["film_id"]) for d in docs]
+    lat = []
+    for _ in range(max(args.rounds // 20, 1)):
+        for q in QUERIES:
+            rx = re.compile(re.escape(q.strip()), re.I)
+            t = time.perf_counter()
+            [f for f in fields if any(rx.search(v) for v in f)]
+            lat.append(time.perf_counter() - t)
+    lat.sort()
+    print(f"regex scan: p50 {_pct(lat, .5):.2f}ms • p95 {_pct(lat, .95):.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# ---------------------- ⏱ بنچ توان عملیاتی /start (DeepLink) ----------------------
+# N درخواست هم‌زمان /start <film_id> روی یک MongoDB واقعی، در دو حالت:
+#   blocking: هر فراخوانی pymongo مستقیم روی حلقه‌ی رویداد (رفتار قبل از لایه‌ی AsyncRepo)
+#   async:    همان فراخوانی‌ها روی Thread Pool (run_db)
+# تلگرام با یک کلاینت ساختگی با تأخیر ثابت شبیه‌سازی می‌شود؛ هر درخواست کاربر و فیلم جدا دارد تا کش‌ها بی‌اثر باشند.
+# داده‌ها در دیتابیس جدا (BENCH_DB، پیش‌فرض upbox_bench) نوشته و آخر کار حذف می‌شوند.
+# اجرا:  MONGO_URI="mongodb+srv://…" python bench/start.py [--hits 200] [--tg-ms 50]
+import os, sys, time, asyncio, argparse, itertools, statistics
+from types import SimpleNamespace as NS
+
+if not os.getenv("MONGO_URI"):
+    sys.exit("❌ MONGO_URI not set (this bench needs a real MongoDB, e.g. your Atlas cluster)")
+os.environ["MONGO_DB"] = os.getenv("BENCH_DB", "upbox_bench")
+for k, v in dict(API_ID="1", API_HASH="x", BOT_TOKEN="1:x", BOT_USERNAME="bench", WELCOME_IMAGE="x",
+                 CONFIRM_IMAGE="x", ADMIN_IDS="1", REQUIRED_CHANNELS="bench_a,bench_b",
+                 TARGET_CHANNELS_JSON="{}", USER_SESSION_STRING="x").items():
+    os.environ.setdefault(k, v)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import bot  # noqa: E402
+
+class StubClient:
+    """کلاینت تلگرام ساختگی: هر فراخوانی tg_ms میلی‌ثانیه طول می‌کشد"""
+    def __init__(self, tg_ms: float):
+        self.delay = tg_ms / 1000; self.ids = itertools.count(1)
+
+    async def get_chat_member(self, chat, uid):
+        await asyncio.sleep(self.delay); return NS(status=bot.ChatMemberStatus.MEMBER)
+
+    async def _send(self, *a, **kw):
+        await asyncio.sleep(self.delay); return NS(id=next(self.ids))
+
+    send_video = send_message = _send
+
+    async def send_media_group(self, chat_id, media, **kw):
+        await asyncio.sleep(self.delay); return [NS(id=next(self.ids)) for _ in media]
+
+class StubMessage:
+    def __init__(self, uid: int, film_id: str):
+        self.text = f"/start {film_id}"
+        self.from_user = NS(id=uid); self.chat = NS(id=uid)
+
+    async def reply(self, *a, **kw): pass
+    reply_photo = reply
+
+async def _blocking_run_db(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+async def run(mode: str, hits: int, tg_ms: float, offset: int) -> list[float]:
+    client = StubClient(tg_ms)
+    lat = []
+
+    async def one(i: int):
+        t0 = time.perf_counter()
+        await bot.start_handler(client, StubMessage(offset + i, f"bench{i}"))
+        lat.append(time.perf_counter() - t0)
+
+    orig = bot.run_db
+    if mode == "blocking":
+        bot.run_db = _blocking_run_db
+    try:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(hits)))
+        wall = time.perf_counter() - t0
+    finally:
+        bot.run_db = orig
+    lat.sort()
+    print(f"{mode:>8} | {wall:6.2f}s | {hits / wall:7.1f} hit/s | p50 {statistics.median(lat) * 1000:6.0f}ms"
+          f" | p95 {lat[int(len(lat) * 0.95) - 1] * 1000:6.0f}ms")
+    return lat
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--hits", type=int, default=200)
+    ap.add_argument("--tg-ms", type=float, default=50)
+    args = ap.parse_args()
+
+    films = [{"film_id": f"bench{i}", "title": f"Bench {i}", "files": [
+        {"film_id": f"bench{i}", "file_id": f"f{i}_{j}", "quality": "720p"} for j in range(3)]} for i in range(args.hits)]
+    bot.films_col.delete_many({}); bot.films_col.insert_many(films)
+    bot.films_col.create_index("film_id", unique=True)
+    try:
+        # برچسب سرور در خروجی تا ارقام گزارش‌شده همیشه به Mongo واقعی (میزبان/نسخه/RTT) نسبت داده شوند
+        t0 = time.perf_counter(); bot.mongo_client.admin.command("ping"); rtt = (time.perf_counter() - t0) * 1000
+        host = ",".join(f"{h}:{p}" for h, p in bot.mongo_client.nodes) or "?"
+        print(f"{args.hits} concurrent /start hits • Telegram {args.tg_ms:.0f}ms/call • db {bot.MONGO_DB_NAME}")
+        print(f"mongo {host} • v{bot.mongo_client.server_info().get('version', '?')} • ping {rtt:.1f}ms")
+        for n, mode in enumerate(("blocking", "async")):
+            bot.film_cache = bot.TTLCache(bot.FILM_CACHE_SIZE)     # هر حالت با کش سرد
+            bot.member_cache = bot.TTLCache(bot.MEMBER_CACHE_SIZE)
+            await run(mode, args.hits, args.tg_ms, offset=(n + 1) * 1_000_000)
+    finally:
+        bot.mongo_client.drop_database(bot.MONGO_DB_NAME)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,14 +2,20 @@
 # نسخه‌ی کامل با یوزربات + انتشار خودکار از کانال‌های منبع + مدیریت کامل
 # تمام بخش‌ها کامنت فارسی دارد تا بدانید هر خط چه می‌کند.
 
-import os, re, json, asyncio, io, csv, unicodedata, string, pathlib, traceback
+import os, sys, re, json, asyncio, io, csv, unicodedata, string, pathlib, traceback, functools, time, heapq, bisect, gzip, shutil, hashlib, socket, contextvars, inspect
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv                            # خواندن متغیرهای .env
 from zoneinfo import ZoneInfo                             # تبدیل دقیق تایم‌زون
 from pyrogram import Client, filters, idle               # هسته Pyrogram (Bot/UserBot)
 from pyrogram.enums import ChatMemberStatus              # برای چک عضویت اجباری
-from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
-from pymongo import MongoClient                           # اتصال به MongoDB
+from pyrogram.errors import UserNotParticipant, FloodWait, MessageNotModified
+from pyrogram.types import (Message, CallbackQuery, ChatMemberUpdated, InlineKeyboardMarkup, InlineKeyboardButton, InputMediaVideo,
+                            InlineQuery, InlineQueryResultArticle, InputTextMessageContent)
+from pymongo import MongoClient, UpdateOne, ReturnDocument, ASCENDING as ASC, DESCENDING as DESC  # اتصال به MongoDB
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from typing import Literal, get_args, get_origin
 from bson import ObjectId
 from apscheduler.schedulers.asyncio import AsyncIOScheduler # زمان‌بندی کارها
 
@@ -64,6 +70,11 @@ REQUIRED_CHANNELS = [x.strip().lstrip("@") for x in _get_env_str("REQUIRED_CHANN
 # مقصدها (کلیدها دلخواه: films/series/animation/… → آیدی کانال)
 TARGET_CHANNELS = {str(k): int(v) for k, v in json.loads(_get_env_str("TARGET_CHANNELS_JSON")).items()}
 
+# چند Worker: هر پروسه WORKER_INDEX خودش را دارد (0..WORKER_COUNT-1)
+WORKER_COUNT = _get_env_int("WORKER_COUNT", required=False, default=1)
+WORKER_INDEX = _get_env_int("WORKER_INDEX", required=False, default=0)
+WORKER_ID    = os.getenv("WORKER_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
 # ---------------------- ⚡️ تنظیمات یوزربات (UserBot) ----------------------
 USER_SESSION_STRING = _get_env_str("USER_SESSION_STRING") # سشن اکانت شخصی
 SOURCE_CHANNELS = [x.strip().lstrip("@") for x in os.getenv("SOURCE_CHANNELS", "").split(",") if x.strip()]  # کانال‌های منبع
@@ -80,10 +91,341 @@ stats_col        = db["stats"]          # آمار (downloads/shares/reactions/
 post_refs        = db["post_refs"]      # نگاشت film_id ↔ (channel_id,message_id)
 pending_posts    = db["pending_posts"]  # موارد Pending برای دسته‌بندی دستی
 reactions_col    = db["reactions"]      # واکنش کاربر به فیلم (یک واکنش در هر فیلم)
+channel_members  = db["channel_members"]# ایندکس عضویت (channel,user_id) → member
+pending_deletes  = db["pending_deletes"]# صف حذف پیام‌های موقت (chat_id,message_id,due_at)
+report_runs      = db["report_runs"]    # زمان تولید هر گزارش روزانه
+stats_buckets    = db["stats_buckets"]  # سطل‌های ساعتی/روزانه‌ی آمار (g,t,film_id,channel_id)
+counters_col     = db["counters"]       # شمارنده‌های اتمیک (film:<slug> → seq)
+film_aliases     = db["film_aliases"]   # film_id قدیمی → جدید (بعد از مهاجرت؛ DeepLinkهای قبلی کار کنند)
+source_fps       = db["source_fingerprints"]  # اثرانگشت پست‌های منبع (file_unique_id / کپشن) برای حذف تکراری
+leases_col       = db["leases"]         # سند رهبری Workerها (owner/expires_at)
+conv_state       = db["conv_state"]     # state فلوهای چندمرحله‌ای ادمین (STATE_BACKEND=mongo)
+
+# ---------------------- 🧵 لایه‌ی async دیتابیس (Repository) ----------------------
+# pymongo بلاک‌کننده است؛ هر فراخوانی روی یک Thread Pool محدود اجرا می‌شود تا
+# تأخیر Atlas حلقه‌ی رویداد Pyrogram را قفل نکند و با I/O تلگرام هم‌پوشانی داشته باشد.
+DB_WORKERS = _get_env_int("DB_WORKERS", required=False, default=16)
+_db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="mongo")
+
+async def run_db(fn, *args, **kwargs):
+    """اجرای یک تابع بلاک‌کننده‌ی دیتابیس روی Thread Pool و await نتیجه"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+class AsyncRepo:
+    """پوسته‌ی async دور یک کالکشن؛ هر متد pymongo (find_one/update_one/…) را await‌پذیر می‌کند"""
+    def __init__(self, col):
+        self.col = col
+
+    def __getattr__(self, name):
+        fn = getattr(self.col, name)
+        async def _call(*args, **kwargs):
+            return await run_db(fn, *args, **kwargs)
+        return _call
+
+    async def find_list(self, flt=None, projection=None, sort=None, skip=0, limit=0):
+        """find + sort/skip/limit؛ کرسر داخل همان Thread کامل خوانده می‌شود"""
+        def _query():
+            cur = self.col.find(flt or {}, projection)
+            if sort:  cur = cur.sort(sort)
+            if skip:  cur = cur.skip(skip)
+            if limit: cur = cur.limit(limit)
+            return list(cur)
+        return await run_db(_query)
+
+    async def aggregate_list(self, pipeline: list):
+        """aggregate و خواندن کامل نتیجه داخل Thread"""
+        return await run_db(lambda: list(self.col.aggregate(pipeline)))
+
+films_repo     = AsyncRepo(films_col)
+sched_repo     = AsyncRepo(scheduled_posts)
+sources_repo   = AsyncRepo(user_sources)
+stats_repo     = AsyncRepo(stats_col)
+refs_repo      = AsyncRepo(post_refs)
+pending_repo   = AsyncRepo(pending_posts)
+reactions_repo = AsyncRepo(reactions_col)
+members_repo   = AsyncRepo(channel_members)
+deletes_repo   = AsyncRepo(pending_deletes)
+report_runs_repo = AsyncRepo(report_runs)
+buckets_repo   = AsyncRepo(stats_buckets)
+counters_repo  = AsyncRepo(counters_col)
+aliases_repo   = AsyncRepo(film_aliases)
+fps_repo       = AsyncRepo(source_fps)
+leases_repo    = AsyncRepo(leases_col)
+states_repo    = AsyncRepo(conv_state)
+
+# ---------------------- 🗂 ایندکس‌ها + ممیزی شکل کوئری‌ها ----------------------
+# هر کالکشن → ایندکس‌هایی که کوئری‌های ربات لازم دارند (create_index idempotent است).
+INDEX_SPECS = {
+    films_col:       [([("film_id", ASC)], {"unique": True}),
+                      ([("timestamp", DESC), ("_id", DESC)], {}),
+                      ([("updated_at", ASC)], {})],
+    stats_col:       [([("film_id", ASC)], {"unique": True}),
+                      ([("downloads", DESC)], {})],
+    post_refs:       [([("film_id", ASC), ("channel_id", ASC)], {"unique": True}),
+                      ([("channel_id", ASC), ("message_id", ASC)], {}),
+                      ([("tier", ASC), ("next_refresh_at", ASC)], {}),
+                      ([("views", DESC)], {})],
+    reactions_col:   [([("film_id", ASC), ("user_id", ASC)], {"unique": True})],
+    scheduled_posts: [([("scheduled_time", ASC), ("_id", ASC)], {})],
+    user_sources:    [([("user_id", ASC)], {"unique": True})],
+    pending_posts:   [([("timestamp", DESC), ("_id", DESC)], {})],
+    channel_members: [([("channel", ASC), ("user_id", ASC)], {"unique": True}),
+                      ([("checked_at", ASC)], {})],
+    pending_deletes: [([("chat_id", ASC), ("message_id", ASC)], {}),
+                      ([("worker", ASC)], {})],
+    stats_buckets:   [([("g", ASC), ("t", ASC), ("film_id", ASC), ("channel_id", ASC)], {"unique": True}),
+                      ([("expire_at", ASC)], {"expireAfterSeconds": 0})],
+    source_fps:      [([("expire_at", ASC)], {"expireAfterSeconds": 0})],
+    conv_state:      [([("expire_at", ASC)], {"expireAfterSeconds": 0})],
+}
+
+def _ensure_indexes_sync():
+    for col, specs in INDEX_SPECS.items():
+        for keys, opts in specs:
+            try:
+                col.create_index(keys, background=True, **opts)
+            except Exception as e:   # مثلاً داده‌ی تکراری روی ایندکس unique
+                print(f"⚠️ index {col.name}{keys}: {e}")
+
+async def ensure_indexes():
+    """ساخت ایندکس‌های لازم در پس‌زمینه (هنگام استارت)"""
+    await run_db(_ensure_indexes_sync)
+    print("🗂 Indexes ensured")
+
+# شکل کوئری‌هایی که ربات واقعاً اجرا می‌کند: (نام، کالکشن، فیلتر، مرتب‌سازی)
+def _query_shapes():
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return [
+        ("film by id",          films_col,       {"film_id": "x"}, None),
+        ("films list",          films_col,       {}, [("timestamp", DESC)]),
+        ("films today",         films_col,       {"timestamp": {"$gte": now, "$lte": now}}, None),
+        ("films changed since", films_col,       {"updated_at": {"$gt": now}}, None),
+        ("members changed since", channel_members, {"checked_at": {"$gt": now}}, None),
+        ("stats by film",       stats_col,       {"film_id": {"$in": ["x"]}}, None),
+        ("ref by post",         post_refs,       {"channel_id": 0, "message_id": 0}, None),
+        ("ref by film",         post_refs,       {"film_id": "x"}, None),
+        ("top viewed post",     post_refs,       {"views": {"$gt": 0}}, [("views", DESC)]),
+        ("refs due (tier)",     post_refs,       {"tier": "warm", "message_id": {"$gt": 0}, "next_refresh_at": {"$not": {"$gt": now}}}, [("next_refresh_at", ASC)]),
+        ("reaction of user",    reactions_col,   {"film_id": "x", "user_id": 0}, None),
+        ("scheduled due",       scheduled_posts, {"scheduled_time": {"$lte": now}}, None),
+        ("user source",         user_sources,    {"user_id": 0}, None),
+        ("pending list",        pending_posts,   {}, [("timestamp", DESC)]),
+        ("members reconcile",   channel_members, {}, [("checked_at", ASC)]),
+        ("deletes by chat",     pending_deletes, {"chat_id": 0, "message_id": {"$in": [0]}}, None),
+        ("buckets in window",   stats_buckets,   {"g": "h", "t": {"$gte": now}}, None),
+    ]
+
+def _has_collscan(plan) -> bool:
+    if isinstance(plan, dict):
+        return plan.get("stage") == "COLLSCAN" or any(_has_collscan(v) for v in plan.values())
+    if isinstance(plan, list):
+        return any(_has_collscan(v) for v in plan)
+    return False
+
+def audit_query_shapes() -> list[str]:
+    """explain() روی هر شکل کوئری و علامت‌گذاری COLLSCAN"""
+    lines = []
+    for name, col, flt, sort in _query_shapes():
+        try:
+            cur = col.find(flt).limit(1)
+            if sort: cur = cur.sort(sort)
+            plan = cur.explain().get("queryPlanner", {}).get("winningPlan", {})
+            lines.append(f"{'❌ COLLSCAN' if _has_collscan(plan) else '✅'} {col.name} • {name}")
+        except Exception as e:
+            lines.append(f"⚠️ {col.name} • {name}: {e}")
+    return lines
+
+# ---------------------- 🧮 بافر شمارنده‌ها (Write-Behind) ----------------------
+# هر دانلود/اشتراک/واکنش به‌جای یک $inc جدا، در حافظه جمع می‌شود و هر STATS_FLUSH_MS
+# میلی‌ثانیه یا بعد از STATS_FLUSH_OPS عملیات با یک bulk_write نوشته می‌شود.
+# حداکثر داده‌ی از دست رفته در کرش = همین بازه‌ی flush؛ در خاموشی عادی flush کامل انجام می‌شود.
+STATS_FLUSH_MS  = _get_env_int("STATS_FLUSH_MS", required=False, default=2000)
+STATS_FLUSH_OPS = _get_env_int("STATS_FLUSH_OPS", required=False, default=500)
+# سطل‌های زمانی همراه همان flush به‌روز می‌شوند؛ سطل ساعتی زودتر با TTL حذف می‌شود و فقط روزانه می‌ماند
+BUCKET_HOURLY_DAYS = _get_env_int("BUCKET_HOURLY_DAYS", required=False, default=14)
+BUCKET_DAILY_DAYS  = _get_env_int("BUCKET_DAILY_DAYS", required=False, default=400)
+
+# سطل‌ها هم‌تراز با ساعت/نیمه‌شب محلی TIMEZONE‌اند (نه UTC): برای آفست‌های غیرساعتی مثل تهران (+03:30)
+# مرز «امروز» گزارش روزانه دقیقاً روی مرز یک سطل می‌افتد.
+_BUCKET_TZ = ZoneInfo(TIMEZONE)
+
+def bucket_start(dt: datetime, g: str) -> datetime:
+    """شروع سطل ساعتی (g=h) یا روزانه (g=d) شامل dt (UTC بدون tz) به وقت محلی، برگردانده به UTC بدون tz"""
+    local = dt.replace(tzinfo=timezone.utc).astimezone(_BUCKET_TZ).replace(minute=0, second=0, microsecond=0)
+    if g == "d":
+        local = local.replace(hour=0)
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+# خطاهای گذرا‌ی یک عملیات در bulk (رقابت upsert / WriteConflict)؛ بقیه دائمی‌اند و دور ریخته می‌شوند
+_RETRYABLE_WRITE_CODES = {11000, 112}
+
+def _retryable_indexes(e: BulkWriteError, label: str) -> list[int]:
+    """اندیس عملیات‌های شکست‌خورده‌ی قابل تکرار در bulk بدون ترتیب؛ خطاهای دائمی فقط لاگ می‌شوند"""
+    retry = []
+    for err in e.details.get("writeErrors", []):
+        if err.get("code") in _RETRYABLE_WRITE_CODES:
+            retry.append(err["index"])
+        else:
+            print(f"⚠️ {label}: dropped op", err.get("code"), err.get("errmsg"))
+    return retry
+
+class CounterBuffer:
+    """جمع‌کردن $incها به تفکیک film_id و flush دوره‌ای با bulk_write"""
+    def __init__(self, interval_ms: int, max_ops: int):
+        self.interval = interval_ms / 1000
+        self.max_ops = max_ops
+        self.pending: dict[str, dict[str, int]] = {}    # film_id → {"downloads": n, "reactions.love": n, …}
+        self.inflight: dict[str, dict[str, int]] = {}   # دسته‌ای که در حال نوشتن است
+        self.buckets: dict[tuple, dict[str, int]] = {}  # (film_id, channel_id, ساعت) → {field: n}
+        self.bucket_retry: list = []                    # عملیات سطل‌های شکست‌خورده‌ی گذرا (هر دانه‌بندی جدا)
+        self.ops = 0
+        self._lock = asyncio.Lock()
+        self._kick = asyncio.Event()
+        self._task = None
+
+    def incr(self, film_id: str, field: str, n: int = 1, channel_id: int = 0):
+        """channel_id=0 یعنی رویداد بدون پست کانالی مشخص (مثل دانلود از DeepLink)"""
+        d = self.pending.setdefault(film_id, {})
+        d[field] = d.get(field, 0) + n
+        hour = bucket_start(datetime.now(timezone.utc).replace(tzinfo=None), "h")
+        self._add_bucket((film_id, channel_id, hour), field, n)
+        self.ops += 1
+        if self.ops >= self.max_ops:
+            self._kick.set()
+
+    def _add_bucket(self, key: tuple, field: str, n: int):
+        b = self.buckets.setdefault(key, {})
+        b[field] = b.get(field, 0) + n
+
+    def _bucket_ops(self, buckets: dict) -> list:
+        ops = []
+        for (fid, ch, hour), inc in buckets.items():
+            for g, t, keep in (("h", hour, BUCKET_HOURLY_DAYS), ("d", bucket_start(hour, "d"), BUCKET_DAILY_DAYS)):
+                ops.append(UpdateOne({"g": g, "t": t, "film_id": fid, "channel_id": ch},
+                                     {"$inc": inc, "$setOnInsert": {"expire_at": t + timedelta(days=keep)}}, upsert=True))
+        return ops
+
+    def delta(self, film_id: str) -> dict[str, int]:
+        """افزایش‌های هنوز نوشته‌نشده (در صف + در حال نوشتن) برای یک فیلم"""
+        out = dict(self.inflight.get(film_id, {}))
+        for k, v in self.pending.get(film_id, {}).items():
+            out[k] = out.get(k, 0) + v
+        return out
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending and not self.buckets and not self.bucket_retry:
+                return
+            self.inflight, self.pending, self.ops = self.pending, {}, 0
+            buckets, self.buckets = self.buckets, {}
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            batch = [(fid, inc) for fid, inc in self.inflight.items() if any(inc.values())]
+            ops = [UpdateOne({"film_id": fid}, {"$inc": inc, "$max": {"last_activity": now}}, upsert=True)
+                   for fid, inc in batch]
+            # در خطای جزئی فقط عملیات‌های شکست‌خورده‌ی گذرا برمی‌گردند؛ بقیه اعمال شده‌اند و تکرارشان شمارش دوباره است
+            try:
+                if ops:
+                    await stats_repo.bulk_write(ops, ordered=False)
+            except BulkWriteError as e:
+                self._requeue([batch[i] for i in _retryable_indexes(e, "stats flush")])
+            except Exception as e:
+                print("⚠️ stats flush error:", e)
+                self._requeue(batch)                      # کل فراخوانی شکست خورد (مثلاً شبکه)
+            finally:
+                self.inflight = {}
+            bops, self.bucket_retry = self.bucket_retry + self._bucket_ops(buckets), []
+            try:
+                if bops:
+                    await buckets_repo.bulk_write(bops, ordered=False)
+            except BulkWriteError as e:
+                self.bucket_retry = [bops[i] for i in _retryable_indexes(e, "bucket flush")]
+            except Exception as e:
+                print("⚠️ bucket flush error:", e)
+                self.bucket_retry = bops
+
+    def _requeue(self, batch: list):
+        """برگرداندن افزایش‌ها به صف برای تلاش بعدی"""
+        for fid, inc in batch:
+            d = self.pending.setdefault(fid, {})
+            for k, v in inc.items():
+                d[k] = d.get(k, 0) + v
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._kick.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._kick.clear()
+            await self.flush()
+
+stats_buffer = CounterBuffer(STATS_FLUSH_MS, STATS_FLUSH_OPS)
+
+Reaction  = Literal["love", "like", "dislike", "sad"]
+REACTIONS = get_args(Reaction)
+_REACT_SUM = {"$add": [{"$ifNull": [f"$reactions.{r}", 0]} for r in REACTIONS]}
+
+async def window_top(start: datetime, end: datetime | None = None, limit: int = 10, channel_id: int | None = None) -> list[dict]:
+    """برترین فیلم‌های یک بازه فقط از روی سطل‌ها (≤۴۸ ساعت ساعتی، بیشتر روزانه)"""
+    end = end or datetime.now(timezone.utc).replace(tzinfo=None)
+    g = "h" if end - start <= timedelta(hours=48) else "d"
+    match = {"g": g, "t": {"$gte": bucket_start(start, g), "$lte": end}}
+    if channel_id is not None:
+        match["channel_id"] = channel_id
+    return await buckets_repo.aggregate_list([
+        {"$match": match},
+        {"$group": {"_id": "$film_id", "downloads": {"$sum": "$downloads"},
+                    "shares": {"$sum": "$shares"}, "reactions": {"$sum": _REACT_SUM}}},
+        {"$sort": {"downloads": -1, "shares": -1, "reactions": -1}},
+        {"$limit": limit},
+    ])
+
+async def window_totals(start: datetime, end: datetime) -> dict:
+    """جمع دانلود/اشتراک/واکنش یک بازه از سطل‌های ساعتی"""
+    agg = await buckets_repo.aggregate_list([
+        {"$match": {"g": "h", "t": {"$gte": bucket_start(start, "h"), "$lte": end}}},
+        {"$group": {"_id": None, "downloads": {"$sum": "$downloads"},
+                    "shares": {"$sum": "$shares"}, "reactions": {"$sum": _REACT_SUM}}},
+    ])
+    return agg[0] if agg else {}
+
+def _merge_delta(film_id: str, st: dict) -> dict:
+    """اعمال افزایش‌های flush‌نشده‌ی بافر روی یک سند آمار"""
+    for k, v in stats_buffer.delta(film_id).items():
+        if k.startswith("reactions."):
+            rec = st.setdefault("reactions", {}); name = k.split(".", 1)[1]
+            rec[name] = rec.get(name, 0) + v
+        else:
+            st[k] = st.get(k, 0) + v
+    return st
+
+async def get_stats(film_id: str) -> dict:
+    """سند آمار یک فیلم + افزایش‌های flush‌نشده‌ی بافر"""
+    return _merge_delta(film_id, await stats_repo.find_one({"film_id": film_id}) or {})
+
+async def get_stats_many(film_ids) -> dict[str, dict]:
+    """آمار چند فیلم با یک کوئری $in (برای جاب‌های دسته‌ای)"""
+    ids = list(set(film_ids))
+    docs = {d["film_id"]: d for d in await stats_repo.find_list({"film_id": {"$in": ids}})}
+    return {fid: _merge_delta(fid, docs.get(fid, {})) for fid in ids}
+
+async def save_post_ref(film_id: str, channel_id: int, message_id: int):
+    """ثبت مرجع پست کانالی؛ پست تازه در طبقه‌ی hot و بلافاصله سررسید رفرش قرار می‌گیرد"""
+    await refs_repo.update_one(
+        {"film_id": film_id, "channel_id": channel_id},
+        {"$set": {"message_id": message_id, "posted_at": datetime.now(timezone.utc).replace(tzinfo=None), "tier": "hot"},
+         "$unset": {"next_refresh_at": "", "views": ""}},
+        upsert=True
+    )
 
 # ---------------------- 🤖 ساخت کلاینت Bot و UserBot ----------------------
 bot = Client(
-    "BoxUploader",                        # نام سشن Bot
+    "BoxUploader" if WORKER_COUNT == 1 else f"BoxUploader-{WORKER_INDEX}",  # نام سشن Bot (جدا برای هر Worker)
     api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN,
     workdir=SESSION_DIR
 )
@@ -93,14 +435,334 @@ user = Client(
     workdir=SESSION_DIR
 )
 
+# ---------------------- 🧩 کش LRU با TTL ----------------------
+_MISS = object()  # نشانگر «در کش نیست» (چون False هم مقدار معتبری است)
+
+class TTLCache:
+    """کش LRU محدود با انقضای جدا برای هر کلید + شمارنده‌های hit/miss"""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()   # key → (expires_at, value)
+        self.hits = 0; self.misses = 0
+
+    def get(self, key, default=_MISS):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value, ttl: float):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)   # قدیمی‌ترین کلید بیرون می‌رود
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        ratio = (self.hits / total * 100) if total else 0
+        return f"{len(self)}/{self.maxsize} • hit {self.hits} • miss {self.misses} • {ratio:.1f}%"
+
+# ---------------------- 🚦 دروازه‌ی نرخ API تلگرام (Bot) ----------------------
+# همه‌ی فراخوانی‌های bot (send/edit/reply/…) در نهایت از Client.invoke رد می‌شوند؛ همان‌جا:
+#   • یک سطل توکن سراسری (API_GLOBAL_RATE در ثانیه) با صف اولویت‌دار: تحویل به کاربر (PRIO_USER) همیشه
+#     جلوتر از کارهای ادمین و پس‌زمینه (رفرش آمار، رندر کیبورد، حذف‌ها، گزارش‌ها) توکن می‌گیرد؛
+#   • سطل جدا برای هر چت فقط روی متدهای نوشتنی (Send/Edit/Forward/Delete): خصوصی ~۱ پیام در ثانیه،
+#     گروه/کانال ~۲۰ پیام در دقیقه؛
+#   • صف هر چت هم اولویت‌دار است و بدهی نمی‌سازد: انتشار ادمین/زمان‌بندی جلوتر از ویرایش‌های پس‌زمینه
+#     توکن می‌گیرد؛ ویرایش پس‌زمینه وقتی صف کانال بیش از API_BG_EDIT_MAX_WAIT ثانیه عقب است اصلاً
+#     فرستاده نمی‌شود (ApiDropped) و رندر کیبورد بعداً با آخرین وضعیت دوباره تلاش می‌کند؛
+#   • FloodWait تا API_FLOOD_MAX_WAIT ثانیه: سطل همان چت (یا سراسری) قفل و درخواست دوباره فرستاده می‌شود.
+# اولویت با ContextVar منتقل می‌شود؛ هندلرها/جاب‌ها با دکوریتور api_priority علامت می‌خورند.
+PRIO_USER, PRIO_ADMIN, PRIO_BACKGROUND = 0, 1, 2
+API_GLOBAL_RATE    = _get_env_int("API_GLOBAL_RATE", required=False, default=25)   # سقف کل ربات؛ بین Workerها تقسیم می‌شود
+API_PRIVATE_BURST  = _get_env_int("API_PRIVATE_BURST", required=False, default=5)
+API_GROUP_PER_MIN  = _get_env_int("API_GROUP_PER_MIN", required=False, default=20)
+API_FLOOD_MAX_WAIT = _get_env_int("API_FLOOD_MAX_WAIT", required=False, default=60)
+API_BG_EDIT_MAX_WAIT = _get_env_int("API_BG_EDIT_MAX_WAIT", required=False, default=10)
+_api_prio: contextvars.ContextVar[int] = contextvars.ContextVar("api_prio", default=PRIO_ADMIN)
+
+def api_priority(prio: int):
+    """دکوریتور: همه‌ی فراخوانی‌های API داخل این تابع با اولویت prio صف می‌شوند"""
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            token = _api_prio.set(prio)
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                _api_prio.reset(token)
+        return wrapper
+    return deco
+
+class TokenBucket:
+    """سطل توکن با رزرو: take() توکن را برمی‌دارد (حتی بدهکار) و زمان انتظار لازم را برمی‌گرداند"""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate; self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        self._refill()
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> float:
+        wait = self.wait_time()
+        self.tokens -= 1
+        return wait
+
+    def block(self, seconds: float):
+        """بعد از FloodWait: تا seconds ثانیه توکنی داده نشود"""
+        self._refill()
+        self.tokens = min(self.tokens, 1) - seconds * self.rate
+
+class ApiDropped(Exception):
+    """ویرایش پس‌زمینه به‌خاطر صف شلوغ چت فرستاده نشد؛ retry_after ثانیه بعد دوباره تلاش شود"""
+    def __init__(self, retry_after: float):
+        super().__init__(f"dropped, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class PriorityLane:
+    """سطل توکن + صف اولویت منتظرها؛ توکن فقط وقتی موجود است داده می‌شود (بدون بدهی)"""
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = 0
+        self._granter = None
+
+    def idle(self) -> bool:
+        """بدون منتظر و با سطل پر: حذفش با ساختن دوباره‌ی یک سطل تازه فرقی ندارد"""
+        self.bucket._refill()
+        return not self.waiters and self.bucket.tokens >= self.bucket.capacity
+
+    def backlog(self) -> float:
+        """تخمین انتظار یک درخواست تازه پشت صف فعلی (ثانیه)"""
+        return self.bucket.wait_time() + len(self.waiters) / self.bucket.rate
+
+    async def acquire(self, prio: int):
+        if not self.waiters and self.bucket.wait_time() == 0:
+            self.bucket.take(); return
+        fut = asyncio.get_running_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self.waiters, (prio, self._seq, fut))
+        if self._granter is None or self._granter.done():
+            self._granter = asyncio.create_task(self._grant())
+        await fut
+
+    async def _grant(self):
+        """توکن‌ها را به ترتیب اولویت (و بعد ترتیب ورود) به منتظرها می‌دهد"""
+        while self.waiters:
+            wait = self.bucket.wait_time()
+            if wait:
+                await asyncio.sleep(wait); continue
+            _, _, fut = heapq.heappop(self.waiters)
+            if not fut.done():
+                self.bucket.take(); fut.set_result(None)
+
+class ApiGateway:
+    """جایگزین client.invoke با صف‌های اولویت‌دار سراسری/هر چت و retry روی FloodWait"""
+    def __init__(self, client: Client):
+        self._invoke = client.invoke
+        client.invoke = self.invoke
+        rate = API_GLOBAL_RATE / WORKER_COUNT         # همه‌ی Workerها با یک توکن ربات؛ جمع نرخ‌ها = API_GLOBAL_RATE
+        self.global_lane = PriorityLane(TokenBucket(rate, max(rate, 1)))
+        self.chat_lanes: dict[tuple, PriorityLane] = {}   # peer → PriorityLane؛ فقط صف‌های بیکار هرس می‌شوند
+        self._pruned_at = time.monotonic()
+        self.calls = 0; self.flood_waits = 0; self.waited = 0.0; self.dropped = 0
+
+    @staticmethod
+    def _peer_key(query) -> tuple | None:
+        if not type(query).__name__.startswith(("Send", "Edit", "Forward", "Delete")):
+            return None
+        peer = getattr(query, "peer", None) or getattr(query, "channel", None)
+        for attr in ("user_id", "channel_id", "chat_id"):
+            if (v := getattr(peer, attr, None)) is not None:
+                return (attr, v)
+        return None
+
+    def _chat_lane(self, key: tuple) -> PriorityLane:
+        if time.monotonic() - self._pruned_at > 60:
+            self._prune()
+        lane = self.chat_lanes.get(key)
+        if lane is None:
+            lane = self.chat_lanes[key] = PriorityLane(TokenBucket(1.0, API_PRIVATE_BURST) if key[0] == "user_id"
+                                                       else TokenBucket(API_GROUP_PER_MIN / 60, 3))
+        return lane
+
+    def _prune(self):
+        """حذف صف‌های بیکار (بدون منتظر، سطل پر)؛ صفی که منتظر دارد هرگز حذف نمی‌شود تا نرخ چت دور زده نشود"""
+        self._pruned_at = time.monotonic()
+        for key in [k for k, lane in self.chat_lanes.items() if lane.idle()]:
+            del self.chat_lanes[key]
+
+    async def invoke(self, query, *args, **kwargs):
+        prio = _api_prio.get()
+        key = self._peer_key(query)
+        lane = self._chat_lane(key) if key is not None else None
+        if lane and prio == PRIO_BACKGROUND and type(query).__name__.startswith("Edit"):
+            if (backlog := lane.backlog()) > API_BG_EDIT_MAX_WAIT:
+                self.dropped += 1
+                raise ApiDropped(backlog)
+        for attempt in range(3):
+            t0 = time.monotonic()
+            if lane:
+                await lane.acquire(prio)
+            await self.global_lane.acquire(prio)
+            self.waited += time.monotonic() - t0; self.calls += 1
+            try:
+                return await self._invoke(query, *args, **kwargs)
+            except FloodWait as e:
+                self.flood_waits += 1
+                if e.value > API_FLOOD_MAX_WAIT or attempt == 2:
+                    raise
+                (lane or self.global_lane).bucket.block(e.value)
+                print(f"⏳ FloodWait {e.value}s on {type(query).__name__} → retry")
+
+    def summary(self) -> str:
+        avg = (self.waited / self.calls * 1000) if self.calls else 0
+        return (f"{self.calls} call • queue {len(self.global_lane.waiters)} • avg wait {avg:.0f}ms • "
+                f"FloodWait {self.flood_waits} • dropped {self.dropped}")
+
+api_gateway = ApiGateway(bot)
+
+# ---------------------- 👑 چند Worker + انتخاب رهبر ----------------------
+# با WORKER_COUNT>1 چند پروسه با همان توکن اجرا می‌شوند. همه‌ی سشن‌های MTProto یک ربات آپدیت‌ها را
+# می‌گیرند؛ هر Worker فقط کاربرانی را پردازش می‌کند که user_id % WORKER_COUNT == WORKER_INDEX
+# (بقیه در گروه -100 متوقف می‌شوند)، پس state هر ادمین/کاربر روی یک Worker می‌ماند.
+# جاب‌های دوره‌ای و یوزربات منبع‌ها فقط روی رهبر اجرا می‌شوند: رهبر یک سند lease در Mongo را هر
+# LEADER_LEASE_S/3 ثانیه تمدید می‌کند؛ اگر بمیرد، حداکثر بعد از LEADER_LEASE_S ثانیه Worker دیگری رهبر می‌شود.
+# رهبر اگر نتواند تمدید کند قبل از پایان lease خودش کنار می‌رود (دو رهبر هم‌زمان نداریم).
+LEADER_LEASE_S = _get_env_int("LEADER_LEASE_S", required=False, default=30)
+
+def _worker_of(uid: int | None) -> bool:
+    return WORKER_COUNT == 1 or uid is None or uid % WORKER_COUNT == WORKER_INDEX
+
+@bot.on_message(group=-100)
+@bot.on_callback_query(group=-100)
+@bot.on_inline_query(group=-100)
+@bot.on_chat_member_updated(group=-100)
+async def shard_updates(client: Client, update):
+    """آپدیت‌های کاربرانی که سهم این Worker نیستند همین‌جا متوقف می‌شوند"""
+    member = getattr(update, "new_chat_member", None) or getattr(update, "old_chat_member", None)
+    u = member.user if member else getattr(update, "from_user", None)   # تغییر عضویت: سهم خودِ عضو
+    if not _worker_of(u.id if u else None):
+        update.stop_propagation()
+
+class LeaderLease:
+    """رهبری با یک سند lease در Mongo (owner + expires_at) و heartbeat"""
+    def __init__(self, name: str):
+        self.name = name
+        self.valid_until = 0.0                         # monotonic؛ تا این لحظه رهبری ما قطعی است
+        self.was_leader = False
+        self._task = None
+        self._switch = None                            # تسک start/stop یوزربات
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self.valid_until
+
+    async def _renew(self):
+        t0 = time.monotonic()
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        try:
+            doc = await leases_repo.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": WORKER_ID}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": WORKER_ID, "expires_at": now + timedelta(seconds=LEADER_LEASE_S), "heartbeat_at": now}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+            if doc and doc.get("owner") == WORKER_ID:
+                self.valid_until = t0 + LEADER_LEASE_S * 0.8   # حاشیه برای اختلاف ساعت/تأخیر
+        except DuplicateKeyError:
+            pass                                           # lease دست Worker دیگری است
+        except Exception as e:
+            print("⚠️ leader lease error:", e)
+
+    def _sync_userbot(self):
+        """یوزربات را در تسک جدا با وضعیت رهبری هم‌خوان می‌کند تا لاگین کند تمدید lease را عقب نیندازد"""
+        if self.was_leader != user.is_connected and (self._switch is None or self._switch.done()):
+            self._switch = asyncio.create_task(self._apply_userbot())
+
+    async def _apply_userbot(self):
+        while self.was_leader != user.is_connected:     # اگر وسط start رهبری از دست رفت، بلافاصله stop
+            try:
+                if self.was_leader:
+                    await user.start()
+                    me2 = await user.get_me(); print(f"👤 Userbot {me2.id} started")
+                else:
+                    await user.stop()
+            except Exception as e:
+                print("⚠️ userbot switch error:", e); return   # تیک بعدی دوباره تلاش می‌کند
+
+    async def tick(self):
+        await self._renew()
+        if self.is_leader != self.was_leader:
+            self.was_leader = self.is_leader
+            print(f"👑 {WORKER_ID}: {'became leader' if self.was_leader else 'lost leadership'}")
+        self._sync_userbot()
+
+    async def start(self):
+        await self.tick()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(LEADER_LEASE_S / 3)
+            await self.tick()
+
+    async def release(self):
+        """خاموشی عادی: lease آزاد می‌شود تا Worker دیگری بی‌درنگ رهبر شود"""
+        if self._task:
+            self._task.cancel()
+        if self._switch and not self._switch.done():
+            await asyncio.wait([self._switch])
+        if self.was_leader:
+            self.was_leader = False
+            await self._apply_userbot()
+            await leases_repo.update_one({"_id": self.name, "owner": WORKER_ID},
+                                         {"$set": {"expires_at": datetime(1970, 1, 1)}})
+        self.valid_until = 0.0; self.was_leader = False
+
+leader = LeaderLease("jobs")
+
+def leader_only(fn):
+    """جاب دوره‌ای فقط روی رهبر اجرا شود"""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if leader.is_leader:
+            return await fn(*args, **kwargs)
+    return wrapper
+
 # ---------------------- 🧰 ابزارها و توابع کمکی ----------------------
+_FA_TRANSLIT = str.maketrans({
+    "ا": "a", "ب": "b", "پ": "p", "ت": "t", "ث": "s", "ج": "j", "چ": "ch", "ح": "h", "خ": "kh",
+    "د": "d", "ذ": "z", "ر": "r", "ز": "z", "ژ": "zh", "س": "s", "ش": "sh", "ص": "s", "ض": "z",
+    "ط": "t", "ظ": "z", "ع": "", "غ": "gh", "ف": "f", "ق": "gh", "ک": "k", "گ": "g", "ل": "l",
+    "م": "m", "ن": "n", "و": "v", "ه": "h", "ی": "y", "ء": "",
+})
+SLUG_MAX = 40   # جا برای پسوند شمارنده در پارامتر start (سقف ۶۴ کاراکتر)
+
 def slugify(title: str) -> str:
-    """ساخت شناسه‌ی تمیز برای film_id از روی عنوان"""
-    t = unicodedata.normalize("NFKD", title)
+    """ساخت شناسه‌ی تمیز برای film_id از روی عنوان (حروف فارسی آوانویسی می‌شوند؛ '-' فقط برای پسوند شمارنده)"""
+    t = unicodedata.normalize("NFKD", normalize_fa(title).translate(_FA_TRANSLIT))
     allowed = string.ascii_letters + string.digits + " _-"
     t = "".join(ch for ch in t if ch in allowed)
-    t = t.strip().replace(" ", "_")
-    return (t.lower() or "title")[:64]
+    t = re.sub(r"[\s_-]+", "_", t).strip("_")
+    return (t.lower() or "title")[:SLUG_MAX].rstrip("_") or "title"
 
 def caption_to_buttons(caption: str):
     """تبدیل الگوی 'متن (URL)' داخل کپشن به دکمه‌های زیر پیام + پاکسازی کپشن"""
@@ -134,9 +796,311 @@ def compose_channel_caption(film: dict) -> str:
     lines.append("👇 برای دریافت، روی دکمه دانلود بزنید.")
     return "\n".join(lines)
 
-def _stats_keyboard(film_id: str, channel_id: int, message_id: int, views=0):
+# ---------------------- 🎞 کش سند فیلم‌ها (Read-Through) ----------------------
+# سند فیلم + کپشن کانالی‌اش در یک LRU+TTL نگه داشته می‌شود؛ هر مسیر نوشتن با update_film/invalidate_film
+# کش را باطل می‌کند. اسناد برگشتی مشترک‌اند و نباید درجا تغییر کنند.
+FILM_CACHE_TTL  = _get_env_int("FILM_CACHE_TTL", required=False, default=300)
+FILM_CACHE_SIZE = _get_env_int("FILM_CACHE_SIZE", required=False, default=2000)
+FILM_WARMUP     = _get_env_int("FILM_CACHE_WARMUP", required=False, default=200)
+film_cache    = TTLCache(FILM_CACHE_SIZE)   # film_id → سند فیلم (یا None برای لینک نامعتبر)
+caption_cache = TTLCache(FILM_CACHE_SIZE)   # film_id → کپشن پست کانالی
+alias_cache   = TTLCache(FILM_CACHE_SIZE)   # film_id قدیمی → film_id اصلی (یا None)
+
+async def get_film(film_id: str) -> dict | None:
+    """خواندن فیلم از کش؛ در صورت نبود از Mongo و ذخیره در کش (نبودن فیلم هم کوتاه‌مدت کش می‌شود)"""
+    film = film_cache.get(film_id)
+    if film is _MISS:
+        film = await films_repo.find_one({"film_id": film_id})
+        if film is None:
+            # شناسه‌ی قدیمی قبل از مهاجرت: فقط نگاشت کش می‌شود و سند زیر شناسه‌ی اصلی، تا update_film باطلش کند
+            canonical = alias_cache.get(film_id)
+            if canonical is _MISS:
+                alias = await aliases_repo.find_one({"_id": film_id})
+                canonical = alias["film_id"] if alias else None
+                alias_cache.set(film_id, canonical, FILM_CACHE_TTL if canonical else 30)
+            if canonical and canonical != film_id:
+                return await get_film(canonical)
+        film_cache.set(film_id, film, FILM_CACHE_TTL if film else 30)
+    return film
+
+def invalidate_film(film_id: str):
+    film_cache.pop(film_id); caption_cache.pop(film_id)
+
+async def update_film(film_id: str, update: dict, **kwargs):
+    """update_one روی films + باطل کردن کش و به‌روزرسانی ایندکس جست‌وجوی همان فیلم"""
+    update = {**update, "$currentDate": {"updated_at": True}}     # واترمارک همگام‌سازی Workerهای دیگر
+    res = await films_repo.update_one({"film_id": film_id}, update, **kwargs)
+    invalidate_film(film_id)
+    if film_index.ready:
+        await film_index.refresh(film_id)
+    return res
+
+def film_caption(film: dict) -> str:
+    """کپشن کانالی فیلم با کش"""
+    fid = film.get("film_id")
+    cap = caption_cache.get(fid)
+    if cap is _MISS:
+        cap = compose_channel_caption(film)
+        caption_cache.set(fid, cap, FILM_CACHE_TTL)
+    return cap
+
+async def warm_film_cache():
+    """گرم کردن کش با پردانلودترین فیلم‌ها (از stats) هنگام استارت"""
+    top = await stats_repo.find_list({}, {"_id": 0, "film_id": 1}, sort=[("downloads", DESC)], limit=FILM_WARMUP)
+    films = await films_repo.find_list({"film_id": {"$in": [t["film_id"] for t in top]}})
+    for f in films:
+        film_cache.set(f["film_id"], f, FILM_CACHE_TTL)
+    print(f"🎞 Film cache warmed: {len(films)} films")
+
+# ---------------------- 🆔 تخصیص film_id یکتا ----------------------
+# slug آوانویسی‌شده + شمارنده‌ی اتمیک در counters: اولین فیلم هر slug خود slug است و بعدی‌ها
+# slug-2، slug-3، … (مبنای ۳۶). چون slugify هیچ‌وقت '-' تولید نمی‌کند، فضای پسوندها با slugها تداخل ندارد.
+# تداخل با شناسه‌های قدیمی (slugify قدیمی '-' را نگه می‌داشت) تا قبل از مهاجرت ممکن است؛ برای همین فیلم جدید
+# با insert_one ساخته می‌شود و ایندکس unique روی film_id داور است: DuplicateKeyError → شناسه‌ی بعدی.
+def _allocate_film_id_sync(title: str) -> str:
+    base = slugify(title)
+    while True:
+        seq = counters_col.find_one_and_update({"_id": f"film:{base}"}, {"$inc": {"seq": 1}},
+                                               upsert=True, return_document=ReturnDocument.AFTER)["seq"]
+        if seq > 1:
+            return f"{base}-{_b36(seq)}"
+        if not films_col.find_one({"film_id": base}, {"_id": 1}):
+            return base
+
+async def allocate_film_id(title: str) -> str:
+    """film_id کوتاه و یکتا برای عنوان (یک find_one_and_update اتمیک؛ بدون پیمایش title_2، title_3، …)"""
+    return await run_db(_allocate_film_id_sync, title)
+
+FILM_INSERT_RETRIES = 5
+
+async def insert_film(doc: dict) -> str:
+    """ساخت فیلم جدید با insert_one (هرگز روی فیلم موجود نمی‌نویسد)؛ در تداخل film_id تازه می‌گیرد. خروجی: film_id نهایی"""
+    for _ in range(FILM_INSERT_RETRIES):
+        fid = doc["film_id"]
+        try:
+            await films_repo.insert_one(dict(doc))
+        except DuplicateKeyError:
+            new = await allocate_film_id(doc.get("title") or fid)
+            print(f"⚠️ film_id {fid} already taken → {new}")
+            doc["film_id"] = new                        # درجا، تا سند فراخواننده (کپشن/DeepLink) هم شناسه‌ی نهایی را ببیند
+            for f in doc.get("files", []):
+                f["film_id"] = new
+            continue
+        await update_film(fid, {})                     # updated_at با ساعت سرور + کش/ایندکس جست‌وجو
+        return fid
+    raise RuntimeError(f"could not allocate a free film_id for {doc.get('title')!r}")
+
+_LEGACY_COLLAPSED = re.compile(r"title(_\d+)?")   # عنوان‌های فارسی که slugify قدیمی همه را title کرده بود
+_FILM_ID_REFS = (                                  # (کالکشن، فیلد) هایی که film_id را نگه می‌دارند
+    (post_refs, "film_id"), (stats_col, "film_id"), (reactions_col, "film_id"), (stats_buckets, "film_id"),
+    (pending_posts, "film_id"), (scheduled_posts, "film_id"), (user_sources, "from_film_id"),
+)
+
+def migrate_film_ids(apply: bool = False) -> list[str]:
+    """مهاجرت: seed کردن شمارنده‌ها از شناسه‌های موجود + تغییر کلید فیلم‌های title/title_N و ارجاع‌هایشان"""
+    lines = []
+    films = list(films_col.find({}, {"_id": 0, "film_id": 1, "title": 1}))
+    if apply:
+        for f in films:   # شمارنده هر slug حداقل به اندازه‌ی شناسه‌های موجود؛ تا allocate با آنها برخورد نکند
+            # فقط شناسه‌هایی که خود allocate ساخته (slug عنوان + '-' + مبنای ۳۶)؛ نه '-' شناسه‌های قدیمی مثل spider-man
+            base, _, suffix = f["film_id"].rpartition("-")
+            if base and base == slugify(f.get("title") or "") and re.fullmatch(r"[0-9a-z]+", suffix):
+                counters_col.update_one({"_id": f"film:{base}"}, {"$max": {"seq": int(suffix, 36)}}, upsert=True)
+            counters_col.update_one({"_id": f"film:{f['film_id']}"}, {"$max": {"seq": 1}}, upsert=True)
+    for f in films:
+        old = f["film_id"]
+        if not _LEGACY_COLLAPSED.fullmatch(old) or slugify(f.get("title") or "") == "title":
+            continue
+        new = _allocate_film_id_sync(f["title"]) if apply else slugify(f["title"]) + "[-n]"
+        lines.append(f"{old} → {new}  [{f['title']}]")
+        if not apply:
+            continue
+        films_col.update_one({"film_id": old}, {"$set": {"film_id": new}, "$currentDate": {"updated_at": True}})
+        films_col.update_one({"film_id": new, "files.0": {"$exists": True}}, {"$set": {"files.$[].film_id": new}})
+        for col, field in _FILM_ID_REFS:
+            col.update_many({field: old}, {"$set": {field: new}})
+        film_aliases.update_one({"_id": old}, {"$set": {"film_id": new}}, upsert=True)
+    lines.append(f"{'✅ applied' if apply else '🔍 dry-run'}: {len(lines)} films to re-key (of {len(films)})")
+    return lines
+
+# ---------------------- 🔎 ایندکس جست‌وجوی فارسی (Inverted Index) ----------------------
+# عنوان/ژانر/سال/film_id نرمال می‌شوند (ی/ي، ک/ك، اعراب، کشیده، نیم‌فاصله، ارقام فارسی/عربی)
+# و در یک ایندکس معکوس درون‌حافظه نگه داشته می‌شوند؛ استارت یک بار کامل ساخته می‌شود و بعد
+# هر نوشتن روی films (update_film / حذف) فقط همان فیلم را بازسازی می‌کند.
+# نوشتن‌های Workerهای دیگر (ورود منبع روی رهبر، ویرایش ادمین روی Worker خودش) هر INDEX_SYNC_S ثانیه
+# با واترمارک updated_at (ساعت سرور Mongo) خوانده می‌شوند؛ حذف‌ها با مقایسه‌ی فهرست film_idها (فقط WORKER_COUNT>1).
+SEARCH_LIMIT        = _get_env_int("SEARCH_LIMIT", required=False, default=50)
+SEARCH_PREFIX_MAX   = _get_env_int("SEARCH_PREFIX_MAX", required=False, default=300)   # سقف توکن‌های هم‌پیشوند برای هر کلمه
+_SEARCH_FIELDS      = {"title": 3, "film_id": 2, "genre": 1, "year": 1}                 # وزن هر فیلد در رتبه‌بندی
+_SEARCH_PROJECTION  = {"_id": 0, "film_id": 1, "title": 1, "genre": 1, "year": 1, "timestamp": 1, "updated_at": 1}
+INDEX_SYNC_S        = _get_env_int("INDEX_SYNC_S", required=False, default=30)
+SYNC_OVERLAP        = timedelta(seconds=5)     # بازخوانی کمی قبل از واترمارک (نوشتن‌های هم‌زمانِ دیرتر commit‌شده)
+
+_FA_TRANSLATE = str.maketrans({
+    "ي": "ی", "ى": "ی", "ئ": "ی", "ك": "ک", "ة": "ه", "ۀ": "ه",
+    "أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ؤ": "و",
+    "\u200c": "", "\u200d": "", "\u0640": "",                                       # نیم‌فاصله، ZWJ، کشیده
+    **{chr(0x06F0 + i): str(i) for i in range(10)},                                    # ارقام فارسی
+    **{chr(0x0660 + i): str(i) for i in range(10)},                                    # ارقام عربی
+})
+_FA_DIACRITICS = re.compile(r"[\u064B-\u065F\u0670]")
+_TOKEN_SPLIT   = re.compile(r"[\W_]+")
+
+def normalize_fa(text) -> str:
+    """نرمال‌سازی متن برای جست‌وجو: یکسان‌سازی حروف عربی/فارسی، حذف اعراب/نیم‌فاصله، ارقام لاتین، حروف کوچک"""
+    t = unicodedata.normalize("NFKC", str(text or "")).translate(_FA_TRANSLATE)
+    return _FA_DIACRITICS.sub("", t).casefold()
+
+def search_tokens(text) -> list[str]:
+    return [w for w in _TOKEN_SPLIT.split(normalize_fa(text)) if w]
+
+class SearchIndex:
+    """ایندکس معکوس توکن → {film_id: وزن} + لیست مرتب توکن‌ها برای تطبیق پیشوندی با bisect"""
+
+    def __init__(self):
+        self._postings: dict[str, dict[str, int]] = {}
+        self._vocab: list[str] = []                    # توکن‌های مرتب
+        self._docs: dict[str, tuple] = {}              # film_id → (title, year, genre, timestamp, tokens)
+        self.ready = False
+        self.version = 0                               # با هر تغییر زیاد می‌شود (کلید کش نتایج)
+        self._stamps: dict[str, datetime] = {}         # film_id → updated_at ایندکس‌شده
+        self.watermark: datetime | None = None
+
+    def add(self, doc: dict):
+        fid = doc.get("film_id")
+        if not fid:
+            return
+        self.remove(fid)
+        weights: dict[str, int] = {}
+        for field, w in _SEARCH_FIELDS.items():
+            for tok in search_tokens(doc.get(field)):
+                weights[tok] = max(weights.get(tok, 0), w)
+        for tok, w in weights.items():
+            post = self._postings.get(tok)
+            if post is None:
+                post = self._postings[tok] = {}
+                if self.ready:
+                    bisect.insort(self._vocab, tok)
+            post[fid] = w
+        ts = doc.get("timestamp")
+        if doc.get("updated_at"):
+            self._stamps[fid] = doc["updated_at"]
+            self.watermark = max(self.watermark or doc["updated_at"], doc["updated_at"])
+        self._docs[fid] = (doc.get("title") or fid, doc.get("year") or "-", doc.get("genre") or "",
+                           ts.timestamp() if ts else 0.0, tuple(weights))
+        self.version += 1
+
+    def remove(self, film_id: str):
+        old = self._docs.pop(film_id, None)
+        self._stamps.pop(film_id, None)
+        if not old:
+            return
+        self.version += 1
+        for tok in old[4]:
+            post = self._postings.get(tok)
+            if post is None:
+                continue
+            post.pop(film_id, None)
+            if not post:
+                del self._postings[tok]
+                i = bisect.bisect_left(self._vocab, tok)
+                if i < len(self._vocab) and self._vocab[i] == tok:
+                    del self._vocab[i]
+
+    def _expand(self, word: str) -> list[str]:
+        """توکن‌هایی که با word شروع می‌شوند (حداکثر SEARCH_PREFIX_MAX)"""
+        i = bisect.bisect_left(self._vocab, word)
+        out = []
+        while i < len(self._vocab) and self._vocab[i].startswith(word) and len(out) < SEARCH_PREFIX_MAX:
+            out.append(self._vocab[i]); i += 1
+        return out
+
+    def search(self, query: str, limit: int = SEARCH_LIMIT) -> list[dict]:
+        """همه‌ی کلمات باید (به‌صورت کامل یا پیشوندی) پیدا شوند؛ تطابق کامل و فیلد عنوان امتیاز بیشتری دارند"""
+        words = search_tokens(query)
+        if not words:
+            return []
+        scores: dict[str, float] | None = None
+        for word in sorted(set(words), key=len, reverse=True):   # کلمه‌ی بلندتر = کاندیدای کمتر
+            best: dict[str, float] = {}
+            for tok in self._expand(word):
+                factor = 1.0 if tok == word else 0.6
+                for fid, w in self._postings[tok].items():
+                    if scores is not None and fid not in scores:
+                        continue
+                    s = w * factor
+                    if s > best.get(fid, 0):
+                        best[fid] = s
+            if scores is None:
+                scores = best
+            else:
+                scores = {fid: scores[fid] + s for fid, s in best.items()}
+            if not scores:
+                return []
+        top = heapq.nlargest(limit, scores.items(), key=lambda kv: (kv[1], self._docs[kv[0]][3]))
+        return [self._result(fid, s) for fid, s in top]
+
+    def latest(self, limit: int = SEARCH_LIMIT) -> list[dict]:
+        """جدیدترین فیلم‌ها (برای کوئری خالی)"""
+        top = heapq.nlargest(limit, self._docs.items(), key=lambda kv: kv[1][3])
+        return [self._result(fid, 0.0) for fid, _ in top]
+
+    def _result(self, fid: str, score: float) -> dict:
+        title, year, genre, _, _ = self._docs[fid]
+        return {"film_id": fid, "title": title, "year": year, "genre": genre, "score": score}
+
+    async def rebuild(self):
+        """ساخت کامل ایندکس از films (فقط فیلدهای لازم)"""
+        t0 = time.perf_counter()
+        docs = await films_repo.find_list({}, _SEARCH_PROJECTION)
+        self.ready = False
+        self._postings.clear(); self._docs.clear(); self._stamps.clear(); self.watermark = None
+        for d in docs:
+            self.add(d)
+        self._vocab = sorted(self._postings)
+        self.ready = True
+        print(f"🔎 Search index built: {len(self._docs)} films, {len(self._vocab)} tokens in {time.perf_counter() - t0:.2f}s")
+
+    async def refresh(self, film_id: str):
+        """بازسازی یک فیلم بعد از نوشتن روی آن"""
+        doc = await films_repo.find_one({"film_id": film_id}, _SEARCH_PROJECTION)
+        if doc:
+            self.add(doc)
+        else:
+            self.remove(film_id)
+
+    async def sync(self):
+        """اعمال نوشتن‌های Workerهای دیگر: فیلم‌های تغییرکرده بعد از واترمارک + حذف‌شده‌ها"""
+        if not self.ready:
+            return
+        flt = {"updated_at": {"$gt": self.watermark - SYNC_OVERLAP}} if self.watermark else {"updated_at": {"$exists": True}}
+        changed = 0
+        for d in await films_repo.find_list(flt, _SEARCH_PROJECTION):
+            if self._stamps.get(d["film_id"]) != d["updated_at"]:
+                self.add(d); invalidate_film(d["film_id"]); changed += 1
+        alive = set(await films_repo.distinct("film_id"))
+        for fid in [f for f in self._docs if f not in alive]:
+            self.remove(fid); invalidate_film(fid); changed += 1
+        if changed:
+            print(f"🔎 Search index synced: {changed} films")
+
+    def summary(self) -> str:
+        return f"{len(self._docs)} films • {len(self._vocab)} tokens" if self.ready else "building…"
+
+film_index = SearchIndex()
+
+async def search_films(query: str, limit: int = SEARCH_LIMIT) -> list[dict]:
+    """جست‌وجو در ایندکس؛ تا وقتی ایندکس ساخته نشده، regex قدیمی روی Mongo"""
+    if film_index.ready:
+        return film_index.search(query, limit)
+    regs = {"$regex": re.escape(query.strip()), "$options": "i"}
+    return await films_repo.find_list({"$or": [
+        {"title": regs}, {"genre": regs}, {"year": regs}, {"film_id": regs}
+    ]}, {"_id": 0, "film_id": 1, "title": 1, "year": 1}, sort=[("timestamp", DESC)], limit=limit)
+
+async def _stats_keyboard(film_id: str, channel_id: int, message_id: int, views=0):
     """کیبورد آمار (👁/📥/🔁) + دکمه دانلود (DeepLink)؛ بدون Reactions"""
-    st = stats_col.find_one({"film_id": film_id}) or {}
+    st = await get_stats(film_id)
     dl = int(st.get("downloads", 0))
     sh = int(st.get("shares", 0))
     v  = int(views or 0)
@@ -149,9 +1113,10 @@ def _stats_keyboard(film_id: str, channel_id: int, message_id: int, views=0):
         ]
     ])
 
-def _reaction_keyboard(film_id: str, channel_id: int, message_id: int, views=0):
-    """کیبورد Reactions (❤️ 👍 👎 😢) + آمار"""
-    st = stats_col.find_one({"film_id": film_id}) or {}
+async def _reaction_keyboard(film_id: str, channel_id: int, message_id: int, views=0, st: dict | None = None):
+    """کیبورد Reactions (❤️ 👍 👎 😢) + آمار؛ st اگر از قبل خوانده شده باشد دوباره کوئری نمی‌شود"""
+    if st is None:
+        st = await get_stats(film_id)
     rec = st.get("reactions", {})
     return InlineKeyboardMarkup([
         [
@@ -169,24 +1134,221 @@ def _reaction_keyboard(film_id: str, channel_id: int, message_id: int, views=0):
         ]
     ])
 
-async def delete_after_delay(client: Client, chat_id: int, message_id: int):
-    """حذف پیام‌های موقت بعد از N ثانیه"""
+# ---------------------- 🗑 چرخ حذف پیام‌های موقت ----------------------
+# به‌جای یک تسک خوابیده برای هر پیام، یک تسک واحد سطل‌های زمانی را می‌چرخاند؛
+# هر سطل پیام‌ها را به تفکیک چت نگه می‌دارد و با delete_messages گروهی حذف می‌کند.
+# صف در Mongo هم ذخیره می‌شود تا بعد از ری‌استارت حذف‌ها از دست نروند.
+DELETE_TICK  = 1     # دقت چرخ (ثانیه)
+DELETE_CHUNK = 100   # سقف شناسه در هر delete_messages
+
+class DeletionWheel:
+    """چرخ زمانی سطل‌بندی‌شده با یک تایمر واحد و پشتوانه‌ی Mongo"""
+    def __init__(self, tick: int = DELETE_TICK):
+        self.tick = tick
+        self.buckets: dict[int, dict[int, list[int]]] = {}   # bucket → chat_id → [message_id]
+        self._heap: list[int] = []                            # سطل‌ها به ترتیب زمان
+        self._task = None
+
+    def _add(self, due_ts: float, chat_id: int, ids: list[int]):
+        b = int(due_ts // self.tick)
+        if b not in self.buckets:
+            self.buckets[b] = {}; heapq.heappush(self._heap, b)
+        self.buckets[b].setdefault(chat_id, []).extend(ids)
+
+    async def schedule(self, chat_id: int, ids: list[int], delay: int = DELETE_DELAY):
+        """ثبت حذف پیام‌ها بعد از delay ثانیه (حافظه + Mongo)"""
+        if not ids:
+            return
+        due_ts = time.time() + delay
+        self._add(due_ts, chat_id, ids)
+        due_at = datetime.fromtimestamp(due_ts, timezone.utc).replace(tzinfo=None)
+        try:
+            await deletes_repo.insert_many([{"chat_id": chat_id, "message_id": i, "due_at": due_at, "worker": WORKER_INDEX}
+                                            for i in ids])
+        except Exception as e:
+            print("⚠️ deletion persist error:", e)
+
+    async def restore(self):
+        """بارگذاری حذف‌های معوق همین Worker از Mongo بعد از ری‌استارت (ردیف‌های بدون برچسب: بر اساس سهم chat_id)"""
+        docs = await deletes_repo.find_list({"worker": {"$in": [WORKER_INDEX, None]}}, {"_id": 0})
+        docs = [d for d in docs if d.get("worker") == WORKER_INDEX or _worker_of(d["chat_id"])]
+        for d in docs:
+            self._add(d["due_at"].replace(tzinfo=timezone.utc).timestamp(), d["chat_id"], [d["message_id"]])
+        if docs:
+            print(f"🗑 Restored {len(docs)} pending deletions")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    @api_priority(PRIO_BACKGROUND)
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self._flush_due()
+            except Exception as e:
+                print("⚠️ deletion wheel error:", e)
+
+    async def _flush_due(self):
+        now_b = int(time.time() // self.tick)
+        due: dict[int, list[int]] = {}
+        while self._heap and self._heap[0] <= now_b:
+            for chat_id, ids in self.buckets.pop(heapq.heappop(self._heap)).items():
+                due.setdefault(chat_id, []).extend(ids)
+        for chat_id, ids in due.items():
+            for i in range(0, len(ids), DELETE_CHUNK):
+                chunk = ids[i:i + DELETE_CHUNK]
+                try:
+                    await bot.delete_messages(chat_id, chunk)
+                except FloodWait as e:
+                    self._add(time.time() + e.value, chat_id, chunk); continue   # بعد از FloodWait دوباره
+                except Exception as e:
+                    print("⚠️ delete_messages:", e)
+                await deletes_repo.delete_many({"chat_id": chat_id, "message_id": {"$in": chunk}})
+
+delete_wheel = DeletionWheel()
+
+# ---------------------- 👥 چک عضویت اجباری (کش + موازی) ----------------------
+MEMBER_TTL_POS    = _get_env_int("MEMBER_CACHE_TTL", required=False, default=600)     # عضو بود → ۱۰ دقیقه
+MEMBER_TTL_NEG    = _get_env_int("MEMBER_CACHE_NEG_TTL", required=False, default=30)  # عضو نبود → ۳۰ ثانیه
+MEMBER_CACHE_SIZE = _get_env_int("MEMBER_CACHE_SIZE", required=False, default=100_000)
+member_cache = TTLCache(MEMBER_CACHE_SIZE)   # کلید: (user_id, channel) → bool
+_MEMBER_STATUSES = (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER)
+
+# حالت ایندکس رویدادمحور: ربات ادمین کانال‌هاست و ChatMemberUpdated را می‌گیرد؛
+# عضویت در Mongo (channel_members) + حافظه نگه داشته می‌شود و API فقط برای کاربر ناشناخته صدا زده می‌شود.
+MEMBERSHIP_INDEX  = os.getenv("MEMBERSHIP_INDEX", "false").lower() == "true"
+RECONCILE_BATCH   = _get_env_int("MEMBERSHIP_RECONCILE_BATCH", required=False, default=200)
+RECONCILE_RATE    = _get_env_int("MEMBERSHIP_RECONCILE_RATE", required=False, default=5)   # درخواست در ثانیه
+_member_index: dict[str, dict[int, bool]] = {ch.lower(): {} for ch in REQUIRED_CHANNELS}
+_member_watermark: datetime | None = None      # بیشترین checked_at دیده‌شده (ساعت سرور Mongo)
+
+async def load_member_index():
+    """بارگذاری ایندکس عضویت از Mongo به حافظه (یک‌بار هنگام استارت)"""
+    if not MEMBERSHIP_INDEX:
+        return
+    docs = await members_repo.find_list({}, {"_id": 0, "channel": 1, "user_id": 1, "member": 1, "checked_at": 1})
+    _apply_member_docs(docs)
+    print(f"👥 Membership index loaded: {len(docs)} entries")
+
+def _apply_member_docs(docs: list[dict]) -> int:
+    global _member_watermark
+    changed = 0
+    for d in docs:
+        ch, uid, ok = d["channel"], d["user_id"], bool(d.get("member"))
+        idx = _member_index.setdefault(ch, {})
+        if idx.get(uid) != ok:
+            idx[uid] = ok; member_cache.pop((uid, ch)); changed += 1
+        if d.get("checked_at") and (_member_watermark is None or d["checked_at"] > _member_watermark):
+            _member_watermark = d["checked_at"]
+    return changed
+
+async def sync_member_index():
+    """اعمال تغییرات عضویت ثبت‌شده توسط Workerهای دیگر (ترمیم رهبر، ChatMemberUpdated) از روی checked_at"""
+    if not MEMBERSHIP_INDEX:
+        return
+    flt = {"checked_at": {"$gt": _member_watermark - SYNC_OVERLAP}} if _member_watermark else {}
+    docs = await members_repo.find_list(flt,
+                                        {"_id": 0, "channel": 1, "user_id": 1, "member": 1, "checked_at": 1})
+    if (changed := _apply_member_docs(docs)):
+        print(f"👥 Membership index synced: {changed} entries")
+
+async def record_membership(channel: str, uid: int, ok: bool):
+    """ثبت وضعیت عضویت در ایندکس حافظه + Mongo و باطل کردن کش TTL"""
+    ch = channel.lower()
+    _member_index.setdefault(ch, {})[uid] = ok
+    member_cache.pop((uid, ch))
+    await members_repo.update_one(
+        {"channel": ch, "user_id": uid},
+        {"$set": {"member": ok}, "$currentDate": {"checked_at": True}},
+        upsert=True
+    )
+
+async def _is_member_of(client: Client, uid: int, channel: str, recheck_negative=False) -> bool:
+    """عضویت در یک کانال؛ اول ایندکس، بعد کش، بعد get_chat_member و ذخیره با TTL مثبت/منفی"""
+    key = (uid, channel.lower())
+    if MEMBERSHIP_INDEX:
+        known = _member_index.get(key[1], {}).get(uid)
+        if known is True or (known is False and not recheck_negative):
+            return known
+    cached = member_cache.get(key)
+    if cached is True or (cached is False and not recheck_negative):
+        return cached
+    try:
+        m = await client.get_chat_member(f"@{channel}", uid)
+        ok = m.status in _MEMBER_STATUSES
+    except UserNotParticipant:
+        ok = False
+    except Exception:
+        return False   # خطای موقت (FloodWait/شبکه) کش نمی‌شود
+    if MEMBERSHIP_INDEX:
+        await record_membership(channel, uid, ok)
+    member_cache.set(key, ok, MEMBER_TTL_POS if ok else MEMBER_TTL_NEG)
+    return ok
+
+async def user_is_member(client: Client, uid: int, recheck_negative=False) -> bool:
+    """بررسی عضویت کاربر در تمام کانال‌های اجباری؛ موازی و با خروج زودهنگام روی اولین «عضو نیست»"""
+    tasks = [asyncio.create_task(_is_member_of(client, uid, ch, recheck_negative)) for ch in REQUIRED_CHANNELS]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            if not await fut:
+                return False
+        return True
+    finally:
+        for t in tasks:
+            t.cancel()
+
+@bot.on_chat_member_updated(filters.chat(REQUIRED_CHANNELS))
+async def required_member_updated(client: Client, upd: ChatMemberUpdated):
+    """ورود/خروج کاربر در کانال‌های اجباری → به‌روزرسانی ایندکس عضویت"""
+    if not MEMBERSHIP_INDEX or not upd.chat.username:
+        return
+    member = upd.new_chat_member or upd.old_chat_member
+    if not member or not member.user:
+        return
+    ok = bool(upd.new_chat_member) and upd.new_chat_member.status in _MEMBER_STATUSES
     try:
-        await asyncio.sleep(DELETE_DELAY)
-        await client.delete_messages(chat_id, message_id)
+        await record_membership(upd.chat.username, member.user.id, ok)
     except Exception as e:
-        print("⚠️ delete_after_delay:", e)
+        print("⚠️ member index update:", e)
 
-async def user_is_member(client: Client, uid: int) -> bool:
-    """بررسی عضویت کاربر در تمام کانال‌های اجباری"""
-    for channel in REQUIRED_CHANNELS:
+@leader_only
+@api_priority(PRIO_BACKGROUND)
+async def reconcile_member_index():
+    """ترمیم تدریجی ایندکس: قدیمی‌ترین رکوردها در دسته‌ی محدود و با نرخ ثابت دوباره چک می‌شوند"""
+    if not MEMBERSHIP_INDEX:
+        return
+    try:
+        docs = await members_repo.find_list({}, sort=[("checked_at", 1)], limit=RECONCILE_BATCH)
+    except Exception as e:
+        print("❌ DB error in reconcile_member_index:", e); return
+    fixed = 0
+    for d in docs:
+        ch, uid = d["channel"], d["user_id"]
         try:
-            m = await client.get_chat_member(f"@{channel}", uid)
-            if m.status not in (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER):
-                return False
+            m = await bot.get_chat_member(f"@{ch}", uid)
+            ok = m.status in _MEMBER_STATUSES
+        except UserNotParticipant:
+            ok = False
+        except FloodWait as e:
+            print(f"⏳ reconcile paused by FloodWait {e.value}s"); break
         except Exception:
-            return False
-    return True
+            ok = bool(d.get("member"))   # نامشخص → فقط زمان چک جلو می‌رود تا صف گیر نکند
+        if ok != bool(d.get("member")):
+            fixed += 1
+        await record_membership(ch, uid, ok)
+        await asyncio.sleep(1 / max(RECONCILE_RATE, 1))
+    if fixed:
+        print(f"👥 Membership index reconciled: {fixed} drifted entries fixed")
+
+async def sync_worker_views():
+    """هر INDEX_SYNC_S ثانیه روی همه‌ی Workerها: ایندکس جست‌وجو و ایندکس عضویت از Mongo به‌روز می‌شوند"""
+    for fn in (film_index.sync, sync_member_index):
+        try:
+            await fn()
+        except Exception as e:
+            print(f"⚠️ {fn.__name__} error:", e)
 
 def join_buttons_markup():
     """ساخت کیبورد عضویت اجباری + دکمه «عضو شدم»"""
@@ -215,22 +1377,325 @@ def format_source_footer(caption: str, source_username: str) -> str:
     footer += f"🔗 @BoxOfficeMoviiie"
     return (caption or "") + footer
 
+# ---------------------- 📜 لاگ ورودی کانال‌های منبع (JSONL فقط‌افزودنی) ----------------------
+# هر ورودی یک خط JSON در exports/sources.jsonl است؛ append در حافظه بافر می‌شود و یک تسک پس‌زمینه
+# هر SOURCE_LOG_FLUSH_S ثانیه (یا بعد از SOURCE_LOG_FLUSH_LINES خط) روی یک Thread می‌نویسد.
+# وقتی فایل از SOURCE_LOG_MAX_MB بزرگ‌تر یا از SOURCE_LOG_ROTATE_HOURS قدیمی‌تر شود به
+# sources-<شروع دوره>.jsonl.gz فشرده می‌شود. sources.json قدیمی یک بار به JSONL تبدیل می‌شود.
+SOURCE_LOG_FLUSH_S     = _get_env_int("SOURCE_LOG_FLUSH_S", required=False, default=2)
+SOURCE_LOG_FLUSH_LINES = _get_env_int("SOURCE_LOG_FLUSH_LINES", required=False, default=200)
+SOURCE_LOG_MAX_MB      = _get_env_int("SOURCE_LOG_MAX_MB", required=False, default=20)
+SOURCE_LOG_ROTATE_HOURS = _get_env_int("SOURCE_LOG_ROTATE_HOURS", required=False, default=24)
+
+class SourceLog:
+    """نویسنده‌ی بافر‌دار JSONL با چرخش حجمی/زمانی و فشرده‌سازی gzip"""
+    def __init__(self, directory: str, name: str = "sources"):
+        self.dir = pathlib.Path(directory)
+        self.name = name
+        self.path = self.dir / f"{name}.jsonl"
+        self.buffer: list[str] = []
+        self._period_start: datetime | None = None     # زمان اولین خط فایل جاری
+        self._lock = asyncio.Lock()
+        self._kick = asyncio.Event()
+        self._task = None
+
+    def append(self, entry: dict):
+        self.buffer.append(json.dumps(entry, ensure_ascii=False, default=str))
+        if len(self.buffer) >= SOURCE_LOG_FLUSH_LINES:
+            self._kick.set()
+
+    def _write_sync(self, lines: list[str]):
+        now = datetime.now()
+        if self._period_start is None:
+            self._period_start = self._first_time() or now
+        if self.path.exists() and (
+            self.path.stat().st_size >= SOURCE_LOG_MAX_MB * 1024 * 1024
+            or now - self._period_start >= timedelta(hours=SOURCE_LOG_ROTATE_HOURS)
+        ):
+            self._rotate_sync()
+            self._period_start = now
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _first_time(self) -> datetime | None:
+        """زمان اولین ورودی فایل جاری (برای چرخش زمانی بعد از ری‌استارت)"""
+        try:
+            with self.path.open(encoding="utf-8") as f:
+                return datetime.fromisoformat(json.loads(f.readline())["time"])
+        except Exception:
+            return None
+
+    def _rotate_sync(self):
+        stamp = (self._period_start or datetime.now()).strftime("%Y%m%d-%H%M%S")
+        target = self.dir / f"{self.name}-{stamp}.jsonl.gz"
+        with self.path.open("rb") as src, gzip.open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        self.path.unlink()
+        print(f"🗜 Source log rotated → {target.name}")
+
+    def _migrate_legacy_sync(self):
+        legacy = self.dir / f"{self.name}.json"
+        if not legacy.exists():
+            return
+        try:
+            old = json.loads(legacy.read_text(encoding="utf-8"))
+            with self.path.open("a", encoding="utf-8") as f:
+                for e in old:
+                    f.write(json.dumps(e, ensure_ascii=False, default=str) + "\n")
+            legacy.rename(legacy.with_suffix(".json.migrated"))
+            print(f"📜 Source log: migrated {len(old)} legacy entries")
+        except Exception as e:
+            print("⚠️ source log migration error:", e)
+
+    async def flush(self):
+        async with self._lock:
+            if not self.buffer:
+                return
+            lines, self.buffer = self.buffer, []
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write_sync, lines)
+            except Exception as e:
+                print("⚠️ source log write error:", e)
+                self.buffer[:0] = lines                    # برگرداندن به صف برای تلاش بعدی
+
+    async def start(self):
+        await asyncio.get_running_loop().run_in_executor(None, self._migrate_legacy_sync)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._kick.wait(), timeout=SOURCE_LOG_FLUSH_S)
+            except asyncio.TimeoutError:
+                pass
+            self._kick.clear()
+            await self.flush()
+
+source_log = SourceLog(EXPORTS_DIR)
+
 def log_source_entry(entry: dict):
-    """نوشتن لاگِ ورود پست از کانال منبع داخل فایل JSON"""
-    exports = pathlib.Path(EXPORTS_DIR) / "sources.json"
-    old = []
-    if exports.exists():
-        old = json.loads(exports.read_text(encoding="utf-8"))
-    old.append(entry)
-    exports.write_text(json.dumps(old, ensure_ascii=False, indent=2), encoding="utf-8")
+    """ثبت ورود پست از کانال منبع در لاگ JSONL (بدون I/O روی حلقه‌ی رویداد)"""
+    source_log.append(entry)
+
+def read_source_log(source: str | None = None, status: str | None = None,
+                    since: datetime | None = None, until: datetime | None = None):
+    """پیمایش جریانی لاگ (فایل‌های gz قدیمی → فایل جاری) با فیلتر منبع/وضعیت (پیشوندی)/بازه‌ی زمانی"""
+    base = pathlib.Path(EXPORTS_DIR)
+    files = sorted(base.glob(f"{source_log.name}-*.jsonl.gz")) + [source_log.path]
+    for p in files:
+        if not p.exists():
+            continue
+        opener = gzip.open if p.suffix == ".gz" else open
+        with opener(p, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except ValueError:
+                    continue                              # خط ناقص (مثلاً کرش وسط نوشتن)
+                if source and e.get("source", "").lstrip("@") != source.lstrip("@"):
+                    continue
+                if status and not str(e.get("status", "")).startswith(status):
+                    continue
+                if since or until:
+                    try:
+                        t = datetime.fromisoformat(e.get("time", ""))
+                    except ValueError:
+                        continue
+                    if (since and t < since) or (until and t >= until):
+                        continue
+                yield e
 
 # ---------------------- 🧠 Stateهای فرایندهای چندمرحله‌ای ----------------------
-upload_data: dict[int, dict] = {}        # وضعیت آپلود دستی ادمین
-schedule_data: dict[int, dict] = {}      # وضعیت زمان‌بندی ادمین
-admin_edit_state: dict[int, dict] = {}   # وضعیت ویرایش در پنل
+# هر فلو یک StateStore دارد: get/set/pop برحسب user_id، با انقضای STATE_TTL ثانیه از آخرین set.
+# memory: LRU+TTL درون پروسه (سقف STATE_MAX_USERS)؛ mongo: کالکشن conv_state با ایندکس TTL تا state
+# بعد از ری‌استارت بماند و بین Workerها مشترک باشد. بعد از تغییر dict حتماً set صدا زده شود.
+STATE_BACKEND   = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_TTL       = _get_env_int("STATE_TTL", required=False, default=3600)
+STATE_MAX_USERS = _get_env_int("STATE_MAX_USERS", required=False, default=1000)
+
+class MemoryStateStore:
+    """state درون‌حافظه با LRU + TTL"""
+    def __init__(self, name: str):
+        self.name = name
+        self._cache = TTLCache(STATE_MAX_USERS)
+
+    async def get(self, uid: int) -> dict | None:
+        return self._cache.get(uid, None)
+
+    async def set(self, uid: int, data: dict):
+        self._cache.set(uid, data, STATE_TTL)
+
+    async def pop(self, uid: int):
+        self._cache.pop(uid)
+
+class MongoStateStore:
+    """state مشترک در Mongo (conv_state: _id=<name>:<uid>, data, expire_at)"""
+    def __init__(self, name: str):
+        self.name = name
+
+    async def get(self, uid: int) -> dict | None:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        doc = await states_repo.find_one({"_id": f"{self.name}:{uid}", "expire_at": {"$gt": now}}, {"data": 1})
+        return doc["data"] if doc else None
+
+    async def set(self, uid: int, data: dict):
+        expire = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=STATE_TTL)
+        await states_repo.update_one({"_id": f"{self.name}:{uid}"}, {"$set": {"data": data, "expire_at": expire}}, upsert=True)
+
+    async def pop(self, uid: int):
+        await states_repo.delete_one({"_id": f"{self.name}:{uid}"})
+
+def make_state_store(name: str):
+    return MongoStateStore(name) if STATE_BACKEND == "mongo" else MemoryStateStore(name)
+
+upload_data      = make_state_store("upload")   # وضعیت آپلود دستی ادمین
+schedule_data    = make_state_store("schedule") # وضعیت زمان‌بندی ادمین
+admin_edit_state = make_state_store("edit")     # وضعیت ویرایش در پنل
+
+# ---------------------- 🧭 روتر callbackها (یک هندلر، مسیریابی با پیشوند) ----------------------
+# به‌جای ~۴۰ فیلتر regex که به ترتیب ثبت امتحان می‌شدند، یک هندلر callback_data را یک بار با '::'
+# می‌شکند: سر داده با dict پیدا می‌شود (sr، react، film_open، …) و اگر نبود با پیشوندهای ثبت‌شده
+# (admin_films_<page>، …؛ باقیمانده‌ی سر اولین آرگومان می‌شود). آرگومان‌ها از روی annotation پارامترهای
+# هندلر (int/Index/str/Literal/ObjectId) تبدیل می‌شوند؛ callback نامعتبر بی‌صدا جواب می‌گیرد. چک ADMIN_IDS یک بار
+# برای هر مسیر انجام می‌شود و زمان اجرای هر مسیر برای /routes نگه داشته می‌شود.
+ADMIN_SET = frozenset(ADMIN_IDS)
+
+class Index(int):
+    """اندیس نامنفی (مثل files.<idx>) در callback_data"""
+    def __new__(cls, v):
+        n = super().__new__(cls, v)
+        if n < 0:
+            raise ValueError(f"negative index: {v}")
+        return n
+
+def _converter(ann):
+    """annotation پارامتر → تابع تبدیل رشته (Literal فقط مقادیر مجاز را می‌پذیرد)"""
+    if ann is inspect.Parameter.empty:
+        return str
+    if get_origin(ann) is Literal:
+        allowed = frozenset(get_args(ann))
+        def conv(v: str):
+            if v not in allowed:
+                raise ValueError(f"not allowed: {v}")
+            return v
+        return conv
+    return ann
+
+class CallbackRouter:
+    """مسیریاب callback_data → هندلر تایپ‌دار"""
+    def __init__(self):
+        self.exact: dict[str, tuple] = {}
+        self.prefixes: list[tuple[str, tuple]] = []      # بلندترین پیشوند اول
+        self.stats: dict[str, list] = {}                 # route → [تعداد، مجموع ثانیه، بیشینه]
+
+    def route(self, name: str, *, admin: bool = True, prefix: bool = False):
+        """ثبت هندلر async (client, cq, *args) برای سر name (یا پیشوند name)"""
+        def deco(fn):
+            params = list(inspect.signature(fn).parameters.values())[2:]
+            convs = tuple(_converter(p.annotation) for p in params)
+            required = sum(p.default is inspect.Parameter.empty for p in params)
+            entry = (fn, convs, required, admin, name)
+            if prefix:
+                self.prefixes.append((name, entry))
+                self.prefixes.sort(key=lambda pe: -len(pe[0]))
+            else:
+                self.exact[name] = entry
+            self.stats.setdefault(name, [0, 0.0, 0.0])
+            return fn
+        return deco
+
+    def resolve(self, data: str):
+        """(entry, args تبدیل‌شده) یا None"""
+        head, *raw = data.split("::")
+        entry = self.exact.get(head)
+        if entry is None:
+            for p, e in self.prefixes:
+                if head.startswith(p):
+                    entry, raw = e, [head[len(p):], *raw]
+                    break
+            else:
+                return None
+        fn, convs, required, admin, name = entry
+        if not required <= len(raw) <= len(convs):
+            return None
+        try:
+            return entry, [conv(v) for conv, v in zip(convs, raw)]
+        except Exception:
+            return None
+
+    async def dispatch(self, client: Client, cq: CallbackQuery):
+        t0 = time.perf_counter()
+        found = self.resolve(cq.data or "")
+        if found is None:
+            return await cq.answer()
+        (fn, _, _, admin, name), args = found
+        if admin and cq.from_user.id not in ADMIN_SET:
+            return await cq.answer()
+        try:
+            await fn(client, cq, *args)
+        finally:
+            st = self.stats[name]; dt = time.perf_counter() - t0
+            st[0] += 1; st[1] += dt; st[2] = max(st[2], dt)
+
+    def report(self, limit: int = 15) -> list[str]:
+        rows = sorted(((n, s) for n, s in self.stats.items() if s[0]), key=lambda ns: -ns[1][0])[:limit]
+        return [f"{n}: {s[0]}× • avg {s[1] / s[0] * 1000:.1f}ms • max {s[2] * 1000:.0f}ms" for n, s in rows]
+
+callbacks = CallbackRouter()
+
+@bot.on_callback_query()
+async def callback_dispatch(client: Client, cq: CallbackQuery):
+    """تنها هندلر callback؛ مسیریابی با CallbackRouter"""
+    await callbacks.dispatch(client, cq)
 
 # ---------------------- 🚪 /start + عضویت اجباری + DeepLink ----------------------
+ALBUM_SIZE = 10                                                                # سقف آلبوم تلگرام
+
+def _delivery_chunks(film: dict) -> list[list[tuple]]:
+    """تقسیم فایل‌ها به آلبوم‌های ≤۱۰تایی؛ فایلی که کپشنش دکمه دارد تکی می‌ماند (آلبوم دکمه نمی‌گیرد)"""
+    chunks, album = [], []
+    for f in film.get("files", []):
+        cap = f"🎬 {film.get('title', film.get('film_id', ''))}"
+        if f.get("quality"): cap += f" ({f['quality']})"
+        cap += "\n\n" + (f.get("caption","") or "")
+        cleaned, kb = caption_to_buttons(cap)
+        if kb:
+            if album: chunks.append(album); album = []
+            chunks.append([(f["file_id"], cleaned, kb)])
+            continue
+        album.append((f["file_id"], cleaned, None))
+        if len(album) == ALBUM_SIZE:
+            chunks.append(album); album = []
+    if album:
+        chunks.append(album)
+    return chunks
+
+async def deliver_film(client: Client, chat_id: int, film: dict):
+    """ارسال فایل‌های یک فیلم به کاربر: آلبوم‌ها به ترتیب (قسمت‌های سریال جابه‌جا نرسند) + ارسال تکی در صورت خطای آلبوم + پیام هشدار حذف"""
+    ids, errors = [], []
+    for chunk in _delivery_chunks(film):
+        if len(chunk) > 1:
+            try:
+                msgs = await client.send_media_group(chat_id, [InputMediaVideo(fid, caption=cap) for fid, cap, _ in chunk])
+                ids.extend(m.id for m in msgs)
+                continue
+            except Exception as e:
+                print("⚠️ send_media_group failed, falling back per file:", e)
+        for fid, cap, kb in chunk:
+            try:
+                m = await client.send_video(chat_id, fid, caption=cap, reply_markup=kb)
+                ids.append(m.id)
+            except Exception as e:
+                errors.append(e)
+    await delete_wheel.schedule(chat_id, ids)             # اول فایل‌ها؛ شکست پیام‌های بعدی جلوی حذف را نگیرد
+    for e in errors:
+        await client.send_message(chat_id, f"⚠️ خطا در ارسال یک فایل: {e}")
+    warn = await client.send_message(chat_id, "⚠️ فایل‌ها تا ۳۰ ثانیه دیگر حذف می‌شوند، ذخیره کنید.")
+    await delete_wheel.schedule(chat_id, [warn.id])
+
 @bot.on_message(filters.command("start") & filters.private)
+@api_priority(PRIO_USER)
 async def start_handler(client: Client, message: Message):
     """ورود کاربر؛ اگر start=film_id باشد و عضو باشد → فایل‌ها ارسال می‌شود"""
     user_id = message.from_user.id
@@ -238,34 +1703,16 @@ async def start_handler(client: Client, message: Message):
     film_id = parts[1].strip() if len(parts) == 2 else None
 
     if film_id and await user_is_member(client, user_id):
-        try:
-            stats_col.update_one({"film_id": film_id}, {"$inc": {"downloads": 1}}, upsert=True)  # شمارش دانلود
-        except Exception:
-            pass
-        film = films_col.find_one({"film_id": film_id})
+        stats_buffer.incr(film_id, "downloads")  # شمارش دانلود
+        film = await get_film(film_id)
         if not film:
             return await message.reply("❌ لینک فایل معتبر نیست یا فیلم پیدا نشد.")
         # ارسال همه فایل‌های فیلم به کاربر
-        for f in film.get("files", []):
-            cap = f"🎬 {film.get('title', film_id)}"
-            if f.get("quality"): cap += f" ({f['quality']})"
-            cap += "\n\n" + (f.get("caption","") or "")
-            cleaned, kb = caption_to_buttons(cap)
-            try:
-                if kb:
-                    m = await client.send_video(message.chat.id, f["file_id"], caption=cleaned, reply_markup=kb)
-                else:
-                    m = await client.send_video(message.chat.id, f["file_id"], caption=cleaned)
-                asyncio.create_task(delete_after_delay(client, m.chat.id, m.id))
-            except Exception as e:
-                await client.send_message(message.chat.id, f"⚠️ خطا در ارسال یک فایل: {e}")
-        warn = await client.send_message(message.chat.id, "⚠️ فایل‌ها تا ۳۰ ثانیه دیگر حذف می‌شوند، ذخیره کنید.")
-        asyncio.create_task(delete_after_delay(client, warn.chat.id, warn.id))
-        return
+        return await deliver_film(client, message.chat.id, film)
 
     # اگر start داشت ولی عضو نبود → منبع را نگه می‌داریم تا بعد از عضویت فایل‌ها بدهیم
     if film_id:
-        user_sources.update_one({"user_id": user_id}, {"$set": {"from_film_id": film_id}}, upsert=True)
+        await sources_repo.update_one({"user_id": user_id}, {"$set": {"from_film_id": film_id}}, upsert=True)
 
     # ارسال پیام خوش‌آمد + کیبورد عضویت
     try:
@@ -280,19 +1727,13 @@ async def start_handler(client: Client, message: Message):
             reply_markup=join_buttons_markup()
         )
 
-@bot.on_callback_query(filters.regex(r"^check_membership$"))
+@callbacks.route("check_membership", admin=False)
+@api_priority(PRIO_USER)
 async def check_membership_cb(client: Client, cq: CallbackQuery):
     """دکمه «عضو شدم»؛ اگر همه کانال‌ها عضو بود → فایل‌های DeepLink را بده"""
     user_id = cq.from_user.id
-    missing = []
-    for ch in REQUIRED_CHANNELS:
-        try:
-            m = await client.get_chat_member(f"@{ch}", user_id)
-            if m.status not in (ChatMemberStatus.MEMBER, ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER):
-                missing.append(ch)
-        except Exception:
-            missing.append(ch)
-    if missing:
+    # کاربر می‌گوید عضو شده؛ جواب‌های منفیِ کش‌شده دوباره از API پرسیده می‌شوند
+    if not await user_is_member(client, user_id, recheck_negative=True):
         return await cq.answer("⛔️ هنوز در همه کانال‌ها عضو نیستی!", show_alert=True)
 
     await cq.answer("✅ عضویت تایید شد!", show_alert=True)
@@ -302,58 +1743,109 @@ async def check_membership_cb(client: Client, cq: CallbackQuery):
         await client.send_message(cq.message.chat.id, "✅ عضویت تایید شد. در حال بررسی…")
 
     # اگر از start آمده بود، فایل‌ها را بده
-    src = user_sources.find_one({"user_id": user_id})
+    src = await sources_repo.find_one({"user_id": user_id})
     film_id = src.get("from_film_id") if src else None
     if film_id:
-        try:
-            stats_col.update_one({"film_id": film_id}, {"$inc": {"downloads": 1}}, upsert=True)
-        except Exception:
-            pass
-        film = films_col.find_one({"film_id": film_id})
+        stats_buffer.incr(film_id, "downloads")
+        film = await get_film(film_id)
         if not film:
             await client.send_message(cq.message.chat.id, "❌ لینک فیلم معتبر نیست یا اطلاعاتی یافت نشد.")
-            user_sources.update_one({"user_id": user_id}, {"$unset": {"from_film_id": ""}})
+            await sources_repo.update_one({"user_id": user_id}, {"$unset": {"from_film_id": ""}})
             return
-        for f in film.get("files", []):
-            cap = f"🎬 {film.get('title', film_id)}"
-            if f.get("quality"): cap += f" ({f['quality']})"
-            cap += "\n\n" + (f.get("caption","") or "")
-            cleaned, kb = caption_to_buttons(cap)
-            try:
-                if kb:
-                    m = await client.send_video(cq.message.chat.id, f["file_id"], caption=cleaned, reply_markup=kb)
-                else:
-                    m = await client.send_video(cq.message.chat.id, f["file_id"], caption=cleaned)
-                asyncio.create_task(delete_after_delay(client, m.chat.id, m.id))
-            except Exception:
-                pass
-        user_sources.update_one({"user_id": user_id}, {"$unset": {"from_film_id": ""}})
+        await deliver_film(client, cq.message.chat.id, film)
+        await sources_repo.update_one({"user_id": user_id}, {"$unset": {"from_film_id": ""}})
     else:
         await client.send_message(cq.message.chat.id, "ℹ️ الان عضو شدی. برای دریافت محتوا، روی لینک داخل پست‌های کانال کلیک کن.")
 
+# ---------------------- 🔍 جست‌وجوی اینلاین (@bot عنوان) ----------------------
+# نیاز به فعال بودن Inline Mode در BotFather دارد. نتایج فقط از film_index (حافظه) می‌آیند و Mongo
+# لمس نمی‌شود؛ پاسخ هر (کوئری نرمال، offset) کوتاه‌مدت کش می‌شود و تلگرام هم با cache_time نگهش می‌دارد.
+# تایپ پشت‌سرهم: هر کاربر حداکثر یک جست‌وجو در هر INLINE_MIN_INTERVAL_MS؛ کوئری‌های عقب‌افتاده اگر
+# کاربر تا نوبتشان چیز جدیدی تایپ کرده باشد دور ریخته می‌شوند.
+INLINE_PAGE            = 20
+INLINE_CACHE_TIME      = _get_env_int("INLINE_CACHE_TIME", required=False, default=60)
+INLINE_MIN_INTERVAL    = _get_env_int("INLINE_MIN_INTERVAL_MS", required=False, default=400) / 1000
+INLINE_MAX_WAIT        = 2.0
+inline_results_cache = TTLCache(2000)    # (version, کوئری، offset) → (results, next_offset)
+inline_users         = TTLCache(20000)   # user_id → [زمان نوبت بعدی، آخرین inline_query_id]
+
+async def _inline_admit(uid: int, qid: str) -> bool:
+    """رزرو نوبت جست‌وجو برای کاربر؛ False یعنی کوئری منسوخ شده یا صف بیش از حد طولانی است"""
+    slot = inline_users.get(uid)
+    if slot is _MISS:
+        slot = [0.0, qid]
+        inline_users.set(uid, slot, 60)
+    slot[1] = qid
+    now = time.monotonic()
+    at = max(now, slot[0])
+    if at - now > INLINE_MAX_WAIT:
+        return False
+    slot[0] = at + INLINE_MIN_INTERVAL
+    if at > now:
+        await asyncio.sleep(at - now)
+    return slot[1] == qid
+
+def _inline_articles(films: list[dict]) -> list:
+    out = []
+    for f in films:
+        fid = f["film_id"]
+        link = f"https://t.me/{BOT_USERNAME}?start={fid}"
+        title = f"{f['title']} ({f['year']})"
+        out.append(InlineQueryResultArticle(
+            id=fid[:64],
+            title=title,
+            description=f.get("genre") or None,
+            input_message_content=InputTextMessageContent(f"🎬 {title}\n📥 دریافت: {link}"),
+            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📥 دانلود", url=link)]]),
+        ))
+    return out
+
+@bot.on_inline_query()
+@api_priority(PRIO_USER)
+async def inline_search(client: Client, iq: InlineQuery):
+    """پاسخ به جست‌وجوی اینلاین از ایندکس حافظه با کش نتایج و محدودیت نرخ هر کاربر"""
+    q = " ".join(search_tokens(iq.query))
+    offset = int(iq.offset) if (iq.offset or "").isdigit() else 0
+    key = (film_index.version, q, offset)
+    cached = inline_results_cache.get(key)
+    if cached is _MISS:
+        if not film_index.ready or not await _inline_admit(iq.from_user.id, iq.id):
+            return
+        films = film_index.search(q, offset + INLINE_PAGE + 1) if q else film_index.latest(offset + INLINE_PAGE + 1)
+        page = films[offset:offset + INLINE_PAGE]
+        nxt = str(offset + INLINE_PAGE) if len(films) > offset + INLINE_PAGE else ""
+        cached = (_inline_articles(page), nxt)
+        inline_results_cache.set(key, cached, INLINE_CACHE_TIME)
+    results, nxt = cached
+    try:
+        await iq.answer(results, cache_time=INLINE_CACHE_TIME, is_personal=False, next_offset=nxt)
+    except Exception as e:
+        print("⚠️ inline answer error:", e)
+
 # ---------------------- ⬆️ آپلود چندمرحله‌ای برای ادمین ----------------------
 @bot.on_message(filters.command("upload") & filters.private & filters.user(ADMIN_IDS))
 async def upload_command(client: Client, message: Message):
     """شروع آپلود دستی؛ مرحله به مرحله اطلاعات فیلم را می‌گیرد"""
     uid = message.from_user.id
-    upload_data[uid] = {"step": "awaiting_title", "files": []}
+    await upload_data.set(uid, {"step": "awaiting_title", "files": []})
     await message.reply("🎬 لطفاً عنوان را بفرست (مثال: آواتار ۲).")
 
-@bot.on_message(filters.private & filters.user(ADMIN_IDS) & filters.text)
+@bot.on_message(filters.private & filters.user(ADMIN_IDS) & filters.text & ~filters.regex(r"^/"))
 async def admin_text_router(client: Client, message: Message):
     """مسیر‌دهی پیام‌های متنی ادمین (آپلود/زمان‌بندی/ویرایش/جست‌وجو)"""
     uid = message.from_user.id
 
     # --- حالت زمان‌بندی: دریافت تاریخ/ساعت و انتخاب کانال ---
-    if uid in schedule_data:
-        st = schedule_data[uid]
+    if (st := await schedule_data.get(uid)):
         if st.get("step") == "date":
             st["date"] = message.text.strip()
             st["step"] = "time"
+            await schedule_data.set(uid, st)
             return await message.reply("🕒 ساعت را وارد کن (HH:MM):")
         if st.get("step") == "time":
             st["time"] = message.text.strip()
             st["step"] = "channel_await"
+            await schedule_data.set(uid, st)
             rows = [[InlineKeyboardButton(title, callback_data=f"sched_pick::{chat_id}")]
                     for title, chat_id in TARGET_CHANNELS.items()]
             rows.append([InlineKeyboardButton("❌ لغو", callback_data="sched_cancel")])
@@ -361,79 +1853,74 @@ async def admin_text_router(client: Client, message: Message):
         return
 
     # --- حالت‌های پنل ادمین (جست‌وجو/ویرایش) ---
-    if uid in admin_edit_state:
-        st = admin_edit_state[uid]
+    if (st := await admin_edit_state.get(uid)):
         mode = st.get("mode")
         film_id = st.get("film_id")
 
         # جست‌وجو
         if mode == "search":
-            q = message.text.strip()
-            regs = {"$regex": q, "$options": "i"}
-            films = list(films_col.find({"$or": [
-                {"title": regs}, {"genre": regs}, {"year": regs}, {"film_id": regs}
-            ]}).sort("timestamp", -1))
-            admin_edit_state.pop(uid, None)
+            films = await search_films(message.text)
+            await admin_edit_state.pop(uid)
             if not films:
                 return await message.reply("❌ چیزی پیدا نشد. /admin")
-            rows = [[InlineKeyboardButton(f"{f.get('title', f['film_id'])} ({f.get('year','-')})", callback_data=f"film_open::{f['film_id']}")] for f in films[:50]]
+            rows = [[InlineKeyboardButton(f"{f.get('title') or f['film_id']} ({f.get('year') or '-'})", callback_data=f"film_open::{f['film_id']}")] for f in films]
             rows.append([InlineKeyboardButton("🏠 منو اصلی", callback_data="admin_home")])
             return await message.reply("🔎 نتایج:", reply_markup=InlineKeyboardMarkup(rows))
 
         # اگر فیلم مشخص نیست، کانتکست از بین رفته
         if not film_id:
-            admin_edit_state.pop(uid, None)
+            await admin_edit_state.pop(uid)
             return await message.reply("⚠️ کانتکست از دست رفت. دوباره تلاش کن.")
 
         # ویرایش عنوان/ژانر/سال
         if mode == "edit_title":
-            films_col.update_one({"film_id": film_id}, {"$set": {"title": message.text.strip()}})
-            admin_edit_state.pop(uid, None)
+            await update_film(film_id, {"$set": {"title": message.text.strip()}})
+            await admin_edit_state.pop(uid)
             return await message.reply("✅ عنوان ذخیره شد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_open::{film_id}")]]))
         if mode == "edit_genre":
-            films_col.update_one({"film_id": film_id}, {"$set": {"genre": message.text.strip()}})
-            admin_edit_state.pop(uid, None)
+            await update_film(film_id, {"$set": {"genre": message.text.strip()}})
+            await admin_edit_state.pop(uid)
             return await message.reply("✅ ژانر ذخیره شد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_open::{film_id}")]]))
         if mode == "edit_year":
             new_year = message.text.strip()
             if new_year and not new_year.isdigit():
                 return await message.reply("⚠️ سال باید عدد باشد.")
-            films_col.update_one({"film_id": film_id}, {"$set": {"year": new_year}})
-            admin_edit_state.pop(uid, None)
+            await update_film(film_id, {"$set": {"year": new_year}})
+            await admin_edit_state.pop(uid)
             return await message.reply("✅ سال ذخیره شد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_open::{film_id}")]]))
 
         # ویرایش فایل‌های فیلم
         idx = st.get("file_index", 0)
         if mode == "file_edit_caption":
-            films_col.update_one({"film_id": film_id}, {"$set": {f"files.{idx}.caption": message.text.strip()}})
-            admin_edit_state.pop(uid, None)
+            await update_film(film_id, {"$set": {f"files.{idx}.caption": message.text.strip()}})
+            await admin_edit_state.pop(uid)
             return await message.reply("✅ کپشن فایل ذخیره شد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_files::{film_id}")]]))
         if mode == "file_edit_quality":
-            films_col.update_one({"film_id": film_id}, {"$set": {f"files.{idx}.quality": message.text.strip()}})
-            admin_edit_state.pop(uid, None)
+            await update_film(film_id, {"$set": {f"files.{idx}.quality": message.text.strip()}})
+            await admin_edit_state.pop(uid)
             return await message.reply("✅ کیفیت فایل ذخیره شد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_files::{film_id}")]]))
 
         # افزودن فایل جدید (مرحله کپشن → کیفیت)
         if mode == "file_add_caption":
             st["tmp_caption"] = message.text.strip()
             st["mode"] = "file_add_quality"
+            await admin_edit_state.set(uid, st)
             return await message.reply("📽 کیفیت فایل جدید را بفرست (مثل 720p):")
         if mode == "file_add_quality":
             new_q = message.text.strip()
             if not st.get("tmp_file_id"):
-                admin_edit_state.pop(uid, None)
+                await admin_edit_state.pop(uid)
                 return await message.reply("⚠️ ابتدا فایل رسانه را بفرست.")
-            films_col.update_one({"film_id": film_id}, {"$push": {"files": {
+            await update_film(film_id, {"$push": {"files": {
                 "film_id": film_id, "file_id": st["tmp_file_id"],
                 "caption": st.get("tmp_caption", ""), "quality": new_q
             }}})
-            admin_edit_state.pop(uid, None)
+            await admin_edit_state.pop(uid)
             return await message.reply("✅ فایل جدید اضافه شد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_files::{film_id}")]]))
         return
 
     # --- فلو آپلود دستی ---
-    if uid in upload_data:
-        data = upload_data[uid]
+    if (data := await upload_data.get(uid)):
         step = data.get("step")
 
         if step == "awaiting_title":
@@ -441,17 +1928,15 @@ async def admin_text_router(client: Client, message: Message):
             if not title:
                 return await message.reply("⚠️ عنوان خالیه! دوباره بفرست.")
             data["title"] = title
-            base = slugify(title)
-            candidate, i = base, 2
-            while films_col.find_one({"film_id": candidate}):
-                candidate = f"{base}_{i}"; i += 1
-            data["film_id"] = candidate
+            data["film_id"] = await allocate_film_id(title)
             data["step"] = "awaiting_genre"
+            await upload_data.set(uid, data)
             return await message.reply("🎭 ژانر را بفرست:")
 
         if step == "awaiting_genre":
             data["genre"] = message.text.strip()
             data["step"] = "awaiting_year"
+            await upload_data.set(uid, data)
             return await message.reply("📆 سال تولید را بفرست (مثال: 2023):")
 
         if step == "awaiting_year":
@@ -461,18 +1946,22 @@ async def admin_text_router(client: Client, message: Message):
             data["year"] = year
             if data.get("cover_id"):
                 data["step"] = "awaiting_first_file"
+                await upload_data.set(uid, data)
                 return await message.reply("🗂 حالا فایل اول را بفرست (ویدیو/سند/صوت).")
             else:
                 data["step"] = "awaiting_cover"
+                await upload_data.set(uid, data)
                 return await message.reply("🖼 کاور را بفرست (یک‌بار).")
 
         if step == "awaiting_caption":
             caption = message.text.strip()
             if "pending_file_id" not in data:
                 data["step"] = "awaiting_first_file" if len(data["files"]) == 0 else "awaiting_next_file"
+                await upload_data.set(uid, data)
                 return await message.reply("⚠️ ابتدا فایل رسانه را بفرست.")
             data["current_file"] = {"caption": caption}
             data["step"] = "awaiting_quality"
+            await upload_data.set(uid, data)
             return await message.reply("📽 کیفیت فایل را بفرست (مثل 720p):")
 
         if step == "awaiting_quality":
@@ -481,6 +1970,7 @@ async def admin_text_router(client: Client, message: Message):
                 return await message.reply("⚠️ کیفیت خالیه! دوباره بفرست.")
             if "pending_file_id" not in data:
                 data["step"] = "awaiting_first_file" if len(data["files"]) == 0 else "awaiting_next_file"
+                await upload_data.set(uid, data)
                 return await message.reply("⚠️ ابتدا فایل رسانه را بفرست.")
             data["files"].append({
                 "film_id": data["film_id"], "file_id": data["pending_file_id"],
@@ -490,6 +1980,7 @@ async def admin_text_router(client: Client, message: Message):
             data["step"] = "confirm_more_files"
             buttons = InlineKeyboardMarkup([[InlineKeyboardButton("✅ بله", callback_data="more_yes"),
                                              InlineKeyboardButton("❌ خیر", callback_data="more_no")]])
+            await upload_data.set(uid, data)
             return await message.reply("✅ فایل اضافه شد. فایل دیگری داری؟", reply_markup=buttons)
         return
 
@@ -500,15 +1991,14 @@ async def admin_media_router(client: Client, message: Message):
     uid = message.from_user.id
 
     # حالت پنل ادمین: جایگزینی کاور/فایل/افزودن فایل
-    if uid in admin_edit_state:
-        st = admin_edit_state[uid]
+    if (st := await admin_edit_state.get(uid)):
         mode = st.get("mode"); fid = st.get("film_id")
 
         if mode == "replace_cover":
             if not message.photo:
                 return await message.reply("⚠️ لطفاً عکس کاور بفرست.")
-            films_col.update_one({"film_id": fid}, {"$set": {"cover_id": message.photo.file_id}})
-            admin_edit_state.pop(uid, None)
+            await update_film(fid, {"$set": {"cover_id": message.photo.file_id}})
+            await admin_edit_state.pop(uid)
             return await message.reply("✅ کاور جایگزین شد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_open::{fid}")]]))
 
         if mode == "file_replace":
@@ -518,8 +2008,8 @@ async def admin_media_router(client: Client, message: Message):
             else:
                 return await message.reply("⚠️ فقط ویدیو/سند/صوت قابل قبول است.")
             idx = st.get("file_index", 0)
-            films_col.update_one({"film_id": fid}, {"$set": {f"files.{idx}.file_id": fid_new}})
-            admin_edit_state.pop(uid, None)
+            await update_film(fid, {"$set": {f"files.{idx}.file_id": fid_new}})
+            await admin_edit_state.pop(uid)
             return await message.reply("✅ فایل جایگزین شد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_files::{fid}")]]))
 
         if mode == "file_add_pickfile":
@@ -530,16 +2020,18 @@ async def admin_media_router(client: Client, message: Message):
                 return await message.reply("⚠️ فقط ویدیو/سند/صوت قابل قبول است.")
             st["tmp_file_id"] = fid_new
             st["mode"] = "file_add_caption"
+            await admin_edit_state.set(uid, st)
             return await message.reply("📝 کپشن فایل جدید را بفرست:")
         # ادامه در admin_text_router
     # فلو آپلود
-    if uid in upload_data:
-        data = upload_data[uid]; step = data.get("step")
+    if (data := await upload_data.get(uid)):
+        step = data.get("step")
         if step == "awaiting_cover":
             if not message.photo:
                 return await message.reply("⚠️ لطفاً عکس کاور بفرست.")
             data["cover_id"] = message.photo.file_id
             data["step"] = "awaiting_first_file"
+            await upload_data.set(uid, data)
             return await message.reply("📤 کاور ثبت شد. حالا فایل اول را بفرست.")
         if step in ("awaiting_first_file", "awaiting_next_file"):
             if message.video: file_id = message.video.file_id
@@ -549,20 +2041,23 @@ async def admin_media_router(client: Client, message: Message):
                 return await message.reply("⚠️ فقط ویدیو/سند/صوت قابل قبول است.")
             data["pending_file_id"] = file_id
             data["step"] = "awaiting_caption"
+            await upload_data.set(uid, data)
             return await message.reply("📝 کپشن این فایل را بفرست:")
         return
 
 # ---------------------- پایان/ادامه آپلود (دکمه‌های more_yes/no) ----------------------
-@bot.on_callback_query(filters.user(ADMIN_IDS) & filters.regex(r"^more_"))
+@callbacks.route("more_yes")
+@callbacks.route("more_no")
 async def upload_more_files_cb(client: Client, cq: CallbackQuery):
     """ادامه دادن افزودن فایل (بله/خیر) و در نهایت ذخیره‌ی فیلم"""
-    uid = cq.from_user.id; data = upload_data.get(uid)
+    uid = cq.from_user.id; data = await upload_data.get(uid)
     if not data:
         return await cq.answer("⚠️ اطلاعات آپلود پیدا نشد.", show_alert=True)
 
     if cq.data == "more_yes":
         await cq.answer(); data["step"] = "awaiting_next_file"
         data.pop("pending_file_id", None); data.pop("current_file", None)
+        await upload_data.set(uid, data)
         return await cq.message.reply("📤 فایل بعدی را بفرست.")
 
     if cq.data == "more_no":
@@ -575,7 +2070,7 @@ async def upload_more_files_cb(client: Client, cq: CallbackQuery):
             "timestamp": datetime.now(timezone.utc).replace(tzinfo=None),
             "files": data["files"]
         }
-        films_col.update_one({"film_id": film_id}, {"$set": film_doc}, upsert=True)
+        film_id = await insert_film(film_doc)
         deep_link = f"https://t.me/{BOT_USERNAME}?start={film_id}"
         await cq.message.reply(f"✅ ذخیره شد.\n🎬 {film_doc['title']}\n📂 فایل‌ها: {len(film_doc['files'])}\n🔗 {deep_link}")
         await cq.message.reply(
@@ -585,43 +2080,40 @@ async def upload_more_files_cb(client: Client, cq: CallbackQuery):
                 [InlineKeyboardButton("📣 ارسال فوری", callback_data=f"sched_no::{film_id}")]
             ])
         )
-        upload_data.pop(uid, None)
+        await upload_data.pop(uid)
 
 # ---------------------- زمان‌بندی و انتشار فوری ----------------------
-@bot.on_callback_query(filters.regex(r"^sched_yes::(.+)$") & filters.user(ADMIN_IDS))
-async def ask_schedule_date(client: Client, cq: CallbackQuery):
+@callbacks.route("sched_yes")
+async def ask_schedule_date(client: Client, cq: CallbackQuery, film_id: str):
     await cq.answer()
-    film_id = cq.data.split("::")[1]
-    schedule_data[cq.from_user.id] = {"film_id": film_id, "step": "date"}
+    await schedule_data.set(cq.from_user.id, {"film_id": film_id, "step": "date"})
     await cq.message.reply("📅 تاریخ (YYYY-MM-DD):")
 
-@bot.on_callback_query(filters.regex(r"^sched_no::(.+)$") & filters.user(ADMIN_IDS))
-async def ask_publish_immediate(client: Client, cq: CallbackQuery):
+@callbacks.route("sched_no")
+async def ask_publish_immediate(client: Client, cq: CallbackQuery, film_id: str):
     await cq.answer()
-    film_id = cq.data.split("::")[1]
     rows = [[InlineKeyboardButton(title, callback_data=f"film_pub_go::{film_id}::{chat_id}")]
             for title, chat_id in TARGET_CHANNELS.items()]
     rows.append([InlineKeyboardButton("❌ لغو", callback_data="pub_cancel")])
     await cq.message.reply("📣 ارسال فوری؟ کانال را انتخاب کن:", reply_markup=InlineKeyboardMarkup(rows))
 
-@bot.on_callback_query(filters.regex(r"^pub_cancel$") & filters.user(ADMIN_IDS))
+@callbacks.route("pub_cancel")
 async def pub_cancel_cb(client: Client, cq: CallbackQuery):
     await cq.answer(); await cq.message.edit_text("🚫 ارسال فوری لغو شد.")
 
-@bot.on_callback_query(filters.regex(r"^sched_cancel$") & filters.user(ADMIN_IDS))
+@callbacks.route("sched_cancel")
 async def sched_cancel_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); schedule_data.pop(cq.from_user.id, None)
+    await cq.answer(); await schedule_data.pop(cq.from_user.id)
     await cq.message.edit_text("⛔️ زمان‌بندی لغو شد.")
 
-@bot.on_callback_query(filters.regex(r"^sched_pick::(-?\d+)$") & filters.user(ADMIN_IDS))
-async def sched_pick_cb(client: Client, cq: CallbackQuery):
+@callbacks.route("sched_pick")
+async def sched_pick_cb(client: Client, cq: CallbackQuery, chat_id: int):
     """ثبت زمان‌بندی: ذخیره UTC naive برای کریستالی بودن مقایسه‌ها"""
     await cq.answer()
-    uid = cq.from_user.id; st = schedule_data.get(uid)
+    uid = cq.from_user.id; st = await schedule_data.get(uid)
     if not st or st.get("step") not in ("channel_await", "pick_channel"):
         return await cq.message.edit_text("⛔️ اطلاعات زمان‌بندی منقضی شده.")
 
-    chat_id  = int(cq.matches[0].group(1))
     date_str = st.get("date"); time_str = st.get("time"); film_id = st.get("film_id")
 
     try:
@@ -631,44 +2123,41 @@ async def sched_pick_cb(client: Client, cq: CallbackQuery):
     except ValueError:
         return await cq.answer("❌ تاریخ/ساعت نامعتبر.", show_alert=True)
 
-    film = films_col.find_one({"film_id": film_id})
+    film = await get_film(film_id)
     if not film:
-        schedule_data.pop(uid, None)
+        await schedule_data.pop(uid)
         return await cq.answer("⚠️ فیلم پیدا نشد.", show_alert=True)
 
-    scheduled_posts.insert_one({
-        "film_id": film_id, "title": film.get("title",""),
-        "channel_id": chat_id, "scheduled_time": dt_utc_naive
-    })
-    schedule_data.pop(uid, None)
+    post = {"film_id": film_id, "title": film.get("title",""), "channel_id": chat_id, "scheduled_time": dt_utc_naive}
+    await sched_repo.insert_one(post)
+    schedule_publisher.push(post)
+    await schedule_data.pop(uid)
     await cq.message.edit_text("✅ زمان‌بندی ذخیره شد.")
 
-@bot.on_callback_query(filters.regex(r"^film_pub_go::(.+)::(-?\d+)$") & filters.user(ADMIN_IDS))
-async def film_pub_go_cb(client: Client, cq: CallbackQuery):
+@callbacks.route("film_pub_go")
+async def film_pub_go_cb(client: Client, cq: CallbackQuery, film_id: str, channel_id: int):
     """انتشار فوری به کانال انتخابی + ثبت post_refs + کیبورد آمار/ری‌اکشن"""
     await cq.answer()
-    film_id, channel_id = cq.data.split("::")[1:]
-    channel_id = int(channel_id)
-    film = films_col.find_one({"film_id": film_id})
+    film = await get_film(film_id)
     if not film:
         return await cq.message.edit_text("❌ فیلم یافت نشد.")
-    caption = compose_channel_caption(film)
+    caption = film_caption(film)
     try:
         if film.get("cover_id"):
             sent = await client.send_photo(channel_id, film["cover_id"], caption=caption,
-                                           reply_markup=_reaction_keyboard(film_id, channel_id, 0))
+                                           reply_markup=await _reaction_keyboard(film_id, channel_id, 0))
         else:
-            sent = await client.send_message(channel_id, caption, reply_markup=_reaction_keyboard(film_id, channel_id, 0))
+            sent = await client.send_message(channel_id, caption, reply_markup=await _reaction_keyboard(film_id, channel_id, 0))
     except Exception as e:
         return await cq.message.edit_text(f"❌ خطا در ارسال: {e}")
     # ثبت مرجع پیام
-    post_refs.update_one({"film_id": film_id, "channel_id": channel_id}, {"$set": {"message_id": sent.id}}, upsert=True)
+    await save_post_ref(film_id, channel_id, sent.id)
     # آپدیت اولیه آمار ویو
     try:
         fresh = await client.get_messages(channel_id, sent.id)
         await client.edit_message_reply_markup(
             chat_id=channel_id, message_id=sent.id,
-            reply_markup=_reaction_keyboard(film_id, channel_id, sent.id, views=fresh.views or 0)
+            reply_markup=await _reaction_keyboard(film_id, channel_id, sent.id, views=fresh.views or 0)
         )
     except Exception:
         pass
@@ -693,55 +2182,147 @@ def _fmt_film_info(film: dict) -> str:
             f"📂 فایل‌ها: {len(film.get('files', []))}\n"
             f"🆔 {film.get('film_id','-')}")
 
-def _paginate(items, page, page_size=10):
-    """برگ‌بندی ساده لیست‌ها"""
-    total = len(items); start = (page - 1) * page_size; end = start + page_size
-    return items[start:end], total
+# ---------------------- 📄 برگ‌بندی keyset برای لیست‌های پنل ----------------------
+# به‌جای خواندن کل کالکشن و برش در پایتون، هر صفحه با کرسر (field, _id) و projection خوانده می‌شود.
+# callback: {prefix}{page} برای صفحه‌ی اول، {prefix}{page}::n|p::{ts36}::{oid} برای بعدی/قبلی (زیر ۶۴ بایت).
+PAGE_SIZE = 10
+
+def _b36(n: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"; out = ""
+    while True:
+        n, r = divmod(n, 36); out = digits[r] + out
+        if not n: return out
+
+def _cursor_of(doc: dict, field: str) -> str:
+    """کرسر فشرده‌ی یک سند: میلی‌ثانیه‌ی field به مبنای ۳۶ + _id"""
+    ts = doc.get(field) or datetime(1970, 1, 1)
+    return f"{_b36(int(ts.replace(tzinfo=timezone.utc).timestamp() * 1000))}::{doc['_id']}"
+
+async def keyset_page(repo: AsyncRepo, field: str, order: int, projection: dict,
+                      direction: str | None = None, ts36: str | None = None, oid: str | None = None):
+    """یک صفحه روی (field, _id) به ترتیب order؛ direction=n بعد از کرسر، p قبل از کرسر. خروجی: (آیتم‌ها، صفحه‌ی بیشتری هست؟)"""
+    flt, sort_order = {}, order
+    if direction:
+        t = datetime.fromtimestamp(int(ts36, 36) / 1000, timezone.utc).replace(tzinfo=None)
+        cmp = "$lt" if (order == -1) == (direction == "n") else "$gt"
+        flt = {"$or": [{field: {cmp: t}}, {field: t, "_id": {cmp: ObjectId(oid)}}]}
+        if direction == "p":
+            sort_order = -order
+    items = await repo.find_list(flt, projection, sort=[(field, sort_order), ("_id", sort_order)], limit=PAGE_SIZE + 1)
+    more = len(items) > PAGE_SIZE
+    items = items[:PAGE_SIZE]
+    if direction == "p":
+        items.reverse()
+    return items, more
+
+async def show_keyset_list(cq: CallbackQuery, page: int, direction: str, ts36: str, oid: str, *, repo: AsyncRepo, prefix: str, field: str, order: int,
+                           projection: dict, button, title: str, extra_rows=()):
+    """رندر یک لیست برگ‌بندی‌شده‌ی پنل (فیلم‌ها/Pending/زمان‌بندی‌ها) با ناوبری قبلی/بعدی"""
+    if direction and (direction not in ("n", "p") or not ts36.isalnum() or not ObjectId.is_valid(oid)):
+        return
+    items, more = await keyset_page(repo, field, order, projection, direction, ts36, oid)
+    if not items and page > 1:
+        return await cq.message.edit_text("⛔️ صفحه خالی است.", reply_markup=kb_admin_main())
+    total = await repo.estimated_document_count()
+    rows = [[button(it)] for it in items]
+    if direction == "p":
+        has_prev, has_next = more, True
+        if not more: page = 1
+    else:
+        has_prev, has_next = page > 1, more
+    nav = []
+    if has_prev and items:
+        nav.append(InlineKeyboardButton("⬅️ قبلی", callback_data=f"{prefix}{page-1}::p::{_cursor_of(items[0], field)}"))
+    if has_next and items:
+        nav.append(InlineKeyboardButton("بعدی ➡️", callback_data=f"{prefix}{page+1}::n::{_cursor_of(items[-1], field)}"))
+    if nav: rows.append(nav)
+    rows.extend(extra_rows)
+    rows.append([InlineKeyboardButton("🏠 منو اصلی", callback_data="admin_home")])
+    pages = max(1, -(-total // PAGE_SIZE))
+    await cq.message.edit_text(f"{title} (صفحه {page} از ~{pages})", reply_markup=InlineKeyboardMarkup(rows))
 
 @bot.on_message(filters.command("admin") & filters.user(ADMIN_IDS))
 async def admin_entry(client: Client, message: Message):
     """ورود به منوی ادمین"""
     await message.reply("🛠 پنل ادمین:", reply_markup=kb_admin_main())
 
-@bot.on_callback_query(filters.regex(r"^admin_home$") & filters.user(ADMIN_IDS))
+@bot.on_message(filters.command("cache") & filters.user(ADMIN_IDS))
+async def admin_cache_stats(client: Client, message: Message):
+    """نمایش وضعیت کش‌ها (اندازه/hit/miss)"""
+    indexed = sum(len(v) for v in _member_index.values())
+    await message.reply(
+        f"🧩 وضعیت کش‌ها:\n\n"
+        f"👥 عضویت: {member_cache.summary()}\n"
+        f"🎞 فیلم‌ها: {film_cache.summary()}\n"
+        f"📇 ایندکس عضویت: {'روشن' if MEMBERSHIP_INDEX else 'خاموش'} • {indexed} رکورد\n"
+        f"⌨️ رندر کیبورد: {keyboard_renderer.summary()}\n"
+        f"🔎 ایندکس جست‌وجو: {film_index.summary()}\n"
+        f"🔍 نتایج اینلاین: {inline_results_cache.summary()}\n"
+        f"♻️ تکراری منبع‌ها: {dedup_summary()}\n"
+        f"🚦 API: {api_gateway.summary()}"
+    )
+
+@bot.on_message(filters.command("dbaudit") & filters.user(ADMIN_IDS))
+async def admin_db_audit(client: Client, message: Message):
+    """گزارش explain() برای همه‌ی شکل‌های کوئری ربات"""
+    lines = await run_db(audit_query_shapes)
+    await message.reply("🗂 ممیزی کوئری‌ها:\n\n" + "\n".join(lines))
+
+@bot.on_message(filters.command("routes") & filters.user(ADMIN_IDS))
+async def admin_route_stats(client: Client, message: Message):
+    """تعداد و زمان اجرای هر مسیر callback"""
+    lines = callbacks.report()
+    await message.reply("🧭 مسیرهای callback:\n\n" + ("\n".join(lines) or "—"))
+
+@bot.on_message(filters.command("top") & filters.user(ADMIN_IDS))
+async def admin_top_films(client: Client, message: Message):
+    """/top 24h 10 یا /top 7d — پرطرفدارترین فیلم‌های یک بازه از روی سطل‌های زمانی"""
+    args = message.command[1:]
+    m = re.match(r"^(\d+)([hd])$", args[0].lower()) if args else None
+    if args and not m:
+        return await message.reply("⚠️ فرمت: /top 24h 10 یا /top 7d")
+    amount, unit = (int(m.group(1)), m.group(2)) if m else (24, "h")
+    limit = int(args[1]) if len(args) > 1 and args[1].isdigit() else 10
+    start = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=amount * (24 if unit == "d" else 1))
+    rows = await window_top(start, limit=min(limit, 50))
+    if not rows:
+        return await message.reply("ℹ️ در این بازه آماری ثبت نشده.")
+    titles = {f["film_id"]: f.get("title") for f in await films_repo.find_list(
+        {"film_id": {"$in": [r["_id"] for r in rows]}}, {"_id": 0, "film_id": 1, "title": 1})}
+    lines = [f"{i}. {titles.get(r['_id']) or r['_id']} — 📥 {r['downloads']} • 🔁 {r['shares']} • 💬 {r['reactions']}"
+             for i, r in enumerate(rows, 1)]
+    await message.reply(f"🏆 برترین‌ها در {amount}{unit}:\n\n" + "\n".join(lines))
+
+@callbacks.route("admin_home")
 async def admin_home_cb(client: Client, cq: CallbackQuery):
     await cq.answer(); await cq.message.edit_text("🛠 پنل ادمین:", reply_markup=kb_admin_main())
 
-@bot.on_callback_query(filters.regex(r"^admin_films_(\d+)$") & filters.user(ADMIN_IDS))
-async def admin_films_list(client: Client, cq: CallbackQuery):
+@callbacks.route("admin_films_", prefix=True)
+async def admin_films_list(client: Client, cq: CallbackQuery, page: int, direction: str = "", ts36: str = "", oid: str = ""):
     """لیست فیلم‌ها با برگ‌بندی"""
     await cq.answer()
-    page = int(cq.matches[0].group(1))
-    films = list(films_col.find().sort("timestamp", -1))
-    page_items, total = _paginate(films, page, 10)
-    if not page_items and page > 1:
-        return await cq.message.edit_text("⛔️ صفحه خالی است.", reply_markup=kb_admin_main())
-    rows = []
-    for f in page_items:
+    def _btn(f):
         title = f.get("title") or f.get("film_id")
         year = f.get("year", "")
-        rows.append([InlineKeyboardButton(f"{title} {f'({year})' if year else ''}", callback_data=f"film_open::{f['film_id']}")])
-    nav = []
-    if page > 1: nav.append(InlineKeyboardButton("⬅️ قبلی", callback_data=f"admin_films_{page-1}"))
-    if page * 10 < total: nav.append(InlineKeyboardButton("بعدی ➡️", callback_data=f"admin_films_{page+1}"))
-    if nav: rows.append(nav)
-    rows.append([InlineKeyboardButton("🔎 جست‌وجو", callback_data="admin_search")])
-    rows.append([InlineKeyboardButton("🏠 منو اصلی", callback_data="admin_home")])
-    await cq.message.edit_text("🎬 لیست فیلم‌ها:", reply_markup=InlineKeyboardMarkup(rows))
-
-@bot.on_callback_query(filters.regex(r"^admin_search$") & filters.user(ADMIN_IDS))
+        return InlineKeyboardButton(f"{title} {f'({year})' if year else ''}", callback_data=f"film_open::{f['film_id']}")
+    await show_keyset_list(
+        cq, page, direction, ts36, oid, repo=films_repo, prefix="admin_films_", field="timestamp", order=-1,
+        projection={"film_id": 1, "title": 1, "year": 1, "timestamp": 1}, button=_btn,
+        title="🎬 لیست فیلم‌ها:", extra_rows=[[InlineKeyboardButton("🔎 جست‌وجو", callback_data="admin_search")]]
+    )
+
+@callbacks.route("admin_search")
 async def admin_search_cb(client: Client, cq: CallbackQuery):
     """شروع جست‌وجو در پنل ادمین"""
     await cq.answer()
-    admin_edit_state[cq.from_user.id] = {"mode": "search"}
+    await admin_edit_state.set(cq.from_user.id, {"mode": "search"})
     await cq.message.edit_text("🔎 عبارت جست‌وجو را بفرست (عنوان/ژانر/سال/film_id)...")
 
-@bot.on_callback_query(filters.regex(r"^film_open::(.+)$") & filters.user(ADMIN_IDS))
-async def film_open_cb(client: Client, cq: CallbackQuery):
+@callbacks.route("film_open")
+async def film_open_cb(client: Client, cq: CallbackQuery, fid: str):
     """نمایش جزییات یک فیلم + منوی عملیات"""
     await cq.answer()
-    fid = cq.matches[0].group(1)
-    film = films_col.find_one({"film_id": fid})
+    film = await get_film(fid)
     if not film:
         return await cq.message.edit_text("❌ فیلم یافت نشد.", reply_markup=kb_admin_main())
     info = _fmt_film_info(film)
@@ -758,34 +2339,34 @@ async def film_open_cb(client: Client, cq: CallbackQuery):
     ])
     await cq.message.edit_text(info, reply_markup=kb)
 
-@bot.on_callback_query(filters.regex(r"^film_edit_title::(.+)$") & filters.user(ADMIN_IDS))
-async def film_edit_title_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1)
-    admin_edit_state[cq.from_user.id] = {"mode": "edit_title", "film_id": fid}
+@callbacks.route("film_edit_title")
+async def film_edit_title_cb(client: Client, cq: CallbackQuery, fid: str):
+    await cq.answer()
+    await admin_edit_state.set(cq.from_user.id, {"mode": "edit_title", "film_id": fid})
     await cq.message.edit_text("🖊 عنوان جدید را بفرست:")
 
-@bot.on_callback_query(filters.regex(r"^film_edit_genre::(.+)$") & filters.user(ADMIN_IDS))
-async def film_edit_genre_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1)
-    admin_edit_state[cq.from_user.id] = {"mode": "edit_genre", "film_id": fid}
+@callbacks.route("film_edit_genre")
+async def film_edit_genre_cb(client: Client, cq: CallbackQuery, fid: str):
+    await cq.answer()
+    await admin_edit_state.set(cq.from_user.id, {"mode": "edit_genre", "film_id": fid})
     await cq.message.edit_text("🎭 ژانر جدید را بفرست:")
 
-@bot.on_callback_query(filters.regex(r"^film_edit_year::(.+)$") & filters.user(ADMIN_IDS))
-async def film_edit_year_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1)
-    admin_edit_state[cq.from_user.id] = {"mode": "edit_year", "film_id": fid}
+@callbacks.route("film_edit_year")
+async def film_edit_year_cb(client: Client, cq: CallbackQuery, fid: str):
+    await cq.answer()
+    await admin_edit_state.set(cq.from_user.id, {"mode": "edit_year", "film_id": fid})
     await cq.message.edit_text("📆 سال جدید را بفرست (مثلاً 2024):")
 
-@bot.on_callback_query(filters.regex(r"^film_replace_cover::(.+)$") & filters.user(ADMIN_IDS))
-async def film_replace_cover_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1)
-    admin_edit_state[cq.from_user.id] = {"mode": "replace_cover", "film_id": fid}
+@callbacks.route("film_replace_cover")
+async def film_replace_cover_cb(client: Client, cq: CallbackQuery, fid: str):
+    await cq.answer()
+    await admin_edit_state.set(cq.from_user.id, {"mode": "replace_cover", "film_id": fid})
     await cq.message.edit_text("🖼 عکس کاور جدید را بفرست:")
 
-@bot.on_callback_query(filters.regex(r"^film_files::(.+)$") & filters.user(ADMIN_IDS))
-async def film_files_list(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1)
-    film = films_col.find_one({"film_id": fid})
+@callbacks.route("film_files")
+async def film_files_list(client: Client, cq: CallbackQuery, fid: str):
+    await cq.answer()
+    film = await get_film(fid)
     if not film:
         return await cq.message.edit_text("❌ فیلم یافت نشد.", reply_markup=kb_admin_main())
     files = film.get("files", [])
@@ -794,11 +2375,14 @@ async def film_files_list(client: Client, cq: CallbackQuery):
     rows.append([InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_open::{fid}")])
     await cq.message.edit_text("📂 فایل‌ها:", reply_markup=InlineKeyboardMarkup(rows))
 
-@bot.on_callback_query(filters.regex(r"^film_file_open::(.+)::(\d+)$") & filters.user(ADMIN_IDS))
-async def film_file_open_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1); idx = int(cq.matches[0].group(2))
-    film = films_col.find_one({"film_id": fid}); files = film.get("files", [])
-    if idx < 0 or idx >= len(files):
+@callbacks.route("film_file_open")
+async def film_file_open_cb(client: Client, cq: CallbackQuery, fid: str, idx: Index):
+    await cq.answer()
+    film = await get_film(fid)
+    if not film:
+        return await cq.message.edit_text("❌ فیلم یافت نشد.", reply_markup=kb_admin_main())
+    files = film.get("files", [])
+    if idx >= len(files):
         return await cq.message.edit_text("❌ اندیس فایل نامعتبر.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_files::{fid}")]]))
     f = files[idx]
     cap = f.get("caption", ""); q = f.get("quality", "")
@@ -812,97 +2396,129 @@ async def film_file_open_cb(client: Client, cq: CallbackQuery):
     ])
     await cq.message.edit_text(info, reply_markup=kb)
 
-@bot.on_callback_query(filters.regex(r"^file_edit_caption::(.+)::(\d+)$") & filters.user(ADMIN_IDS))
-async def file_edit_caption_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1); idx = int(cq.matches[0].group(2))
-    admin_edit_state[cq.from_user.id] = {"mode": "file_edit_caption", "film_id": fid, "file_index": idx}
+@callbacks.route("file_edit_caption")
+async def file_edit_caption_cb(client: Client, cq: CallbackQuery, fid: str, idx: Index):
+    await cq.answer()
+    await admin_edit_state.set(cq.from_user.id, {"mode": "file_edit_caption", "film_id": fid, "file_index": idx})
     await cq.message.edit_text("📝 کپشن جدید را بفرست:")
 
-@bot.on_callback_query(filters.regex(r"^file_edit_quality::(.+)::(\d+)$") & filters.user(ADMIN_IDS))
-async def file_edit_quality_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1); idx = int(cq.matches[0].group(2))
-    admin_edit_state[cq.from_user.id] = {"mode": "file_edit_quality", "film_id": fid, "file_index": idx}
+@callbacks.route("file_edit_quality")
+async def file_edit_quality_cb(client: Client, cq: CallbackQuery, fid: str, idx: Index):
+    await cq.answer()
+    await admin_edit_state.set(cq.from_user.id, {"mode": "file_edit_quality", "film_id": fid, "file_index": idx})
     await cq.message.edit_text("🎞 کیفیت جدید را بفرست (مثلاً 1080p):")
 
-@bot.on_callback_query(filters.regex(r"^file_replace::(.+)::(\d+)$") & filters.user(ADMIN_IDS))
-async def file_replace_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1); idx = int(cq.matches[0].group(2))
-    admin_edit_state[cq.from_user.id] = {"mode": "file_replace", "film_id": fid, "file_index": idx}
+@callbacks.route("file_replace")
+async def file_replace_cb(client: Client, cq: CallbackQuery, fid: str, idx: Index):
+    await cq.answer()
+    await admin_edit_state.set(cq.from_user.id, {"mode": "file_replace", "film_id": fid, "file_index": idx})
     await cq.message.edit_text("📤 فایل جدید (ویدیو/سند/صوت) را بفرست:")
 
-@bot.on_callback_query(filters.regex(r"^file_delete_confirm::(.+)::(\d+)$") & filters.user(ADMIN_IDS))
-async def file_delete_confirm_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1); idx = int(cq.matches[0].group(2))
+@callbacks.route("file_delete_confirm")
+async def file_delete_confirm_cb(client: Client, cq: CallbackQuery, fid: str, idx: Index):
+    await cq.answer()
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("❌ لغو", callback_data=f"film_file_open::{fid}::{idx}")],
         [InlineKeyboardButton("🗑 حذف", callback_data=f"file_delete::{fid}::{idx}")]
     ])
     await cq.message.edit_text("❗️ مطمئنی حذف شود؟", reply_markup=kb)
 
-@bot.on_callback_query(filters.regex(r"^file_delete::(.+)::(\d+)$") & filters.user(ADMIN_IDS))
-async def file_delete_do_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1); idx = int(cq.matches[0].group(2))
-    film = films_col.find_one({"film_id": fid}); files = film.get("files", [])
-    if idx < 0 or idx >= len(files):
+@callbacks.route("file_delete")
+async def file_delete_do_cb(client: Client, cq: CallbackQuery, fid: str, idx: Index):
+    await cq.answer()
+    film = await get_film(fid)
+    if not film:
+        return await cq.message.edit_text("❌ فیلم یافت نشد.", reply_markup=kb_admin_main())
+    files = list(film.get("files", []))   # کپی؛ سند کش دست نخورد
+    if idx >= len(files):
         return await cq.message.edit_text("❌ اندیس فایل نامعتبر.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_files::{fid}")]]))
-    files.pop(idx); films_col.update_one({"film_id": fid}, {"$set": {"files": files}})
+    files.pop(idx); await update_film(fid, {"$set": {"files": files}})
     await cq.message.edit_text("✅ فایل حذف شد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_files::{fid}")]]))
 
-@bot.on_callback_query(filters.regex(r"^film_file_add::(.+)$") & filters.user(ADMIN_IDS))
-async def film_file_add_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1)
-    admin_edit_state[cq.from_user.id] = {"mode": "file_add_pickfile", "film_id": fid}
+@callbacks.route("film_file_add")
+async def film_file_add_cb(client: Client, cq: CallbackQuery, fid: str):
+    await cq.answer()
+    await admin_edit_state.set(cq.from_user.id, {"mode": "file_add_pickfile", "film_id": fid})
     await cq.message.edit_text("📤 فایل جدید (ویدیو/سند/صوت) را بفرست:")
 
-@bot.on_callback_query(filters.regex(r"^film_delete_confirm::(.+)$") & filters.user(ADMIN_IDS))
-async def film_delete_confirm_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1)
+@callbacks.route("film_delete_confirm")
+async def film_delete_confirm_cb(client: Client, cq: CallbackQuery, fid: str):
+    await cq.answer()
     kb = InlineKeyboardMarkup([
         [InlineKeyboardButton("❌ لغو", callback_data=f"film_open::{fid}")],
         [InlineKeyboardButton("🗑 حذف قطعی", callback_data=f"film_delete::{fid}")]
     ])
     await cq.message.edit_text("❗️ حذف کل فیلم و فایل‌ها؟", reply_markup=kb)
 
-@bot.on_callback_query(filters.regex(r"^film_delete::(.+)$") & filters.user(ADMIN_IDS))
-async def film_delete_do_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1)
-    films_col.delete_one({"film_id": fid})
+@callbacks.route("film_delete")
+async def film_delete_do_cb(client: Client, cq: CallbackQuery, fid: str):
+    await cq.answer()
+    await films_repo.delete_one({"film_id": fid}); invalidate_film(fid); film_index.remove(fid)
     await cq.message.edit_text("✅ فیلم حذف شد.", reply_markup=kb_admin_main())
 
-@bot.on_callback_query(filters.regex(r"^film_pub_pick::(.+)$") & filters.user(ADMIN_IDS))
-async def film_pub_pick_channel(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1)
+@callbacks.route("film_pub_pick")
+async def film_pub_pick_channel(client: Client, cq: CallbackQuery, fid: str):
+    await cq.answer()
     rows = [[InlineKeyboardButton(title, callback_data=f"film_pub_go::{fid}::{chat_id}")]
             for title, chat_id in TARGET_CHANNELS.items()]
     await cq.message.edit_text("📣 مقصد انتشار فوری را انتخاب کن:", reply_markup=InlineKeyboardMarkup(rows + [[InlineKeyboardButton("↩️ بازگشت", callback_data=f"film_open::{fid}")]]))
 
-@bot.on_callback_query(filters.regex(r"^film_sched_start::(.+)$") & filters.user(ADMIN_IDS))
-async def film_sched_start_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); fid = cq.matches[0].group(1)
-    schedule_data[cq.from_user.id] = {"film_id": fid, "step": "date"}
+@callbacks.route("film_sched_start")
+async def film_sched_start_cb(client: Client, cq: CallbackQuery, fid: str):
+    await cq.answer()
+    await schedule_data.set(cq.from_user.id, {"film_id": fid, "step": "date"})
     await cq.message.edit_text("📅 تاریخ (YYYY-MM-DD):")
 
-@bot.on_callback_query(filters.regex(r"^admin_pending_(\d+)$") & filters.user(ADMIN_IDS))
-async def admin_pending_list(client: Client, cq: CallbackQuery):
+@callbacks.route("admin_pending_", prefix=True)
+async def admin_pending_list(client: Client, cq: CallbackQuery, page: int, direction: str = "", ts36: str = "", oid: str = ""):
     """نمایش لیست Pending"""
     await cq.answer()
-    page = int(cq.matches[0].group(1))
-    posts = list(pending_posts.find().sort("timestamp", -1))
-    page_items, total = _paginate(posts, page, 10)
-    rows = []
-    for p in page_items:
-        rows.append([InlineKeyboardButton(f"{p.get('title')} • {p.get('source')}", callback_data=f"pending_open::{p['_id']}")])
-    nav = []
-    if page > 1: nav.append(InlineKeyboardButton("⬅️ قبلی", callback_data=f"admin_pending_{page-1}"))
-    if page * 10 < total: nav.append(InlineKeyboardButton("بعدی ➡️", callback_data=f"admin_pending_{page+1}"))
-    if nav: rows.append(nav)
-    rows.append([InlineKeyboardButton("🏠 منو اصلی", callback_data="admin_home")])
-    await cq.message.edit_text("📌 Pending Posts:", reply_markup=InlineKeyboardMarkup(rows))
+    await show_keyset_list(
+        cq, page, direction, ts36, oid, repo=pending_repo, prefix="admin_pending_", field="timestamp", order=-1,
+        projection={"title": 1, "source": 1, "timestamp": 1},
+        button=lambda p: InlineKeyboardButton(f"{p.get('title')} • {p.get('source')}", callback_data=f"pending_open::{p['_id']}"),
+        title="📌 Pending Posts:"
+    )
+
+@callbacks.route("admin_sched_list_", prefix=True)
+async def admin_sched_list(client: Client, cq: CallbackQuery, page: int, direction: str = "", ts36: str = "", oid: str = ""):
+    """لیست پست‌های زمان‌بندی‌شده (نزدیک‌ترین اول)"""
+    await cq.answer()
+    def _btn(p):
+        local = p["scheduled_time"].replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE))
+        return InlineKeyboardButton(f"{p.get('title') or p.get('film_id')} • {local:%m-%d %H:%M}", callback_data=f"sched_open::{p['_id']}")
+    await show_keyset_list(
+        cq, page, direction, ts36, oid, repo=sched_repo, prefix="admin_sched_list_", field="scheduled_time", order=1,
+        projection={"film_id": 1, "title": 1, "channel_id": 1, "scheduled_time": 1}, button=_btn,
+        title="⏰ زمان‌بندی‌ها:"
+    )
+
+@callbacks.route("sched_open")
+async def sched_open_cb(client: Client, cq: CallbackQuery, sid: ObjectId):
+    await cq.answer()
+    post = await sched_repo.find_one({"_id": sid})
+    if not post:
+        return await cq.message.edit_text("❌ زمان‌بندی پیدا نشد.", reply_markup=kb_admin_main())
+    local = post["scheduled_time"].replace(tzinfo=timezone.utc).astimezone(ZoneInfo(TIMEZONE))
+    info = f"⏰ {post.get('title') or post['film_id']}\n🕒 {local:%Y-%m-%d %H:%M} ({TIMEZONE})\n📡 {post['channel_id']}\n🆔 {post['film_id']}"
+    if post.get("attempts"):
+        info += f"\n{'❌ ناموفق' if post.get('failed') else '🔁 تلاش'}: {post['attempts']} • {post.get('error', '')}"
+    kb = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🗑 لغو زمان‌بندی", callback_data=f"sched_del::{sid}")],
+        [InlineKeyboardButton("↩️ بازگشت", callback_data="admin_sched_list_1")]
+    ])
+    await cq.message.edit_text(info, reply_markup=kb)
+
+@callbacks.route("sched_del")
+async def sched_del_cb(client: Client, cq: CallbackQuery, sid: ObjectId):
+    await cq.answer()
+    await sched_repo.delete_one({"_id": sid})
+    await cq.message.edit_text("🗑 زمان‌بندی لغو شد.", reply_markup=kb_admin_main())
 
-@bot.on_callback_query(filters.regex(r"^pending_open::(.+)$") & filters.user(ADMIN_IDS))
-async def pending_open_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); pid = cq.matches[0].group(1)
-    post = pending_posts.find_one({"_id": ObjectId(pid)})
+@callbacks.route("pending_open")
+async def pending_open_cb(client: Client, cq: CallbackQuery, pid: ObjectId):
+    await cq.answer()
+    post = await pending_repo.find_one({"_id": pid})
     if not post:
         return await cq.message.edit_text("❌ Pending پیدا نشد.", reply_markup=kb_admin_main())
     info = f"🎬 {post['title']}\n📡 منبع: {post['source']}\n🆔 {post['film_id']}"
@@ -913,30 +2529,30 @@ async def pending_open_cb(client: Client, cq: CallbackQuery):
     rows.append([InlineKeyboardButton("↩️ بازگشت", callback_data="admin_pending_1")])
     await cq.message.edit_text(info, reply_markup=InlineKeyboardMarkup(rows))
 
-@bot.on_callback_query(filters.regex(r"^pending_send::(.+)::(-?\d+)$") & filters.user(ADMIN_IDS))
-async def pending_send_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); pid = cq.matches[0].group(1); chat_id = int(cq.matches[0].group(2))
-    post = pending_posts.find_one({"_id": ObjectId(pid)})
+@callbacks.route("pending_send")
+async def pending_send_cb(client: Client, cq: CallbackQuery, pid: ObjectId, chat_id: int):
+    await cq.answer()
+    post = await pending_repo.find_one({"_id": pid})
     if not post: return await cq.answer("❌ پیدا نشد", show_alert=True)
-    film = films_col.find_one({"film_id": post["film_id"]})
+    film = await get_film(post["film_id"])
     if not film: return await cq.answer("❌ فیلم پیدا نشد", show_alert=True)
-    caption = compose_channel_caption(film)
-    sent = await client.send_message(chat_id, caption, reply_markup=_reaction_keyboard(film["film_id"], chat_id, 0))
-    post_refs.update_one({"film_id": film["film_id"], "channel_id": chat_id}, {"$set": {"message_id": sent.id}}, upsert=True)
-    pending_posts.delete_one({"_id": ObjectId(pid)})
+    caption = film_caption(film)
+    sent = await client.send_message(chat_id, caption, reply_markup=await _reaction_keyboard(film["film_id"], chat_id, 0))
+    await save_post_ref(film["film_id"], chat_id, sent.id)
+    await pending_repo.delete_one({"_id": pid})
     await cq.message.edit_text("✅ ارسال شد و از Pending حذف شد.", reply_markup=kb_admin_main())
 
-@bot.on_callback_query(filters.regex(r"^pending_delete::(.+)$") & filters.user(ADMIN_IDS))
-async def pending_delete_cb(client: Client, cq: CallbackQuery):
-    await cq.answer(); pid = cq.matches[0].group(1)
-    pending_posts.delete_one({"_id": ObjectId(pid)})
+@callbacks.route("pending_delete")
+async def pending_delete_cb(client: Client, cq: CallbackQuery, pid: ObjectId):
+    await cq.answer()
+    await pending_repo.delete_one({"_id": pid})
     await cq.message.edit_text("🗑 حذف شد.", reply_markup=kb_admin_main())
 
-@bot.on_callback_query(filters.regex(r"^admin_export_csv$") & filters.user(ADMIN_IDS))
+@callbacks.route("admin_export_csv")
 async def admin_export_csv_cb(client: Client, cq: CallbackQuery):
     """خروجی CSV از لیست فیلم‌ها"""
     await cq.answer()
-    films = list(films_col.find().sort("timestamp", -1))
+    films = await films_repo.find_list(sort=[("timestamp", -1)])
     buf = io.StringIO(); w = csv.writer(buf)
     w.writerow(["film_id", "title", "genre", "year", "files_count", "timestamp"])
     for f in films:
@@ -949,131 +2565,483 @@ async def admin_export_csv_cb(client: Client, cq: CallbackQuery):
     await client.send_document(cq.message.chat.id, document=bio, caption="📥 خروجی CSV")
 
 # ---------------------- ⏱ زمان‌بند خودکار ارسال‌های زمان‌بندی‌شده ----------------------
+# یک min-heap درون‌حافظه از (زمان، _id) دقیقاً سر موعد نزدیک‌ترین پست بیدار می‌شود (نه polling دقیقه‌ای).
+# هر پست پیش از ارسال با find_one_and_update اتمیک «اجاره» می‌شود (owner + lease_until) تا اجرای کند
+# یا چند نسخه‌ی هم‌زمان ربات دوبار منتشر نکنند. کانال‌های مختلف موازی، هر کانال ترتیبی.
+# اجاره داخل قفل کانال گرفته می‌شود و تا پایان ارسال هر SCHED_LEASE_S/3 ثانیه تمدید می‌شود؛
+# حذف پست فقط وقتی انجام می‌شود که اجاره هنوز مال همین worker و منقضی‌نشده باشد.
+# شکست → تلاش دوباره با backoff نمایی؛ بعد از SCHED_MAX_ATTEMPTS پست failed می‌شود و به ادمین خبر داده می‌شود.
+# جاب دقیقه‌ای send_scheduled_posts فقط heap را با Mongo همگام می‌کند (پست‌های نسخه‌های دیگر/اجاره‌های منقضی).
+SCHED_LEASE_S       = _get_env_int("SCHED_LEASE_S", required=False, default=120)
+SCHED_MAX_ATTEMPTS  = _get_env_int("SCHED_MAX_ATTEMPTS", required=False, default=5)
+SCHED_HORIZON_S     = 300      # پست‌های تا ۵ دقیقه‌ی آینده در heap بارگذاری می‌شوند
+
+class SchedulePublisher:
+    """صف زمان‌دار انتشار با اجاره‌ی اتمیک، قفل هر کانال و retry"""
+    def __init__(self):
+        self.heap: list[tuple[datetime, str]] = []
+        self.queued: set[str] = set()
+        self.inflight: set[str] = set()                 # پست‌هایی که همین worker در حال انتشارشان است
+        self.channel_locks: dict[int, asyncio.Lock] = {}
+        self._kick = asyncio.Event()
+        self._task = None
+
+    def push(self, post: dict):
+        sid = str(post["_id"])
+        if sid in self.queued or sid in self.inflight:
+            return
+        self.queued.add(sid)
+        heapq.heappush(self.heap, (post["scheduled_time"], sid))
+        if self.heap[0][1] == sid:
+            self._kick.set()                                # زودتر از تایمر فعلی است
+
+    async def sync(self):
+        """بارگذاری پست‌های سررسیده/نزدیک از Mongo در heap"""
+        horizon = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=SCHED_HORIZON_S)
+        posts = await sched_repo.find_list({"scheduled_time": {"$lte": horizon}, "failed": {"$ne": True}},
+                                           {"scheduled_time": 1}, sort=[("scheduled_time", ASC), ("_id", ASC)])
+        for p in posts:
+            self.push(p)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            while self.heap and self.heap[0][0] <= now:
+                _, sid = heapq.heappop(self.heap)
+                self.queued.discard(sid)
+                if sid not in self.inflight:
+                    asyncio.create_task(self._claim_and_publish(ObjectId(sid)))
+            wait = (self.heap[0][0] - now).total_seconds() if self.heap else SCHED_HORIZON_S
+            self._kick.clear()
+            try:
+                await asyncio.wait_for(self._kick.wait(), timeout=max(wait, 0.05))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim_and_publish(self, oid: ObjectId):
+        sid = str(oid)
+        self.inflight.add(sid)
+        try:
+            head = await sched_repo.find_one({"_id": oid}, {"channel_id": 1})
+            if not head:
+                return
+            # اول قفل کانال، بعد اجاره: انتظار پشت پست‌های دیگر همان کانال از عمر اجاره کم نمی‌کند
+            async with self.channel_locks.setdefault(head["channel_id"], asyncio.Lock()):
+                post = await self._claim(oid)
+                if not post:
+                    return                                  # لغو شده یا نسخه‌ی دیگری برداشته
+                renew = asyncio.create_task(self._renew(oid))
+                try:
+                    await self._publish(post)
+                except Exception as e:
+                    return await self._retry(post, e)
+                finally:
+                    renew.cancel()
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            res = await sched_repo.delete_one({"_id": oid, "owner": WORKER_ID, "lease_until": {"$gt": now}})
+            if not res.deleted_count:
+                print("⚠️ schedule lease lost before delete:", sid)
+        except Exception as e:
+            print("⚠️ schedule publish error:", e)
+        finally:
+            self.inflight.discard(sid)
+
+    async def _claim(self, oid: ObjectId) -> dict | None:
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return await sched_repo.find_one_and_update(
+            {"_id": oid, "scheduled_time": {"$lte": now}, "failed": {"$ne": True},
+             "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lt": now}}]},
+            {"$set": {"owner": WORKER_ID, "lease_until": now + timedelta(seconds=SCHED_LEASE_S)}},
+            return_document=ReturnDocument.AFTER)
+
+    async def _renew(self, oid: ObjectId):
+        """تمدید اجاره تا وقتی ارسال (مثلاً در صف API) طول می‌کشد"""
+        while True:
+            await asyncio.sleep(SCHED_LEASE_S / 3)
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            try:
+                await sched_repo.update_one({"_id": oid, "owner": WORKER_ID},
+                                            {"$set": {"lease_until": now + timedelta(seconds=SCHED_LEASE_S)}})
+            except Exception as e:
+                print("⚠️ schedule lease renew error:", e)
+
+    async def _publish(self, post: dict):
+        film = await get_film(post["film_id"])
+        if not film:
+            return                                          # فیلم حذف شده؛ زمان‌بندی هم پاک می‌شود
+        ch = post["channel_id"]
+        caption = film_caption(film)
+        if film.get("cover_id"):
+            sent = await bot.send_photo(ch, film["cover_id"], caption=caption,
+                                        reply_markup=await _reaction_keyboard(film["film_id"], ch, 0))
+        else:
+            sent = await bot.send_message(ch, caption, reply_markup=await _reaction_keyboard(film["film_id"], ch, 0))
+        await save_post_ref(film["film_id"], ch, sent.id)
+        keyboard_renderer.request(film["film_id"], ch, sent.id)   # کیبورد با message_id واقعی و ویو
+
+    async def _retry(self, post: dict, err: Exception):
+        attempts = int(post.get("attempts", 0)) + 1
+        print(f"❌ scheduled send error ({attempts}/{SCHED_MAX_ATTEMPTS}):", err)
+        if attempts >= SCHED_MAX_ATTEMPTS:
+            await sched_repo.update_one({"_id": post["_id"], "owner": WORKER_ID}, {"$set": {"failed": True, "attempts": attempts, "error": str(err)[:300]},
+                                                               "$unset": {"owner": "", "lease_until": ""}})
+            for admin_id in ADMIN_IDS:
+                try:
+                    await bot.send_message(admin_id, f"⚠️ انتشار زمان‌بندی‌شده شکست خورد:\n🎬 {post.get('title') or post['film_id']}\n📡 {post['channel_id']}\n{err}")
+                except Exception:
+                    pass
+            return
+        wait = getattr(err, "value", None) if isinstance(err, FloodWait) else min(30 * 2 ** (attempts - 1), 1800)
+        nxt = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=int(wait or 30))
+        await sched_repo.update_one({"_id": post["_id"], "owner": WORKER_ID}, {"$set": {"scheduled_time": nxt, "attempts": attempts, "error": str(err)[:300]},
+                                                           "$unset": {"owner": "", "lease_until": ""}})
+        self.push({"_id": post["_id"], "scheduled_time": nxt})
+
+schedule_publisher = SchedulePublisher()
+
+@leader_only
 async def send_scheduled_posts():
-    """هر دقیقه: پست‌هایی که زمانشان رسیده را ارسال می‌کند"""
+    """هر دقیقه: همگام‌سازی heap با Mongo (ارسال خودِ پست‌ها سر موعد با SchedulePublisher است)"""
     try:
-        now = datetime.now(timezone.utc).replace(tzinfo=None)
-        posts = list(scheduled_posts.find({"scheduled_time": {"$lte": now}}))
+        await schedule_publisher.sync()
     except Exception as e:
-        print("DB unavailable:", e); return
+        print("DB unavailable:", e)
 
-    for post in posts:
-        film = films_col.find_one({"film_id": post["film_id"]})
-        if not film:
-            scheduled_posts.delete_one({"_id": post["_id"]}); continue
-        caption = compose_channel_caption(film)
+# ---------------------- 📊 Reactions و آمار زیر پست ----------------------
+# ویرایش کیبورد پست کانالی از طریق یک صف رندر برای هر (channel_id, message_id):
+# درخواست‌های پشت‌سرهم در یک رندر ادغام می‌شوند، حداکثر هر RENDER_DEBOUNCE ثانیه یک edit،
+# و اگر کیبورد جدید دقیقاً مثل آخرین کیبورد ارسالی باشد edit انجام نمی‌شود.
+RENDER_DEBOUNCE = _get_env_int("RENDER_DEBOUNCE", required=False, default=3)
+
+def _markup_signature(kb: InlineKeyboardMarkup) -> tuple:
+    """امضای قابل مقایسه‌ی یک کیبورد (متن/callback/url دکمه‌ها)"""
+    return tuple(tuple((b.text, b.callback_data, b.url) for b in row) for row in kb.inline_keyboard)
+
+class KeyboardRenderer:
+    """صف رندر debounce‌شده برای کیبورد آمار/ری‌اکشن پست‌های کانال"""
+    def __init__(self, interval: int):
+        self.interval = interval
+        self.latest: dict[tuple, tuple] = {}            # key → (film_id, views|None) آخرین وضعیت درخواستی
+        self.timers: dict[tuple, asyncio.Task] = {}
+        self.sent = TTLCache(50_000)                     # key → (امضای آخرین edit موفق، زمان آخرین تلاش)
+        self.skipped = 0; self.edits = 0
+
+    def request(self, film_id: str, channel_id: int, message_id: int, views: int | None = None):
+        """درخواست رندر؛ اگر رندری در صف باشد فقط وضعیت آخر جایگزین می‌شود"""
+        key = (channel_id, message_id)
+        self.latest[key] = (film_id, views)
+        if key in self.timers:
+            return
+        prev = self.sent.get(key, None)
+        wait = max(0.0, prev[1] + self.interval - time.monotonic()) if prev else 0.0
+        self.timers[key] = asyncio.create_task(self._render_later(key, wait))
+
+    async def render(self, film_id: str, channel_id: int, message_id: int, views: int, st: dict | None = None):
+        """رندر فوری (برای جاب رفرش)؛ اگر رندری در صف باشد فقط وضعیتش به‌روز می‌شود"""
+        key = (channel_id, message_id)
+        if key in self.timers:
+            self.latest[key] = (film_id, views); return
+        await self._render(key, film_id, views, st)
+
+    async def _render_later(self, key: tuple, wait: float):
+        await asyncio.sleep(wait)
+        self.timers.pop(key, None)
+        film_id, views = self.latest.pop(key)
+        await self._render(key, film_id, views)
+
+    @api_priority(PRIO_BACKGROUND)
+    async def _render(self, key: tuple, film_id: str, views: int | None, st: dict | None = None):
+        channel_id, message_id = key
+        prev = self.sent.get(key, None)
         try:
-            if film.get("cover_id"):
-                sent = await bot.send_photo(post["channel_id"], film["cover_id"], caption=caption,
-                                            reply_markup=_reaction_keyboard(film["film_id"], post["channel_id"], 0))
-            else:
-                sent = await bot.send_message(post["channel_id"], caption,
-                                              reply_markup=_reaction_keyboard(film["film_id"], post["channel_id"], 0))
-            post_refs.update_one({"film_id": film["film_id"], "channel_id": post["channel_id"]}, {"$set": {"message_id": sent.id}}, upsert=True)
-            try:
-                fresh = await bot.get_messages(post["channel_id"], sent.id)
-                await bot.edit_message_reply_markup(
-                    chat_id=post["channel_id"], message_id=sent.id,
-                    reply_markup=_reaction_keyboard(film["film_id"], post["channel_id"], sent.id, views=fresh.views or 0)
-                )
-            except Exception:
-                pass
+            if views is None:
+                msg = await bot.get_messages(channel_id, message_id); views = int(msg.views or 0)
+            kb = await _reaction_keyboard(film_id, channel_id, message_id, views=views, st=st)
+            sig = _markup_signature(kb)
+            if prev and prev[0] == sig:
+                self.skipped += 1; return
+            # زمان تلاش جدا از امضا ثبت می‌شود: debounce بعد از شکست هم برقرار است، ولی امضا فقط بعد از edit موفق
+            self.sent.set(key, (prev[0] if prev else None, time.monotonic()), 6 * 3600)
+            await bot.edit_message_reply_markup(chat_id=channel_id, message_id=message_id, reply_markup=kb)
+            self.sent.set(key, (sig, time.monotonic()), 6 * 3600)
+            self.edits += 1
+        except MessageNotModified:
+            self.sent.set(key, (sig, time.monotonic()), 6 * 3600)
+            self.skipped += 1
+        except ApiDropped as e:
+            # صف کانال شلوغ است: رندر با آخرین وضعیت بعداً تکرار می‌شود
+            self.latest.setdefault(key, (film_id, None))
+            if key not in self.timers:
+                self.timers[key] = asyncio.create_task(self._render_later(key, e.retry_after))
         except Exception as e:
-            print("❌ scheduled send error:", e)
-        scheduled_posts.delete_one({"_id": post["_id"]})
+            print("⚠️ keyboard render error:", e)
 
-# ---------------------- 📊 Reactions و آمار زیر پست ----------------------
-@bot.on_callback_query(filters.regex(r"^react::(.+)::(-?\d+)::(\d+)$"))
-async def react_cb(client: Client, cq: CallbackQuery):
+    def summary(self) -> str:
+        return f"edit {self.edits} • skip {self.skipped} • در صف {len(self.timers)}"
+
+keyboard_renderer = KeyboardRenderer(RENDER_DEBOUNCE)
+
+@callbacks.route("react", admin=False)
+async def react_cb(client: Client, cq: CallbackQuery, reaction: Reaction, channel_id: int, message_id: int):
     """ثبت واکنش کاربر (یک واکنش برای هر فیلم) و رفرش کیبورد"""
-    reaction = cq.matches[0].group(1); channel_id = int(cq.matches[0].group(2)); message_id = int(cq.matches[0].group(3))
-    film_doc = post_refs.find_one({"channel_id": channel_id, "message_id": message_id})
+    film_doc = await refs_repo.find_one({"channel_id": channel_id, "message_id": message_id})
     film_id = film_doc.get("film_id") if film_doc else None
     if not film_id: return await cq.answer("❌ خطا در شناسایی فیلم", show_alert=True)
 
-    old = reactions_col.find_one({"film_id": film_id, "user_id": cq.from_user.id})
+    # یک upsert اتمیک با سند قبلی: دو لمس سریع (یا روی دو Worker) شمارنده را دوبار جابه‌جا نمی‌کنند
+    key = {"film_id": film_id, "user_id": cq.from_user.id}
+    for _ in range(2):
+        try:
+            old = await reactions_repo.find_one_and_update(key, {"$set": {"reaction": reaction}}, upsert=True,
+                                                           return_document=ReturnDocument.BEFORE)
+            break
+        except DuplicateKeyError:
+            continue                                         # upsert هم‌زمان دیگری سند را ساخت؛ این بار update می‌شود
+    else:
+        return await cq.answer("⚠️ دوباره امتحان کن.", show_alert=True)
     if old and old["reaction"] == reaction:
         return await cq.answer("⛔️ قبلاً همین واکنش را دادی.", show_alert=True)
-    elif old:
-        stats_col.update_one({"film_id": film_id}, {"$inc": {f"reactions.{old['reaction']}": -1}})
-        reactions_col.update_one({"_id": old["_id"]}, {"$set": {"reaction": reaction}})
-    else:
-        reactions_col.insert_one({"film_id": film_id, "user_id": cq.from_user.id, "reaction": reaction})
-    stats_col.update_one({"film_id": film_id}, {"$inc": {f"reactions.{reaction}": 1}}, upsert=True)
+    if old:
+        stats_buffer.incr(film_id, f"reactions.{old['reaction']}", -1, channel_id=channel_id)
+    stats_buffer.incr(film_id, f"reactions.{reaction}", channel_id=channel_id)
 
-    try:
-        msg = await client.get_messages(channel_id, message_id); views = int(msg.views or 0)
-        await client.edit_message_reply_markup(chat_id=channel_id, message_id=message_id,
-                                               reply_markup=_reaction_keyboard(film_id, channel_id, message_id, views=views))
-    except Exception:
-        pass
+    keyboard_renderer.request(film_id, channel_id, message_id)
     await cq.answer("✅ ثبت شد.")
 
-@bot.on_callback_query(filters.regex(r"^sr::(-?\d+)::(\d+)$"))
-async def stat_refresh_cb(client: Client, cq: CallbackQuery):
+@callbacks.route("sr", admin=False)
+async def stat_refresh_cb(client: Client, cq: CallbackQuery, channel_id: int, message_id: int):
     """رفرش دستی آمار (👁/📥/🔁)"""
     await cq.answer()
-    channel_id = int(cq.matches[0].group(1)); message_id = int(cq.matches[0].group(2))
-    film_doc = post_refs.find_one({"channel_id": channel_id, "message_id": message_id})
+    film_doc = await refs_repo.find_one({"channel_id": channel_id, "message_id": message_id})
     film_id = film_doc.get("film_id") if film_doc else None
-    views = 0
-    try:
-        msg = await client.get_messages(channel_id, message_id); views = int(msg.views or 0)
-    except Exception:
-        pass
     if film_id:
-        try:
-            await client.edit_message_reply_markup(chat_id=channel_id, message_id=message_id,
-                                                   reply_markup=_reaction_keyboard(film_id, channel_id, message_id, views=views))
-        except Exception:
-            pass
+        keyboard_renderer.request(film_id, channel_id, message_id)
 
-@bot.on_callback_query(filters.regex(r"^ss::(-?\d+)::(\d+)$"))
-async def stat_share_cb(client: Client, cq: CallbackQuery):
+@callbacks.route("ss", admin=False)
+async def stat_share_cb(client: Client, cq: CallbackQuery, channel_id: int, message_id: int):
     """افزایش شمارنده‌ی Share و رفرش سریع"""
     await cq.answer("🔁 شمارش اشتراک افزوده شد.", show_alert=False)
-    channel_id = int(cq.matches[0].group(1)); message_id = int(cq.matches[0].group(2))
-    film_doc = post_refs.find_one({"channel_id": channel_id, "message_id": message_id})
+    film_doc = await refs_repo.find_one({"channel_id": channel_id, "message_id": message_id})
     film_id = film_doc.get("film_id") if film_doc else None
     if not film_id: return
-    stats_col.update_one({"film_id": film_id}, {"$inc": {"shares": 1}}, upsert=True)
-    try:
-        msg = await client.get_messages(channel_id, message_id); views = int(msg.views or 0)
-        await client.edit_message_reply_markup(chat_id=channel_id, message_id=message_id,
-                                               reply_markup=_reaction_keyboard(film_id, channel_id, message_id, views=views))
-    except Exception:
-        pass
+    stats_buffer.incr(film_id, "shares", channel_id=channel_id)
+    keyboard_renderer.request(film_id, channel_id, message_id)
     try:
         await client.send_message(cq.from_user.id, f"✨ این لینک را برای دوستانت بفرست:\nhttps://t.me/{BOT_USERNAME}?start={film_id}")
     except Exception:
         pass
 
-# ---------------------- 🔄 Auto Refresh Stats (هر ۵ دقیقه) ----------------------
-async def refresh_all_stats():
-    """هر ۵ دقیقه: تمام پست‌های ثبت‌شده در post_refs را رفرش می‌کند"""
-    try:
-        refs = list(post_refs.find())
-        for ref in refs:
-            film_id = ref["film_id"]; channel_id = ref["channel_id"]; message_id = ref.get("message_id")
-            if not message_id: continue
+# ---------------------- 🔄 Auto Refresh Stats (طبقه‌بندی hot/warm/cold) ----------------------
+# پست‌ها بر اساس سن و فعالیت اخیر (دانلود/اشتراک/واکنش) در سه طبقه قرار می‌گیرند؛
+# هر طبقه بازه‌ی رفرش و سقف فراخوانی API در دقیقه‌ی خودش را دارد تا بودجه خرج پست‌هایی شود که ویوشان تکان می‌خورد.
+VIEWS_BATCH = 100    # سقف message_id در هر get_messages
+REFRESH_TIERS = [    # (نام، بازه‌ی رفرش به ثانیه، بودجه‌ی API در دقیقه)
+    ("hot",  60,        _get_env_int("REFRESH_BUDGET_HOT",  required=False, default=60)),
+    ("warm", 15 * 60,   _get_env_int("REFRESH_BUDGET_WARM", required=False, default=30)),
+    ("cold", 6 * 3600,  _get_env_int("REFRESH_BUDGET_COLD", required=False, default=10)),
+]
+_TIER_INTERVAL = {name: interval for name, interval, _ in REFRESH_TIERS}
+_refresh_lock = asyncio.Lock()
+
+def _tier_for(ref: dict, st: dict, now: datetime) -> str:
+    """تعیین طبقه‌ی یک پست: تازه یا پرفعالیت → hot، متوسط → warm، بقیه → cold"""
+    posted = ref.get("posted_at") or ref["_id"].generation_time.replace(tzinfo=None)
+    active = now if stats_buffer.delta(ref["film_id"]) else st.get("last_activity")
+    age = now - posted
+    idle = (now - active) if active else None
+    if age < timedelta(days=1) or (idle is not None and idle < timedelta(hours=1)):
+        return "hot"
+    if age < timedelta(days=7) or (idle is not None and idle < timedelta(days=1)):
+        return "warm"
+    return "cold"
+
+async def refresh_refs(refs: list[dict]) -> int:
+    """ویوهای یک دسته پست: یک get_messages برای هر ≤۱۰۰ پست هر کانال، snapshot ویو + طبقه/سررسید بعدی، رندر فقط در صورت تغییر.
+    خروجی: تعداد فراخوانی‌های API"""
+    stats = await get_stats_many(r["film_id"] for r in refs)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    by_channel: dict[int, list[dict]] = {}
+    for r in refs:
+        by_channel.setdefault(r["channel_id"], []).append(r)
+    updates, calls = [], 0
+    for channel_id, items in by_channel.items():
+        for i in range(0, len(items), VIEWS_BATCH):
+            chunk = items[i:i + VIEWS_BATCH]
+            views = {}
             try:
-                msg = await bot.get_messages(channel_id, message_id); views = int(msg.views or 0)
-                await bot.edit_message_reply_markup(chat_id=channel_id, message_id=message_id,
-                                                    reply_markup=_reaction_keyboard(film_id, channel_id, message_id, views=views))
+                calls += 1
+                msgs = await bot.get_messages(channel_id, [r["message_id"] for r in chunk])
+                views = {m.id: int(m.views or 0) for m in msgs if m and not getattr(m, "empty", False)}
+            except FloodWait as e:
+                print(f"⏳ refresh FloodWait {e.value}s"); await asyncio.sleep(e.value)
             except Exception as e:
                 print("⚠️ refresh error:", e)
-    except Exception as e:
-        print("❌ DB error in refresh_all_stats:", e)
+            for r in chunk:
+                st = stats.get(r["film_id"], {})
+                tier = _tier_for(r, st, now)
+                upd = {"tier": tier, "next_refresh_at": now + timedelta(seconds=_TIER_INTERVAL[tier])}
+                v = views.get(r["message_id"])
+                if v is not None:
+                    if v != r.get("views"):
+                        upd.update(views=v, views_at=now)
+                    before = keyboard_renderer.edits
+                    await keyboard_renderer.render(r["film_id"], channel_id, r["message_id"], v, st=st)
+                    calls += keyboard_renderer.edits - before
+                updates.append(UpdateOne({"_id": r["_id"]}, {"$set": upd}))
+    if updates:
+        await refs_repo.bulk_write(updates, ordered=False)
+    return calls
+
+@leader_only
+@api_priority(PRIO_BACKGROUND)
+async def refresh_all_stats():
+    """هر دقیقه: پست‌های سررسیدِ هر طبقه را تا سقف بودجه‌ی API همان طبقه رفرش می‌کند (بدون اجرای هم‌پوشان)"""
+    if _refresh_lock.locked():
+        print("⏭ refresh_all_stats still running; tick skipped"); return
+    async with _refresh_lock:
+        try:
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            for name, _, budget in REFRESH_TIERS:
+                # پست بدون طبقه (قدیمی‌ها قبل از طبقه‌بندی) اول hot حساب می‌شود
+                flt = {"tier": {"$in": [name, None]} if name == "hot" else name,
+                       "message_id": {"$gt": 0},
+                       "next_refresh_at": {"$not": {"$gt": now}}}
+                spent = 0
+                while spent < budget:
+                    refs = await refs_repo.find_list(flt, sort=[("next_refresh_at", 1)], limit=budget - spent)
+                    if not refs:
+                        break
+                    spent += await refresh_refs(refs)
+        except Exception as e:
+            print("❌ DB error in refresh_all_stats:", e)
+
+# ---------------------- 🧬 حذف پست‌های تکراری منبع‌ها ----------------------
+# هر پست ورودی با کلیدهای f:<file_unique_id> (هر فایل) و c:<هش کپشن نرمال> شناسایی می‌شود؛ کپشن بدون
+# لینک/منشن/هشتگ و فقط اگر حداقل DEDUP_MIN_TOKENS کلمه داشته باشد (کپشن‌های کوتاه عمومی تکراری حساب نشوند).
+# مسیر داغ: LRU درون‌حافظه؛ پشت آن source_fingerprints در Mongo (با TTL) که ثبت کلیدها در آن اتمیک است
+# تا دو کپی هم‌زمان از دو کانال هر دو رد نشوند. پیش از هر نوشتن/انتشاری چک می‌شود.
+DEDUP_DAYS       = _get_env_int("DEDUP_DAYS", required=False, default=90)
+DEDUP_MIN_TOKENS = _get_env_int("DEDUP_MIN_TOKENS", required=False, default=3)
+dedup_cache = TTLCache(20000)            # کلید اثرانگشت → True
+dedup_suppressed: dict[str, int] = {}    # source → تعداد تکراری‌های ردشده از استارت
+_CAPTION_NOISE = re.compile(r"https?://\S+|t\.me/\S+|[@#]\w+")
+
+def source_fingerprints(messages: list[Message], caption: str) -> list[str]:
+    """کلیدهای اثرانگشت یک پست (تکی/آلبوم)"""
+    keys = []
+    for m in messages:
+        media = m.video or m.document or m.audio
+        if media and getattr(media, "file_unique_id", None):
+            keys.append(f"f:{media.file_unique_id}")
+    words = search_tokens(_CAPTION_NOISE.sub(" ", caption or ""))
+    if len(words) >= DEDUP_MIN_TOKENS:
+        keys.append("c:" + hashlib.sha1(" ".join(words).encode()).hexdigest()[:20])
+    return keys
+
+async def claim_source_post(keys: list[str], source: str) -> bool:
+    """True اگر پست جدید است (و کلیدهایش ثبت شد)؛ False اگر تکراری است"""
+    if not keys:
+        return True
+    dup = any(dedup_cache.get(k, False) for k in keys)
+    if not dup:
+        expire = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=DEDUP_DAYS)
+        try:
+            await fps_repo.insert_many([{"_id": k, "source": source, "expire_at": expire} for k in keys], ordered=False)
+        except BulkWriteError as e:
+            dup = any(err.get("code") == 11000 for err in e.details.get("writeErrors", []))
+            if not dup:
+                print("⚠️ dedup claim error:", e)
+    for k in keys:
+        dedup_cache.set(k, True, 3600)
+    if dup:
+        dedup_suppressed[source] = dedup_suppressed.get(source, 0) + 1
+        await counters_repo.update_one({"_id": f"dedup:{source}"}, {"$inc": {"suppressed": 1}}, upsert=True)
+    return not dup
+
+async def release_source_post(keys: list[str]):
+    """آزاد کردن کلیدها وقتی ثبت پست شکست خورد تا ارسال دوباره‌ی همان پست رد نشود"""
+    for k in keys:
+        dedup_cache.pop(k)
+    if keys:
+        try:
+            await fps_repo.delete_many({"_id": {"$in": keys}})
+        except Exception as e:
+            print("⚠️ dedup release error:", e)
+
+def dedup_summary() -> str:
+    top = sorted(dedup_suppressed.items(), key=lambda kv: -kv[1])[:5]
+    return f"{sum(dedup_suppressed.values())} رد شده" + ("".join(f" • @{k}: {v}" for k, v in top) if top else "")
 
 # ---------------------- 🧭 UserBot: شنود کانال‌های منبع و انتشار خودکار ----------------------
+# پیام‌های یک آلبوم (media_group_id مشترک) تا ALBUM_WINDOW_MS بعد از آخرین عضو جمع می‌شوند و یکجا
+# به‌عنوان یک فیلم با همه‌ی فایل‌ها ثبت/منتشر می‌شوند. حداکثر ALBUM_MAX_PENDING آلبوم نیمه‌کاره در حافظه
+# می‌ماند؛ با پر شدن، قدیمی‌ترین همان‌طور که هست ثبت می‌شود. آلبوم کامل (۱۰ عضو) بی‌درنگ ثبت می‌شود.
+ALBUM_WINDOW_MS   = _get_env_int("ALBUM_WINDOW_MS", required=False, default=1500)
+ALBUM_MAX_PENDING = _get_env_int("ALBUM_MAX_PENDING", required=False, default=100)
+
+class AlbumAggregator:
+    """بافر پیام‌ها بر اساس media_group_id با پنجره‌ی debounce و سقف تعداد آلبوم‌های باز"""
+    def __init__(self, window_ms: int, max_pending: int, handler):
+        self.window = window_ms / 1000
+        self.max_pending = max_pending
+        self.handler = handler                               # async handler(list[Message])
+        self.groups: OrderedDict[str, list[Message]] = OrderedDict()
+        self.timers: dict[str, asyncio.Task] = {}
+
+    def add(self, message: Message):
+        gid = message.media_group_id
+        self.groups.setdefault(gid, []).append(message)
+        if (t := self.timers.pop(gid, None)):
+            t.cancel()
+        if len(self.groups[gid]) >= ALBUM_SIZE:
+            return self._flush(gid)
+        self.timers[gid] = asyncio.create_task(self._flush_later(gid))
+        while len(self.groups) > self.max_pending:          # بیرون انداختن قدیمی‌ترین آلبوم نیمه‌کاره
+            self._flush(next(iter(self.groups)))
+
+    async def _flush_later(self, gid: str):
+        await asyncio.sleep(self.window)
+        self.timers.pop(gid, None)
+        self._flush(gid)
+
+    def _flush(self, gid: str):
+        msgs = self.groups.pop(gid, None)
+        if (t := self.timers.pop(gid, None)):
+            t.cancel()
+        if msgs:
+            asyncio.create_task(self.handler(sorted(msgs, key=lambda m: m.id)))
+
+def _source_file(message: Message, caption: str) -> dict | None:
+    media = message.video or message.document or message.audio
+    return {"file_id": media.file_id, "caption": caption, "quality": ""} if media else None
+
 @user.on_message(filters.chat(SOURCE_CHANNELS))
 async def catch_source_posts(client: Client, message: Message):
-    """هر پست جدید از کانال‌های منبع: خواندن، ویرایش کپشن، تشخیص مقصد، ذخیره در DB، ارسال خودکار یا Pending"""
+    """هر پست جدید از کانال‌های منبع: پیام تکی مستقیم، اعضای آلبوم از طریق AlbumAggregator"""
+    if message.media_group_id:
+        album_aggregator.add(message)
+    else:
+        await ingest_source_post([message])
+
+@api_priority(PRIO_BACKGROUND)
+async def ingest_source_post(messages: list[Message]):
+    """ثبت یک پست منبع (تکی یا آلبوم): خواندن، ویرایش کپشن، تشخیص مقصد، ذخیره در DB، ارسال خودکار یا Pending"""
+    keys = []
     try:
+        message = messages[0]
         source_username = message.chat.username or ""
-        raw_caption = message.caption or message.text or ""
+        raw_caption = next((m.caption or m.text for m in messages if m.caption or m.text), "")
+        keys = source_fingerprints(messages, raw_caption)
+        if not await claim_source_post(keys, source_username):
+            keys = []
+            print(f"♻️ Duplicate source post skipped (@{source_username})")
+            return
         title = (raw_caption.split("\n")[0] if raw_caption else "بدون عنوان")[:80]
-        film_id = slugify(title)
+        film_id = await allocate_film_id(title)
 
         # آماده‌سازی سند فیلم برای DB
         base_doc = {
@@ -1081,20 +3049,16 @@ async def catch_source_posts(client: Client, message: Message):
             "title": title,
             "genre": "",
             "year": "",
-            "cover_id": message.photo.file_id if message.photo else None,
+            "cover_id": next((m.photo.file_id for m in messages if m.photo), None),
             "timestamp": datetime.now(timezone.utc).replace(tzinfo=None),
             "files": []
         }
         # اگر مدیا دارد (ویدیو/سند/صوت) ثبت کن تا بعداً از DeepLink قابل دریافت باشد
-        if message.video:
-            base_doc["files"].append({"film_id": film_id, "file_id": message.video.file_id, "caption": raw_caption, "quality": ""})
-        elif message.document:
-            base_doc["files"].append({"film_id": film_id, "file_id": message.document.file_id, "caption": raw_caption, "quality": ""})
-        elif message.audio:
-            base_doc["files"].append({"film_id": film_id, "file_id": message.audio.file_id, "caption": raw_caption, "quality": ""})
-
-        films_col.update_one({"film_id": film_id}, {"$set": base_doc}, upsert=True)
+        for m in messages:
+            if (f := _source_file(m, m.caption or raw_caption)):
+                base_doc["files"].append({"film_id": film_id, **f})
 
+        film_id = await insert_film(base_doc)
         # کپشن جدید با امضاء
         new_caption = format_source_footer(raw_caption, source_username)
 
@@ -1111,16 +3075,16 @@ async def catch_source_posts(client: Client, message: Message):
             preview_caption = compose_channel_caption(base_doc)
             if base_doc.get("cover_id"):
                 sent = await bot.send_photo(dest, base_doc["cover_id"], caption=preview_caption,
-                                            reply_markup=_reaction_keyboard(film_id, dest, 0))
+                                            reply_markup=await _reaction_keyboard(film_id, dest, 0))
             else:
                 sent = await bot.send_message(dest, preview_caption,
-                                              reply_markup=_reaction_keyboard(film_id, dest, 0))
+                                              reply_markup=await _reaction_keyboard(film_id, dest, 0))
             # ثبت مرجع پیام برای آمار
-            post_refs.update_one({"film_id": film_id, "channel_id": dest}, {"$set": {"message_id": sent.id}}, upsert=True)
+            await save_post_ref(film_id, dest, sent.id)
             status = f"published → {dest}"
         else:
             # اگر مقصد نامشخص بود یا AUTO_PUBLISH خاموش بود → Pending برای تایید دستی
-            pending_posts.insert_one({
+            await pending_repo.insert_one({
                 "film_id": film_id, "title": title, "source": source_username,
                 "timestamp": datetime.now(timezone.utc).replace(tzinfo=None)
             })
@@ -1136,16 +3100,22 @@ async def catch_source_posts(client: Client, message: Message):
             "film_id": film_id, "title": title, "source": source_username,
             "status": status, "time": datetime.now().isoformat()
         })
-        print(f"📥 Source post saved: {film_id} ({status})")
+        print(f"📥 Source post saved: {film_id} ({status}, {len(messages)} msg)")
 
     except Exception as e:
-        print("❌ error in catch_source_posts:", e)
+        print("❌ error in ingest_source_post:", e)
         traceback.print_exc()
+        await release_source_post(keys)
+
+album_aggregator = AlbumAggregator(ALBUM_WINDOW_MS, ALBUM_MAX_PENDING, ingest_source_post)
 
 # ---------------------- 🗓 گزارش روزانه ساعت 22:00 ----------------------
+@leader_only
+@api_priority(PRIO_BACKGROUND)
 async def daily_report():
     """هر شب بر اساس TIMEZONE گزارش روزانه برای ادمین‌ها می‌فرستد"""
     try:
+        t0 = time.perf_counter()
         now_local = datetime.now(ZoneInfo(TIMEZONE))
         start_local = datetime(now_local.year, now_local.month, now_local.day, 0, 0, 0, tzinfo=ZoneInfo(TIMEZONE))
         end_local   = start_local + timedelta(days=1) - timedelta(seconds=1)
@@ -1154,42 +3124,49 @@ async def daily_report():
         start_utc_naive = start_local.astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
         end_utc_naive   = end_local.astimezone(ZoneInfo("UTC")).replace(tzinfo=None)
 
+        await stats_buffer.flush()   # شمارنده‌های بافر قبل از جمع‌بندی نوشته شوند
+
         # تعداد آیتم‌های امروز
-        films_today = films_col.count_documents({"timestamp": {"$gte": start_utc_naive, "$lte": end_utc_naive}})
-
-        # آمار کلی (از stats_col + post_refs برای ویو)
-        total_downloads = 0; total_shares = 0
-        total_reacts = {"love":0, "like":0, "dislike":0, "sad":0}
-        top_post = None; top_views = 0
-
-        for st in stats_col.find():
-            film_id = st["film_id"]
-            total_downloads += int(st.get("downloads",0))
-            total_shares += int(st.get("shares",0))
-            recs = st.get("reactions", {})
-            for k in total_reacts:
-                total_reacts[k] += int(recs.get(k,0))
-            # آخرین ویو را از پیام کانالی بخوان
-            ref = post_refs.find_one({"film_id": film_id})
-            if ref:
-                try:
-                    msg = await bot.get_messages(ref["channel_id"], ref["message_id"])
-                    v = int(msg.views or 0)
-                    if v > top_views:
-                        top_views = v; top_post = film_id
-                except Exception:
-                    pass
+        films_today = await films_repo.count_documents({"timestamp": {"$gte": start_utc_naive, "$lte": end_utc_naive}})
+
+        # آمار کلی با یک aggregation روی stats_col
+        agg = await stats_repo.aggregate_list([{"$group": {
+            "_id": None,
+            "downloads": {"$sum": "$downloads"}, "shares": {"$sum": "$shares"},
+            "love": {"$sum": "$reactions.love"}, "like": {"$sum": "$reactions.like"},
+            "dislike": {"$sum": "$reactions.dislike"}, "sad": {"$sum": "$reactions.sad"},
+        }}])
+        totals = agg[0] if agg else {}
+        total_downloads = int(totals.get("downloads", 0)); total_shares = int(totals.get("shares", 0))
+        total_reacts = {k: int(totals.get(k, 0)) for k in ("love", "like", "dislike", "sad")}
+
+        # پربازدیدترین پست از snapshot ویوها (که جاب رفرش در post_refs نگه می‌دارد)
+        top = await refs_repo.find_list({"views": {"$gt": 0}}, {"_id": 0, "film_id": 1, "views": 1},
+                                        sort=[("views", DESC)], limit=1)
+        top_post = top[0]["film_id"] if top else None; top_views = top[0]["views"] if top else 0
+
+        # آمار خودِ امروز از سطل‌های ساعتی
+        today = await window_totals(start_utc_naive, end_utc_naive)
 
         text = (
             f"📊 گزارش روزانه — {now_local.strftime('%Y-%m-%d')}\n\n"
             f"🎬 موارد جدید: {films_today}\n"
-            f"📥 دانلودها: {total_downloads}\n"
-            f"🔁 اشتراک‌گذاری‌ها: {total_shares}\n"
+            f"📥 دانلود امروز: {today.get('downloads', 0)} | 🔁 اشتراک امروز: {today.get('shares', 0)} | 💬 واکنش امروز: {today.get('reactions', 0)}\n\n"
+            f"📥 کل دانلودها: {total_downloads}\n"
+            f"🔁 کل اشتراک‌گذاری‌ها: {total_shares}\n"
             f"❤️ {total_reacts['love']} | 👍 {total_reacts['like']} | 👎 {total_reacts['dislike']} | 😢 {total_reacts['sad']}\n"
         )
         if top_post:
             text += f"\n👑 پربازدیدترین: {top_post} ({top_views} 👁)\n"
 
+        # زمان تولید گزارش ثبت می‌شود تا ثابت ماندنش با رشد کاتالوگ قابل پیگیری باشد
+        gen_ms = int((time.perf_counter() - t0) * 1000)
+        text += f"\n⏱ تولید گزارش: {gen_ms} ms"
+        await report_runs_repo.insert_one({
+            "date": now_local.strftime("%Y-%m-%d"), "generation_ms": gen_ms,
+            "created_at": datetime.now(timezone.utc).replace(tzinfo=None)
+        })
+
         for admin_id in ADMIN_IDS:
             try:
                 await bot.send_message(admin_id, text)
@@ -1201,10 +3178,12 @@ async def daily_report():
         print("❌ daily_report error:", e)
 
 # ---------------------- 💾 بکاپ هفتگی CSV و ارسال به ادمین ----------------------
+@leader_only
+@api_priority(PRIO_BACKGROUND)
 async def weekly_backup():
     """هر هفته: خروجی CSV از films و ارسال برای ادمین‌ها"""
     try:
-        films = list(films_col.find().sort("timestamp", -1))
+        films = await films_repo.find_list(sort=[("timestamp", -1)])
         buf = io.StringIO(); w = csv.writer(buf)
         w.writerow(["film_id","title","genre","year","files_count","timestamp"])
         for f in films:
@@ -1234,28 +3213,63 @@ async def main():
     # اطمینان از خاموش بودن وبهوک (برای polling)
     try:
         import urllib.request
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/deleteWebhook?drop_pending_updates=true"
+        drop = "true" if WORKER_COUNT == 1 else "false"   # با چند Worker، ری‌استارت یکی نباید صف بقیه را خالی کند
+        url = f"https://api.telegram.org/bot{BOT_TOKEN}/deleteWebhook?drop_pending_updates={drop}"
         with urllib.request.urlopen(url, timeout=10) as r:
             print(f"🧹 Webhook delete HTTP status: {r.status}")
     except Exception as e:
         print("⚠️ deleteWebhook error:", e)
 
-    # استارت Bot و UserBot
+    # استارت Bot؛ UserBot فقط روی رهبر (LeaderLease خودش start/stop می‌کند)
     await bot.start()
-    await user.start()
-
-    me = await bot.get_me(); print(f"🤖 Bot @{me.username} started")
-    me2 = await user.get_me(); print(f"👤 Userbot {me2.id} started")
+    me = await bot.get_me(); print(f"🤖 Bot @{me.username} started (worker {WORKER_INDEX + 1}/{WORKER_COUNT}, {WORKER_ID})")
+    await leader.start()
+
+    asyncio.create_task(ensure_indexes())                              # ساخت ایندکس‌ها در پس‌زمینه
+    await load_member_index()                                          # ایندکس عضویت از Mongo
+    await warm_film_cache()                                            # کش پردانلودترین فیلم‌ها
+    await film_index.rebuild()                                         # ایندکس جست‌وجوی فارسی
+    await delete_wheel.restore(); delete_wheel.start()                 # حذف‌های معوق + تایمر حذف
+    stats_buffer.start()                                               # flush دوره‌ای شمارنده‌ها
+    await send_scheduled_posts(); schedule_publisher.start()           # تایمر دقیق انتشارهای زمان‌بندی‌شده (sync فقط روی رهبر)
+    await source_log.start()                                           # نویسنده‌ی لاگ منبع‌ها
 
     # جاب‌ها:
-    scheduler.add_job(send_scheduled_posts, "interval", minutes=1)     # چک صف زمان‌بندی
-    scheduler.add_job(refresh_all_stats, "interval", minutes=5)        # رفرش آمار زیر پست
+    scheduler.add_job(send_scheduled_posts, "interval", minutes=1)     # همگام‌سازی صف زمان‌بندی با Mongo
+    scheduler.add_job(refresh_all_stats, "interval", minutes=1)        # رفرش طبقه‌بندی‌شده‌ی آمار زیر پست
+    scheduler.add_job(reconcile_member_index, "interval", minutes=10, max_instances=1)  # ترمیم ایندکس عضویت
+    if WORKER_COUNT > 1:                                               # تک Worker: ایندکس‌های محلی خودشان مرجع‌اند
+        scheduler.add_job(sync_worker_views, "interval", seconds=INDEX_SYNC_S, max_instances=1)  # همگام‌سازی ایندکس‌های درون‌حافظه
     scheduler.add_job(daily_report, "cron", hour=22, minute=0)         # گزارش روزانه ساعت 22:00 (TIMEZONE)
     scheduler.add_job(weekly_backup, "cron", day_of_week="sun", hour=3, minute=0)  # بکاپ هفتگی یکشنبه 03:00
 
     scheduler.start(); print("📅 Scheduler started!")
     await idle()  # برنامه را زنده نگه‌دار
 
+    # خاموشی عادی: شمارنده‌ها و لاگ بافرشده را قبل از خروج بنویس
+    await stats_buffer.flush()
+    await source_log.flush()
+    scheduler.shutdown(wait=False)
+    await leader.release()                                             # توقف UserBot + آزادسازی رهبری
+    await bot.stop()
+
 if __name__ == "__main__":
+    # python bot.py --audit-indexes → ساخت ایندکس‌ها + گزارش explain بدون اجرای ربات
+    if "--audit-indexes" in sys.argv:
+        _ensure_indexes_sync()
+        print("\n".join(audit_query_shapes()))
+        sys.exit(0)
+    # python bot.py --migrate-film-ids [--apply] → بدون --apply فقط نمایش تغییرات
+    if "--migrate-film-ids" in sys.argv:
+        print("\n".join(migrate_film_ids(apply="--apply" in sys.argv)))
+        sys.exit(0)
+    # python bot.py --source-log [source=x] [status=published] [since=2024-01-01] [until=2024-02-01]
+    if "--source-log" in sys.argv:
+        opts = dict(a.split("=", 1) for a in sys.argv[sys.argv.index("--source-log") + 1:] if "=" in a)
+        for e in read_source_log(opts.get("source"), opts.get("status"),
+                                 datetime.fromisoformat(opts["since"]) if "since" in opts else None,
+                                 datetime.fromisoformat(opts["until"]) if "until" in opts else None):
+            print(json.dumps(e, ensure_ascii=False))
+        sys.exit(0)
     # اجرای main داخل event-loop Pyrogram
     bot.run(main)